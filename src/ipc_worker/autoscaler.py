@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:55
+# @Author  : tk
+
+import math
+import threading
+import time
+from .utils import logger
+
+
+class Autoscaler(threading.Thread):
+    '''
+        resize the worker pool of an instance (IPC_shm / IPC_zmq with max_worker_num) every interval seconds from stats()
+        target_utilisation : busy time / wall time of the workers over the last interval , 0.7 keeps 30% headroom
+        target_queue_depth : requests queued or running per worker (sent and not answered , at least the input queue)
+        desired workers is the larger of both , clamped to [min_workers,max_workers] , no change within cooldown seconds of the last one ,
+        a smaller pool must be wanted for cooldown seconds before workers are removed
+    '''
+    def __init__(self, instance, min_workers=1, max_workers=None, target_queue_depth=None, target_utilisation=None,
+                 cooldown=30, interval=1, drain_timeout=None, name=None):
+        super(Autoscaler, self).__init__(name=name, daemon=True)
+        assert target_queue_depth is not None or target_utilisation is not None, \
+            'autoscaler needs target_queue_depth or target_utilisation'
+        assert 1 <= min_workers <= (max_workers or min_workers), 'bad min_workers / max_workers'
+        self._instance = instance
+        self.min_workers = min_workers
+        self.max_workers = max_workers or min_workers
+        self.target_queue_depth = target_queue_depth
+        self.target_utilisation = target_utilisation
+        self.cooldown = cooldown
+        self.interval = interval
+        self.drain_timeout = drain_timeout
+        self._evt_stop = threading.Event()
+        self._last_busy = None
+        self._last_change = 0
+        self._low_since = None
+
+    def _utilisation(self, workers, now):
+        # mean busy ratio since the last sample , workers new since then are left out
+        busy = {w['idx']: w['busy_us'] for w in workers}
+        last, self._last_busy = self._last_busy, (now, busy)
+        if last is None:
+            return None
+        t, last_busy = last
+        deltas = [busy[i] - last_busy[i] for i in busy if i in last_busy]
+        if not deltas or now <= t:
+            return None
+        return sum(deltas) / len(deltas) / ((now - t) * 1e6)
+
+    def desired(self, stats, now=None):
+        '''
+            worker count for stats , None when there is not enough to decide yet
+        '''
+        n = self._instance.worker_num
+        wanted = []
+        if self.target_utilisation is not None:
+            utilisation = self._utilisation(stats['workers'], time.time() if now is None else now)
+            if utilisation is not None:
+                wanted.append(math.ceil(n * utilisation / self.target_utilisation))
+        if self.target_queue_depth is not None:
+            queue = stats['queue']
+            # in flight : workers keep the input queue short , requests they hold count as demand too
+            depth = max(queue.get('input', 0), queue.get('requests', 0) - queue.get('unread', 0))
+            wanted.append(math.ceil(depth / self.target_queue_depth))
+        if not wanted:
+            return None
+        return min(max(max(wanted), self.min_workers), self.max_workers)
+
+    def step(self):
+        n = self._instance.worker_num
+        desired = self.desired(self._instance.stats())
+        now = time.time()
+        if desired is None or desired >= n:
+            self._low_since = None
+        elif self._low_since is None:
+            self._low_since = now
+        if desired is None or desired == n or now - self._last_change < self.cooldown:
+            return
+        if desired < n and now - self._low_since < self.cooldown:
+            return
+        logger.info('autoscale workers {} -> {}'.format(n, desired))
+        if desired > n:
+            self._instance.add_workers(desired - n)
+        else:
+            self._instance.remove_workers(n - desired, timeout=self.drain_timeout)
+        self._last_change = time.time()
+        self._low_since = None
+        # busy time of removed or added workers is not comparable with the last sample
+        self._last_busy = None
+
+    def run(self):
+        while not self._evt_stop.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                logger.error('autoscale except {}'.format(e))
+
+    def stop(self):
+        self._evt_stop.set()
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:20
+# @Author  : tk
+
+from .runner import BACKENDS, run_case, run_sweep, iter_cases, compare
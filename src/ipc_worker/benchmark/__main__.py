@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:40
+# @Author  : tk
+
+'''
+    throughput and latency of the backends over payload sizes and concurrency , results as json
+    python -m ipc_worker.benchmark run --backend shm,zmq --payload 64,64k,1m --threads 1,8 --call unary,stream -o new.json
+    python -m ipc_worker.benchmark run --backend shm_ring --payload 64 --wait-strategy spin,yield,block --idle-s 1 : latency against cpu time
+    python -m ipc_worker.benchmark compare old.json new.json [--threshold 0.1]
+'''
+
+import argparse
+import json
+import sys
+from .runner import BACKENDS, run_sweep, iter_cases, compare
+
+UNITS = {'b': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+def parse_size(s):
+    s = s.strip().lower()
+    if s and s[-1] in UNITS:
+        return int(float(s[:-1]) * UNITS[s[-1]])
+    return int(s)
+
+
+def size_list(s):
+    return [parse_size(x) for x in s.split(',')]
+
+
+def int_list(s):
+    return [int(x) for x in s.split(',')]
+
+
+def str_list(s):
+    return [x.strip() for x in s.split(',')]
+
+
+def cmd_run(args):
+    for backend in args.backend:
+        if backend not in BACKENDS:
+            raise SystemExit('unknown backend {} , one of {}'.format(backend, ','.join(BACKENDS)))
+    for call in args.call:
+        if call not in ('unary', 'stream'):
+            raise SystemExit('unknown call {} , unary or stream'.format(call))
+    for wait_strategy in args.wait_strategy:
+        if wait_strategy not in (None, 'spin', 'yield', 'block'):
+            raise SystemExit('unknown wait strategy {} , spin , yield or block'.format(wait_strategy))
+    cases = list(iter_cases(args.backend, args.payload, args.workers, args.managers, args.threads, args.call,
+                            args.wait_strategy))
+    report = run_sweep(cases, output=args.output,
+                       requests=args.requests, warmup=args.warmup, max_bytes=args.max_bytes,
+                       chunks=args.chunks, work_us=args.work_us, shm_size=args.shm_size,
+                       queue_size=args.queue_size, timeout=args.timeout, idle_s=args.idle_s)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+def cmd_compare(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    rows = compare(base, new, args.threshold)
+    n_regression = 0
+    for case, b_tp, n_tp, b_p99, n_p99, is_regression in rows:
+        n_regression += is_regression
+        print('{:<11} {:>9} w{} m{} t{:<3} {:<6}{} {:>9.0f} -> {:>9.0f} req/s ({:+.1%})  p99 {:.3f} -> {:.3f} ms{}'.format(
+            case['backend'], case['payload'], case['worker_num'], case['manager_num'], case['threads'], case['call'],
+            ' ' + case['wait_strategy'] if case['wait_strategy'] else '', b_tp, n_tp, n_tp / b_tp - 1 if b_tp else 0, b_p99, n_p99, '  REGRESSION' if is_regression else ''))
+    print('{} cases , {} regressions'.format(len(rows), n_regression))
+    return 1 if n_regression else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ipc_worker.benchmark')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='run a sweep , every combination of the lists below')
+    p.add_argument('--backend', type=str_list, default=['shm', 'zmq'], help=','.join(BACKENDS))
+    p.add_argument('--payload', type=size_list, default=size_list('64,1k,64k,1m'), help='bytes , 64,1k,64k,1m,64m')
+    p.add_argument('--workers', type=int_list, default=[1, 4], help='worker_num')
+    p.add_argument('--managers', type=int_list, default=[1], help='manager_num (shm)')
+    p.add_argument('--threads', type=int_list, default=[1, 8], help='client threads')
+    p.add_argument('--call', type=str_list, default=['unary'], help='unary,stream')
+    p.add_argument('--wait-strategy', type=str_list, default=[None], help='spin,yield,block (shm) , the instance default when omitted')
+    p.add_argument('--idle-s', type=float, default=0, help='also measure cpu time over this many idle seconds after each case')
+    p.add_argument('--requests', type=int, default=2000, help='timed requests per case')
+    p.add_argument('--warmup', type=int, default=50)
+    p.add_argument('--max-bytes', type=parse_size, default=parse_size('2g'), help='caps requests * payload per case')
+    p.add_argument('--chunks', type=int, default=8, help='stream chunks per request')
+    p.add_argument('--work-us', type=int, default=0, help='busy time of the worker per request')
+    p.add_argument('--shm-size', type=parse_size, default=parse_size('1m'))
+    p.add_argument('--queue-size', type=int, default=20)
+    p.add_argument('--timeout', type=float, default=60, help='seconds per request')
+    p.add_argument('-o', '--output', default=None, help='json file , stdout when omitted')
+    p.set_defaults(fn=cmd_run)
+
+    p = sub.add_parser('compare', help='compare two result files , exit 1 on a regression')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.1, help='relative drop of throughput or growth of p99')
+    p.set_defaults(fn=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.fn(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
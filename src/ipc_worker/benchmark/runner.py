@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:30
+# @Author  : tk
+
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from ..utils import logger
+from . import workers
+
+try:
+    # per process cpu time , /proc is read without it (linux)
+    import psutil
+except ImportError:
+    psutil = None
+
+# backend -> (worker class name , instance kwargs)
+BACKENDS = {
+    'shm': ('Bench_shm_worker', {}),
+    'shm_ring': ('Bench_shm_worker', {'slot_num': 8}),
+    'shm_shard': ('Bench_shm_worker', {'shard': True}),
+    'shm_ring_shard': ('Bench_shm_worker', {'slot_num': 8, 'shard': True}),
+    'zmq': ('Bench_zmq_worker', {}),
+    'zmq_router': ('Bench_zmq_worker', {'dispatch': 'router', 'prefetch': 4}),
+    'zmq_direct': ('Bench_zmq_worker', {'dispatch': 'router', 'prefetch': 4, 'direct': True}),
+}
+
+# a case is keyed by these , compare() matches results of two runs on them
+# wait_strategy : spin | yield | block of IPC_shm , None the instance default (and zmq)
+CASE_KEYS = ('backend', 'payload', 'worker_num', 'manager_num', 'threads', 'call', 'wait_strategy')
+
+# group names of the cases run by this process
+_case_ids = itertools.count()
+
+QUANTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+
+def percentiles(values):
+    '''
+        nearest rank percentiles of values (seconds) , in ms
+    '''
+    values = sorted(values)
+    d = {}
+    if not values:
+        return d
+    for name, q in QUANTILES:
+        d[name] = values[min(int(q * len(values)), len(values) - 1)] * 1000
+    d['mean'] = sum(values) / len(values) * 1000
+    d['max'] = values[-1] * 1000
+    return d
+
+
+def _create(backend, worker_num, manager_num, group_name, evt_quit, shm_size, queue_size, wait_strategy=None):
+    cls_name, kwargs = BACKENDS[backend]
+    if wait_strategy is not None:
+        kwargs = dict(kwargs, wait_strategy=wait_strategy)
+    CLS_worker = getattr(workers, cls_name, None)
+    if CLS_worker is None:
+        raise ImportError('backend {} needs pyzmq'.format(backend))
+    if backend.startswith('shm'):
+        from ..ipc_shm_loader import IPC_shm
+        return IPC_shm(CLS_worker=CLS_worker, worker_args=(), worker_num=worker_num, manager_num=manager_num,
+                       group_name=group_name, evt_quit=evt_quit, shm_size=shm_size, queue_size=queue_size, **kwargs)
+    from ..ipc_zmq_loader import IPC_zmq
+    return IPC_zmq(CLS_worker=CLS_worker, worker_args=(), worker_num=worker_num,
+                   group_name=group_name, evt_quit=evt_quit, queue_size=queue_size, **kwargs)
+
+
+def _process_cpu(pid):
+    # user + system seconds of pid , None when it can not be read
+    if psutil is not None:
+        try:
+            t = psutil.Process(pid).cpu_times()
+            return t.user + t.system
+        except psutil.Error:
+            return None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def cpu_times(instance):
+    '''
+        cpu seconds used so far : client (this process , dispatcher and client threads) , workers , managers (sum over processes)
+    '''
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    d = dict(client=r.ru_utime + r.ru_stime)
+    for name, processes in (('workers', instance.woker_process_list), ('managers', instance.manager_process_list)):
+        values = [_process_cpu(p.pid) for p in processes if p.pid is not None]
+        d[name] = None if None in values else sum(values)
+    return d
+
+
+def _cpu_delta(before, after):
+    return {k: None if before[k] is None or after[k] is None else after[k] - before[k] for k in before}
+
+
+def _client(instance, request, n, is_stream, timeout, latencies, first_latencies, errors):
+    for _ in range(n):
+        t = time.perf_counter()
+        try:
+            if is_stream:
+                first = None
+                for _ in instance.iter_results(instance.put(request), timeout=timeout):
+                    if first is None:
+                        first = time.perf_counter() - t
+                first_latencies.append(first)
+            else:
+                instance.get(instance.put(request), timeout=timeout)
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - t)
+
+
+def _run_clients(instance, request, n, threads, is_stream, timeout):
+    latencies, first_latencies, errors = [], [], []
+    per_thread = [n // threads + (1 if i < n % threads else 0) for i in range(threads)]
+    thread_list = [threading.Thread(target=_client, args=(instance, request, k, is_stream, timeout,
+                                                          latencies, first_latencies, errors))
+                   for k in per_thread if k > 0]
+    t = time.perf_counter()
+    for th in thread_list:
+        th.start()
+    for th in thread_list:
+        th.join()
+    return time.perf_counter() - t, latencies, first_latencies, errors
+
+
+def run_case(backend, payload, worker_num=1, manager_num=1, threads=1, call='unary',
+             requests=2000, warmup=50, max_bytes=1 << 31, chunks=8, work_us=0,
+             shm_size=1 << 20, queue_size=20, timeout=60, wait_strategy=None, idle_s=0):
+    '''
+        one instance , warmup requests then requests (fewer when requests * payload > max_bytes) from threads client threads
+        call : unary | stream (chunks slices of the payload per request)
+        cpu_s : cpu seconds of client / workers / managers during the timed requests ,
+        idle_cpu_s : the same over idle_s seconds without requests afterwards (what spin costs while waiting)
+    '''
+    is_stream = call == 'stream'
+    n = max(min(requests, max_bytes // max(payload, 1)), threads)
+    evt_quit = multiprocessing.Event()
+    group_name = 'bench_{}_{}'.format(os.getpid(), next(_case_ids))
+    instance = _create(backend, worker_num, manager_num, group_name, evt_quit, shm_size, queue_size, wait_strategy)
+    request = workers.make_request(payload, chunks if is_stream else 0, work_us)
+    result = dict(backend=backend, payload=payload, worker_num=worker_num, manager_num=manager_num,
+                  threads=threads, call=call, wait_strategy=wait_strategy, requests=n)
+    startup = instance.start()
+    try:
+        _run_clients(instance, request, min(warmup, n), threads, is_stream, timeout)
+        cpu_before = cpu_times(instance)
+        elapsed, latencies, first_latencies, errors = _run_clients(instance, request, n, threads, is_stream, timeout)
+        cpu_after = cpu_times(instance)
+        result['cpu_s'] = _cpu_delta(cpu_before, cpu_after)
+        if idle_s > 0:
+            time.sleep(idle_s)
+            result['idle_cpu_s'] = _cpu_delta(cpu_after, cpu_times(instance))
+        result.update(elapsed=elapsed,
+                      throughput=len(latencies) / elapsed,
+                      mb_per_s=len(latencies) * payload / elapsed / (1 << 20),
+                      latency_ms=percentiles(latencies),
+                      errors=len(errors),
+                      startup_s=startup['ready_s'])
+        if is_stream:
+            result['first_chunk_ms'] = percentiles(first_latencies)
+        if errors:
+            result['first_error'] = errors[0]
+        result['stats'] = instance.stats()
+    finally:
+        evt_quit.set()
+        instance.terminate()
+    return result
+
+
+def iter_cases(backends, payloads, worker_nums, manager_nums, threads_list, calls, wait_strategies=(None,)):
+    seen = set()
+    for backend, payload, worker_num, manager_num, threads, call, wait_strategy in itertools.product(
+            backends, payloads, worker_nums, manager_nums, threads_list, calls, wait_strategies):
+        # zmq has a single manager and no wait strategy
+        if not backend.startswith('shm'):
+            manager_num = 1
+            wait_strategy = None
+        case = (backend, payload, worker_num, manager_num, threads, call, wait_strategy)
+        if case not in seen:
+            seen.add(case)
+            yield dict(zip(CASE_KEYS, case))
+
+
+def environment():
+    try:
+        import zmq
+        zmq_version = zmq.zmq_version()
+    except ImportError:
+        zmq_version = None
+    return dict(time=time.strftime('%Y-%m-%d %H:%M:%S'),
+                host=socket.gethostname(),
+                platform=platform.platform(),
+                python=sys.version.split()[0],
+                cpu_count=os.cpu_count(),
+                zmq=zmq_version,
+                argv=sys.argv[1:])
+
+
+def format_cpu(cpu_s):
+    return ' '.join('{} {}'.format(k, '-' if v is None else '{:.2f}s'.format(v)) for k, v in cpu_s.items())
+
+
+def run_sweep(cases, output=None, **options):
+    '''
+        run every case (dicts of CASE_KEYS) , a failed case is recorded with its error
+        return {'env': ..., 'options': ..., 'results': [...]} , written to output (json) after every case
+    '''
+    # ipc sockets of the zmq backends go to the temp dir instead of the working directory
+    os.environ.setdefault('ZEROMQ_SOCK_TMP_DIR', tempfile.gettempdir())
+    report = dict(env=environment(), options=options, results=[])
+    for case in cases:
+        logger.info('bench {}'.format(case))
+        try:
+            result = run_case(**dict(options, **case))
+            logger.info('  {:.0f} req/s , p50 {:.3f} ms , p99 {:.3f} ms , cpu {}{}'.format(
+                result['throughput'], result['latency_ms'].get('p50', 0), result['latency_ms'].get('p99', 0),
+                format_cpu(result['cpu_s']),
+                ' , idle cpu {}'.format(format_cpu(result['idle_cpu_s'])) if 'idle_cpu_s' in result else ''))
+        except Exception as e:
+            logger.error('  failed {}'.format(e))
+            result = dict(case, error=repr(e))
+        report['results'].append(result)
+        if output is not None:
+            with open(output, mode='w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+    return report
+
+
+def _key(result):
+    return tuple(result.get(k) for k in CASE_KEYS)
+
+
+def compare(base, new, threshold=0.1):
+    '''
+        match cases of two reports , a case regresses when throughput drops or p99 latency grows by more than threshold
+        return rows (case , base throughput , new throughput , base p99 , new p99 , is_regression)
+    '''
+    base_results = {_key(r): r for r in base['results'] if 'error' not in r}
+    rows = []
+    for r in new['results']:
+        b = base_results.get(_key(r))
+        if b is None or 'error' in r:
+            continue
+        b_p99, n_p99 = b['latency_ms'].get('p99', 0), r['latency_ms'].get('p99', 0)
+        is_regression = r['throughput'] < b['throughput'] * (1 - threshold) or \
+                        (b_p99 > 0 and n_p99 > b_p99 * (1 + threshold))
+        rows.append((dict(zip(CASE_KEYS, _key(r))), b['throughput'], r['throughput'], b_p99, n_p99, is_regression))
+    return rows
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 23:20
+# @Author  : tk
+
+import time
+from ..ipc_shm_loader import SHM_process_worker
+
+try:
+    # pyzmq is only needed for the zmq backends
+    from ..ipc_zmq_loader import ZMQ_process_worker
+except ImportError:
+    ZMQ_process_worker = None
+
+# request : (chunks,work_us,payload) , chunks 0 : unary echo , chunks n : a stream of n slices of payload
+
+
+def make_request(payload_size, chunks=0, work_us=0):
+    return chunks, work_us, b'\x01' * payload_size
+
+
+def reply(request_data):
+    chunks, work_us, payload = request_data
+    if work_us:
+        # busy wait , sleep is too coarse for a few microseconds
+        t = time.perf_counter() + work_us / 1e6
+        while time.perf_counter() < t:
+            pass
+    if not chunks:
+        return payload
+
+    def stream():
+        step = max(len(payload) // chunks, 1)
+        for i in range(chunks):
+            yield payload[i * step:(i + 1) * step]
+    return stream()
+
+
+class Bench_shm_worker(SHM_process_worker):
+    def run_begin(self):
+        pass
+
+    def run_end(self):
+        pass
+
+    def run_once(self, request_data):
+        return reply(request_data)
+
+
+if ZMQ_process_worker is not None:
+    class Bench_zmq_worker(ZMQ_process_worker):
+        def run_begin(self):
+            pass
+
+        def run_end(self):
+            pass
+
+        def run_once(self, request_data):
+            return reply(request_data)
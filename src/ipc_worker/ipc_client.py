@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 14:20
+# @Author  : tk
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Full, Queue
+from .response_dispatcher import ResponseState
+from .metrics import prometheus_text, Metrics_server
+from .autoscaler import Autoscaler
+from .utils import logger
+
+
+class IPC_client_mixin:
+    '''
+        client api shared by IPC_shm and IPC_zmq
+        subclass provides self._dispatcher (Response_dispatcher) and
+        self._put(data,future=None,listener=None,block=True,deadline=None,priority=0) -> request_id , raise queue.Full when not block
+        self._put_many(data_list,futures=None,deadline=None,priority=0) -> request_ids , one lock and one queue round trip for the list
+        self._cancel(request_id) tells managers and workers to drop request_id
+        self._stats() -> dict , see stats
+        self.worker_num , self.add_workers(n) , self.remove_workers(n,timeout) resize the pool , see autoscale
+        deadline : time.time() value , managers and workers skip the request after it , the client fails it with TimeoutError
+        priority : lane of the request , 0 the highest , below the priorities of the instance (see priority.py)
+    '''
+
+    def _wait_ready(self, worker_list_fn, t_start, timeout=None, supervised=False):
+        '''
+            start(wait_ready=True) , wait until every worker of worker_list_fn() has returned from run_begin ,
+            a worker that exits first raises RuntimeError unless supervised (the supervisor replaces it) , TimeoutError after timeout
+            return {'workers','start_s','ready_s','boot_s'} , boot_s : worker idx -> seconds from process start to ready
+        '''
+        t_started = time.time()
+        deadline = None if timeout is None else t_start + timeout
+        while True:
+            workers = worker_list_fn()
+            waiting = [w for w in workers if w.t_ready is None]
+            if not waiting:
+                break
+            for w in waiting:
+                if not supervised and w.exitcode is not None:
+                    raise RuntimeError('worker {} exited before ready , exitcode {}'.format(w._idx, w.exitcode))
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError('workers {} not ready after {}s'.format([w._idx for w in waiting], timeout))
+            time.sleep(0.002)
+        report = dict(workers=len(workers),
+                      start_s=t_started - t_start,
+                      ready_s=max([w.t_ready for w in workers], default=t_started) - t_start,
+                      boot_s={w._idx: w.t_ready - w.t_start for w in workers})
+        logger.info('{} workers ready in {:.3f}s (processes started in {:.3f}s)'.format(
+            report['workers'], report['ready_s'], report['start_s']))
+        return report
+
+    def put(self, data, deadline=None, priority=0):
+        return self._put(data, deadline=deadline, priority=priority)
+
+    def submit(self, data, deadline=None, priority=0) -> Future:
+        future = Future()
+        future.request_id = self._put(data, future=future, deadline=deadline, priority=priority)
+        return future
+
+    def put_many(self, data_list, deadline=None, priority=0):
+        return self._put_many(list(data_list), deadline=deadline, priority=priority)
+
+    def submit_many(self, data_list, deadline=None, priority=0):
+        futures = [Future() for _ in data_list]
+        for future, request_id in zip(futures, self._put_many(list(data_list), futures=futures, deadline=deadline,
+                                                              priority=priority)):
+            future.request_id = request_id
+        return futures
+
+    def cancel(self, request_id):
+        '''
+            get / future / stream of request_id raise CancelledError , a worker running it sees is_cancelled()
+            return False when request_id is unknown or already cancelled
+        '''
+        if not self._dispatcher.cancel(request_id):
+            return False
+        self._cancel(request_id)
+        return True
+
+    def stats(self):
+        '''
+            {'group','queue','workers','managers'} , queue : current depths ,
+            workers / managers : counters and latency summaries (count,mean,p50,p90,p99,max) , read from shared memory
+        '''
+        return self._stats()
+
+    def prometheus_text(self):
+        s = self.stats()
+        return prometheus_text(s, s['group'])
+
+    def start_metrics_server(self, port=0, host='127.0.0.1'):
+        '''
+            serve prometheus_text() on http://host:port/metrics , return (host,port)
+        '''
+        if getattr(self, '_metrics_server', None) is None:
+            self._metrics_server = Metrics_server(self.prometheus_text, host, port, name='metrics_server')
+            self._metrics_server.start()
+        return self._metrics_server.addr
+
+    def _stop_metrics_server(self):
+        if getattr(self, '_metrics_server', None) is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+    def autoscale(self, min_workers=1, max_workers=None, target_queue_depth=None, target_utilisation=None,
+                  cooldown=30, interval=1, drain_timeout=None):
+        '''
+            after start , resize the pool between min_workers and max_workers (default max_worker_num) , see Autoscaler
+        '''
+        self._stop_autoscaler()
+        self._autoscaler = Autoscaler(self, min_workers, max_workers or self._max_worker_num,
+                                      target_queue_depth=target_queue_depth,
+                                      target_utilisation=target_utilisation,
+                                      cooldown=cooldown, interval=interval, drain_timeout=drain_timeout,
+                                      name='autoscaler')
+        self._autoscaler.start()
+        return self._autoscaler
+
+    def _stop_autoscaler(self):
+        if getattr(self, '_autoscaler', None) is not None:
+            self._autoscaler.stop()
+            self._autoscaler.join()
+            self._autoscaler = None
+
+    # request_seq_id initail 1
+    def get(self, request_id, request_seq_id=None, timeout=None):
+        return self._dispatcher.get(request_id, request_seq_id, timeout)
+
+    def iter_results(self, request_id, timeout=None):
+        '''
+            for chunk in instance.iter_results(instance.put(data)) , chunks in order until end of stream
+        '''
+        return self._dispatcher.iter_results(request_id, timeout)
+
+    def get_many(self, request_ids, timeout=None):
+        return self._dispatcher.get_many(request_ids, timeout)
+
+    def map(self, inputs, ordered=True, chunksize=64, max_pending=None, priority=0):
+        '''
+            yield the result of every input , in input order or as they complete (ordered=False)
+            inputs are sent chunksize at a time with put_many , at most max_pending (default 4 chunks) in flight
+        '''
+        max_pending = max(max_pending or 4 * chunksize, chunksize)
+        it = iter(inputs)
+        futures = deque()
+        done = Queue()
+        n_pending = 0
+        is_exhausted = False
+        while True:
+            while not is_exhausted and n_pending + chunksize <= max_pending:
+                chunk = list(itertools.islice(it, chunksize))
+                if not chunk:
+                    is_exhausted = True
+                    break
+                chunk_futures = self.submit_many(chunk, priority=priority)
+                if ordered:
+                    futures.extend(chunk_futures)
+                else:
+                    for future in chunk_futures:
+                        future.add_done_callback(done.put)
+                n_pending += len(chunk_futures)
+            if n_pending == 0:
+                return
+            future = futures.popleft() if ordered else done.get()
+            n_pending -= 1
+            yield future.result()
+
+    async def _put_async(self, data, future=None, listener=None, priority=0):
+        # never block the event loop on a full request queue
+        while True:
+            try:
+                return self._put(data, future=future, listener=listener, block=False, priority=priority)
+            except Full:
+                await asyncio.sleep(0.001)
+
+    async def call(self, data, priority=0):
+        future = Future()
+        future.request_id = await self._put_async(data, future=future, priority=priority)
+        return await asyncio.wrap_future(future)
+
+    async def stream(self, data, priority=0):
+        '''
+            async for chunk in instance.stream(data) , a non generator result is yielded once
+        '''
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def on_response(seq_id, response, state):
+            loop.call_soon_threadsafe(queue.put_nowait, (seq_id, response, state))
+
+        request_id = await self._put_async(data, listener=on_response, priority=priority)
+        try:
+            while True:
+                seq_id, response, state = await queue.get()
+                if state == ResponseState.RS_END:
+                    break
+                if state == ResponseState.RS_ERROR:
+                    raise response
+                yield response
+                if seq_id == 0:
+                    break
+        finally:
+            self._dispatcher.remove_listener(request_id)
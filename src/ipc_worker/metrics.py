@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 22:40
+# @Author  : tk
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from .utils import logger
+
+# 计数器和直方图放在一块共享内存中 , 每个 worker / manager 一段 , 只由该进程写入 , 读取方不加锁 (近似快照)
+# 直方图为 HDR 风格的对数线性分桶 : 每个 2 的幂区间再分 2**HIST_SUB_BITS 个子桶 , 相对误差约 1 / 2**HIST_SUB_BITS
+# 一个直方图: count , sum , max , buckets (int64)
+HIST_SUB_BITS = 3
+HIST_SUB = 1 << HIST_SUB_BITS
+HIST_BUCKETS = 320
+HIST_SIZE = 3 + HIST_BUCKETS
+
+# run_us : run_once / run_batch and sending its results , payload_bytes : request size
+WORKER_COUNTERS = ('requests', 'batches', 'busy_us', 'start_us')
+WORKER_HISTOGRAMS = ('run_us', 'payload_bytes')
+# dispatch_wait_us : client put (direct mode : io thread receive) to dispatch , dropped : cancelled or expired ,
+# stolen : taken from the input lane of another manager (shm shard mode)
+MANAGER_COUNTERS = ('dispatched', 'dropped', 'stolen', 'start_us')
+MANAGER_HISTOGRAMS = ('dispatch_wait_us',)
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_index(v):
+    v = max(int(v), 0)
+    if v < HIST_SUB:
+        return v
+    e = v.bit_length() - HIST_SUB_BITS - 1
+    return min((e << HIST_SUB_BITS) + (v >> e), HIST_BUCKETS - 1)
+
+
+def bucket_upper(i):
+    if i < HIST_SUB:
+        return i
+    e = (i >> HIST_SUB_BITS) - 1
+    return (((i & (HIST_SUB - 1)) + HIST_SUB + 1) << e) - 1
+
+
+def _section_size(counters, histograms):
+    return len(counters) + HIST_SIZE * len(histograms)
+
+
+class Metrics_writer:
+    '''
+        one section , used by its own process only
+    '''
+    def __init__(self, arr, base, counters, histograms):
+        self._arr = arr
+        self._counters = {name: base + i for i, name in enumerate(counters)}
+        base += len(counters)
+        self._histograms = {name: base + HIST_SIZE * i for i, name in enumerate(histograms)}
+
+    def add(self, name, n=1):
+        self._arr[self._counters[name]] += int(n)
+
+    def set(self, name, v):
+        self._arr[self._counters[name]] = int(v)
+
+    def observe(self, name, v):
+        arr = self._arr
+        pos = self._histograms[name]
+        v = int(v)
+        arr[pos] += 1
+        arr[pos + 1] += v
+        if v > arr[pos + 2]:
+            arr[pos + 2] = v
+        arr[pos + 3 + bucket_index(v)] += 1
+
+
+def record_run(stat, sizes, seconds):
+    '''
+        worker side , one run_once / run_batch round , sizes : payload size of every request in it
+    '''
+    if stat is None:
+        return
+    us = seconds * 1e6
+    stat.add('requests', len(sizes))
+    stat.add('batches')
+    stat.add('busy_us', us)
+    stat.observe('run_us', us)
+    for size in sizes:
+        stat.observe('payload_bytes', size)
+
+
+def _summary(buckets, count, total, v_max):
+    s = {'count': count, 'mean': total / count if count else 0}
+    n = 0
+    q = list(QUANTILES)
+    for i, c in enumerate(buckets):
+        if not c:
+            continue
+        n += c
+        while q and n >= q[0] * count:
+            s['p{}'.format(int(q.pop(0) * 100))] = min(bucket_upper(i), v_max)
+    for x in q:
+        s['p{}'.format(int(x * 100))] = 0
+    s['max'] = v_max
+    return s
+
+
+class SHM_metrics:
+    '''
+        sections : worker_num worker sections , then manager_num manager sections
+        writer(kind,idx) in the writing process , snapshot() anywhere
+    '''
+    def __init__(self, name, worker_num, manager_num):
+        self._name = name
+        self._worker_num = worker_num
+        self._manager_num = manager_num
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=8 * self._size())
+        self._shm.buf[:] = bytes(self._shm.size)
+        self._arr = self._shm.buf.cast('q')
+        self._is_owner = True
+
+    def __getstate__(self):
+        return self._name, self._worker_num, self._manager_num
+
+    def __setstate__(self, state):
+        self._name, self._worker_num, self._manager_num = state
+        self._shm = shared_memory.SharedMemory(name=self._name)
+        self._arr = self._shm.buf.cast('q')
+        self._is_owner = False
+
+    def _size(self):
+        return self._worker_num * _section_size(WORKER_COUNTERS, WORKER_HISTOGRAMS) + \
+               self._manager_num * _section_size(MANAGER_COUNTERS, MANAGER_HISTOGRAMS)
+
+    def _base(self, kind, idx):
+        if kind == 'worker':
+            return idx * _section_size(WORKER_COUNTERS, WORKER_HISTOGRAMS)
+        return self._worker_num * _section_size(WORKER_COUNTERS, WORKER_HISTOGRAMS) + \
+               idx * _section_size(MANAGER_COUNTERS, MANAGER_HISTOGRAMS)
+
+    def writer(self, kind, idx):
+        '''
+            kind : worker | manager , None when idx has no section (remote worker)
+        '''
+        if idx >= (self._worker_num if kind == 'worker' else self._manager_num):
+            return None
+        counters, histograms = (WORKER_COUNTERS, WORKER_HISTOGRAMS) if kind == 'worker' else \
+            (MANAGER_COUNTERS, MANAGER_HISTOGRAMS)
+        base = self._base(kind, idx)
+        w = Metrics_writer(self._arr, base, counters, histograms)
+        # a restarted process keeps the section , counters and start_us stay cumulative (busy_ratio <= 1)
+        if not self._arr[base + counters.index('start_us')]:
+            w.set('start_us', time.time() * 1e6)
+        return w
+
+    def _read(self, kind, idx, now_us):
+        counters, histograms = (WORKER_COUNTERS, WORKER_HISTOGRAMS) if kind == 'worker' else \
+            (MANAGER_COUNTERS, MANAGER_HISTOGRAMS)
+        pos = self._base(kind, idx)
+        arr = self._arr
+        d = {'idx': idx}
+        for name in counters:
+            d[name] = arr[pos]
+            pos += 1
+        for name in histograms:
+            d[name] = _summary(arr[pos + 3:pos + HIST_SIZE], arr[pos], arr[pos + 1], arr[pos + 2])
+            pos += HIST_SIZE
+        start_us = d.pop('start_us')
+        if kind == 'worker':
+            d['busy_ratio'] = d['busy_us'] / (now_us - start_us) if start_us and now_us > start_us else 0
+        return d
+
+    def snapshot(self):
+        now_us = time.time() * 1e6
+        return {
+            'workers': [self._read('worker', i, now_us) for i in range(self._worker_num)],
+            'managers': [self._read('manager', i, now_us) for i in range(self._manager_num)],
+        }
+
+    def close(self):
+        try:
+            self._arr.release()
+            self._shm.close()
+        except Exception as e:
+            logger.warning('metrics close except {}'.format(e))
+
+    def unlink(self):
+        self.close()
+        if self._is_owner:
+            try:
+                self._shm.unlink()
+            except Exception:
+                pass
+
+
+def prometheus_text(stats, group_name, prefix='ipc_worker'):
+    '''
+        prometheus text exposition of instance.stats() , histograms as summaries
+    '''
+    # metric -> (type , sample lines) , samples of one metric stay together
+    families = {}
+
+    def emit(metric, kind, labels, v, suffix=''):
+        label_str = ','.join('{}="{}"'.format(k, x) for k, x in labels.items())
+        families.setdefault(metric, (kind, []))[1].append('{}{}{{{}}} {}'.format(metric, suffix, label_str, v))
+
+    group = {'group': group_name}
+    for name, v in stats.get('queue', {}).items():
+        emit('{}_queue_{}'.format(prefix, name), 'gauge', group, v)
+    for kind in ('workers', 'managers'):
+        for d in stats.get(kind, []):
+            labels = dict(group, **{kind[:-1]: d['idx']})
+            for name, v in d.items():
+                if name == 'idx':
+                    continue
+                metric = '{}_{}_{}'.format(prefix, kind[:-1], name)
+                if isinstance(v, dict):
+                    for q in QUANTILES:
+                        emit(metric, 'summary', dict(labels, quantile=q), v['p{}'.format(int(q * 100))])
+                    emit(metric, 'summary', labels, v['count'], '_count')
+                    emit(metric, 'summary', labels, v['mean'] * v['count'], '_sum')
+                else:
+                    emit(metric, 'gauge' if name == 'busy_ratio' else 'counter', labels, v)
+    lines = []
+    for metric, (kind, samples) in families.items():
+        lines.append('# TYPE {} {}'.format(metric, kind))
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics_server(threading.Thread):
+    '''
+        GET /metrics -> text_fn()
+    '''
+    def __init__(self, text_fn, host='127.0.0.1', port=0, name=None):
+        super(Metrics_server, self).__init__(name=name, daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = text_fn().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.addr = self._server.server_address
+
+    def run(self):
+        self._server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
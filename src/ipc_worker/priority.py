@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 01:40
+# @Author  : tk
+
+from collections import deque
+
+# 优先级通道: put(data,priority=p) , 0 为最高优先级 , 每个优先级一个队列
+# strict   : 总是先取优先级最高的非空队列 , 低优先级在高优先级有请求时一直等待
+# weighted : 在非空队列间做平滑加权轮询 , 队列 i 在 sum(weights) 次中取 weights[i] 次 , 低优先级不会饿死
+PRIORITY_STRICT = 'strict'
+PRIORITY_WEIGHTED = 'weighted'
+
+
+class Priority_selector:
+    '''
+        pick the lane to serve next among the non empty ones , lane 0 is the highest priority
+        weights default to lane_num - i for lane i (weighted only)
+    '''
+    def __init__(self, lane_num=1, policy=PRIORITY_STRICT, weights=None):
+        assert lane_num >= 1, 'priorities must be >= 1'
+        assert policy in (PRIORITY_STRICT, PRIORITY_WEIGHTED), 'bad priority_policy {}'.format(policy)
+        weights = list(weights) if weights is not None else [lane_num - i for i in range(lane_num)]
+        assert len(weights) == lane_num and all(w > 0 for w in weights), 'priority_weights needs one positive weight per lane'
+        self.lane_num = lane_num
+        self.policy = policy
+        self.weights = weights
+        self._current = [0] * lane_num
+
+    def check(self, priority):
+        if not 0 <= priority < self.lane_num:
+            raise ValueError('priority {} out of range , priorities {}'.format(priority, self.lane_num))
+        return priority
+
+    def select(self, ready):
+        '''
+            ready : indexes of the non empty lanes in priority order , return the lane to serve , None when ready is empty
+        '''
+        if not ready:
+            return None
+        if self.policy == PRIORITY_STRICT or len(ready) == 1:
+            return ready[0]
+        total = 0
+        for i in ready:
+            self._current[i] += self.weights[i]
+            total += self.weights[i]
+        best = max(ready, key=lambda i: self._current[i])
+        self._current[best] -= total
+        return best
+
+
+class Priority_deque:
+    '''
+        one deque per lane for requests waiting for worker credits (zmq router) , priority_fn(item) -> lane
+        popleft takes from the lane the selector picks , appendleft puts an item back at the head of its lane
+    '''
+    def __init__(self, selector, priority_fn):
+        self.selector = selector
+        self._priority_fn = priority_fn
+        self._lanes = [deque() for _ in range(selector.lane_num)]
+        self._size = 0
+        # lane picked by peek , popleft takes from it
+        self._next = None
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for lane in self._lanes:
+            yield from lane
+
+    def append(self, item):
+        self._lanes[self._priority_fn(item)].append(item)
+        self._size += 1
+
+    def appendleft(self, item):
+        self._lanes[self._priority_fn(item)].appendleft(item)
+        self._size += 1
+        self._next = None
+
+    def remove(self, item):
+        self._lanes[self._priority_fn(item)].remove(item)
+        self._size -= 1
+        self._next = None
+
+    def peek(self):
+        if self._next is None:
+            self._next = self.selector.select([i for i, lane in enumerate(self._lanes) if lane])
+        return None if self._next is None else self._lanes[self._next][0]
+
+    def popleft(self):
+        if self.peek() is None:
+            raise IndexError('pop from an empty Priority_deque')
+        item = self._lanes[self._next].popleft()
+        self._size -= 1
+        self._next = None
+        return item
+
+    def depth(self):
+        return [len(lane) for lane in self._lanes]
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 11:05
+# @Author  : tk
+
+import heapq
+import math
+import threading
+import time
+from concurrent.futures import Future, CancelledError
+from queue import Empty
+from typing import Optional
+from .utils import logger
+
+
+class ResponseState:
+    RS_DATA = 0
+    # generator exhausted , response is None and seq_id is last seq_id + 1
+    RS_END = 1
+    # response is an exception
+    RS_ERROR = 2
+    # coalesced stream chunks , response is a list , seq_id is the seq_id of the first chunk
+    RS_CHUNKS = 3
+    # the worker (w_id) died with the request and it is not retried , the client fails it with WorkerDiedError
+    RS_LOST = 4
+
+
+class WorkerDiedError(RuntimeError):
+    pass
+
+
+# request cancelled or expired on the client , stored as an RS_ERROR item before any other seq_id
+SEQ_CLOSED = -1
+
+
+class Reorder_buffer:
+    '''
+        buffered responses of one request keyed by seq_id , items are (seq_id,response,state)
+        pop() takes the lowest seq_id , pop(seq_id) and seq_id in buffer are dict lookups
+    '''
+    __slots__ = ('_items', '_heap', 'time')
+
+    def __init__(self, items=()):
+        self._items = {}
+        self._heap = []
+        self.time = time.time()
+        self.extend(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, seq_id):
+        return seq_id in self._items
+
+    def extend(self, items):
+        for item in items:
+            self._items[item[0]] = item
+            heapq.heappush(self._heap, item[0])
+        self.time = time.time()
+
+    def pop(self, seq_id=None):
+        if seq_id is None:
+            # heap entries of seq_ids already taken by pop(seq_id) are dropped here
+            while self._heap and self._heap[0] not in self._items:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            seq_id = heapq.heappop(self._heap)
+        item = self._items.pop(seq_id, None)
+        if not self._items:
+            self._heap.clear()
+        self.time = time.time()
+        return item
+
+    def items(self):
+        return [self._items[seq_id] for seq_id in sorted(self._items)]
+
+
+class Response_dispatcher(threading.Thread):
+    '''
+        single thread drains the response source and hands every item to its request_id ,
+        callers block on their own future or condition instead of polling the queue under a global lock
+        get_fn(timeout) returns (request_id,worker_id,seq_id,response,state) or raises queue.Empty
+        responses are decoded once on arrival by this thread , decode_fn(response,is_chunks)
+    '''
+    def __init__(self, get_fn, decode_fn=None, name=None):
+        super(Response_dispatcher, self).__init__(name=name, daemon=True)
+        self._get_fn = get_fn
+        self._decode_fn = decode_fn
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._futures = {}
+        self._listeners = {}
+        self._evt_stop = threading.Event()
+        # deadline heap (deadline,request_id) , a request expires only while no response has arrived
+        self._deadlines = []
+        self._deadline_of = {}
+        # cancelled or expired request_id -> time , their late responses are dropped
+        self._closed = {}
+        # requests with no response yet , see fail_pending
+        self._waiting = set()
+        self.pending_request = {}
+        self.pending_response = {}
+        self.__last_t = time.time()
+
+    def stop(self):
+        self._evt_stop.set()
+
+    def _expand(self, seq_id, response, state):
+        if state == ResponseState.RS_END:
+            return [(seq_id, None, state)]
+        try:
+            if self._decode_fn is not None and response is not None:
+                response = self._decode_fn(response, state == ResponseState.RS_CHUNKS)
+        except Exception as e:
+            return [(seq_id, e, ResponseState.RS_ERROR)]
+        if state == ResponseState.RS_CHUNKS:
+            return [(seq_id + i, x, ResponseState.RS_DATA) for i, x in enumerate(response)]
+        return [(seq_id, response, state)]
+
+    @staticmethod
+    def _resolve(future: Future, item):
+        _, response, state = item
+        if state == ResponseState.RS_ERROR:
+            future.set_exception(response)
+        else:
+            future.set_result(response)
+
+    @staticmethod
+    def _notify(listener, items):
+        try:
+            for seq_id, response, state in items:
+                listener(seq_id, response, state)
+        except Exception as e:
+            logger.error('response listener except {}'.format(e))
+
+    def _store(self, request_id, items):
+        if not items:
+            return
+        reps = self.pending_response.get(request_id, None)
+        if reps is None:
+            self.pending_response[request_id] = Reorder_buffer(items)
+        else:
+            reps.extend(items)
+        waiter = self._waiters.get(request_id, None)
+        if waiter is not None:
+            waiter[0].notify_all()
+
+    @staticmethod
+    def _is_last(item):
+        # a plain result , the end of a stream or an error , nothing of the request is read after it
+        return item[0] == 0 or item[2] in (ResponseState.RS_END, ResponseState.RS_ERROR)
+
+    def _finish(self, request_id):
+        # hold self._lock , the request got its last response , its later responses are dropped (see _on_response)
+        self.pending_request.pop(request_id, None)
+        self._listeners.pop(request_id, None)
+        self._waiting.discard(request_id)
+        self._deadline_of.pop(request_id, None)
+
+    def _add_deadline(self, request_id, deadline):
+        if deadline is not None:
+            self._deadline_of[request_id] = deadline
+            heapq.heappush(self._deadlines, (deadline, request_id))
+
+    def add_request(self, request_id, future: Optional[Future] = None, listener=None, deadline=None):
+        '''
+            future: resolved with the first response of request_id
+            listener(seq_id,response,state): called from dispatcher thread for every response of request_id
+            deadline: time.time() after which a request with no response yet fails with TimeoutError
+        '''
+        items = []
+        with self._lock:
+            self.pending_request[request_id] = time.time()
+            self._waiting.add(request_id)
+            self._add_deadline(request_id, deadline)
+            if listener is not None:
+                reps = self.pending_response.pop(request_id, None)
+                if reps is not None:
+                    items = reps.items()
+                self._listeners[request_id] = listener
+                if any(self._is_last(item) for item in items):
+                    self._finish(request_id)
+            elif future is not None:
+                item = self._pop_response(request_id, None)
+                if item is None:
+                    self._futures[request_id] = future
+                    return
+                items = [item]
+                self._finish(request_id)
+        if listener is not None:
+            self._notify(listener, items)
+        elif items:
+            self._resolve(future, items[0])
+
+    def add_requests(self, request_ids, futures=None, deadline=None):
+        '''
+            bulk add_request , one lock round trip for a chunk of requests
+        '''
+        resolved = []
+        with self._lock:
+            t = time.time()
+            self._waiting.update(request_ids)
+            for i, request_id in enumerate(request_ids):
+                self.pending_request[request_id] = t
+                self._add_deadline(request_id, deadline)
+                if futures is None:
+                    continue
+                item = self._pop_response(request_id, None)
+                if item is None:
+                    self._futures[request_id] = futures[i]
+                else:
+                    self._finish(request_id)
+                    resolved.append((futures[i], item))
+        for future, item in resolved:
+            self._resolve(future, item)
+
+    def remove_listener(self, request_id):
+        with self._lock:
+            self._finish(request_id)
+
+    def close_request(self, request_id, error):
+        '''
+            fail request_id with error (RS_ERROR) and drop its later responses , False when already closed
+            an item at SEQ_CLOSED is stored for get / iter_results , a stream in progress stops there
+        '''
+        item = (SEQ_CLOSED, error, ResponseState.RS_ERROR)
+        with self._lock:
+            if request_id in self._closed or request_id not in self.pending_request:
+                return False
+            self._closed[request_id] = time.time()
+            self._waiting.discard(request_id)
+            self._deadline_of.pop(request_id, None)
+            listener = self._listeners.get(request_id, None)
+            future = self._futures.pop(request_id, None) if listener is None else None
+            if listener is None and future is None:
+                self._store(request_id, [item])
+            else:
+                self._finish(request_id)
+        if listener is not None:
+            self._notify(listener, [item])
+        elif future is not None:
+            self._resolve(future, item)
+        return True
+
+    def fail_pending(self, error):
+        '''
+            close every request without a response yet , return their request_ids
+        '''
+        with self._lock:
+            request_ids = list(self._waiting)
+        return [r_id for r_id in request_ids if self.close_request(r_id, error)]
+
+    def depth(self):
+        '''
+            futures / listeners : requests waiting for a response , unread : requests with buffered responses ,
+            requests : requests sent and not finished (queued , running or unread)
+        '''
+        with self._lock:
+            return dict(futures=len(self._futures), listeners=len(self._listeners), unread=len(self.pending_response),
+                        requests=len(self.pending_request))
+
+    def cancel(self, request_id):
+        return self.close_request(request_id, CancelledError('request {} cancelled'.format(request_id)))
+
+    def _expire(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, request_id = heapq.heappop(self._deadlines)
+                if self._deadline_of.get(request_id, None) == deadline:
+                    self._deadline_of.pop(request_id)
+                    expired.append(request_id)
+        for request_id in expired:
+            self.close_request(request_id, TimeoutError('request {} deadline exceeded'.format(request_id)))
+
+    def run(self):
+        while not self._evt_stop.is_set():
+            try:
+                item = self._get_fn(timeout=0.1)
+            except Empty:
+                item = None
+            except Exception as e:
+                if not self._evt_stop.is_set():
+                    logger.error('response dispatcher stop , {}'.format(e))
+                break
+            if item is not None:
+                self._on_response(*item)
+            if self._deadlines and self._deadlines[0][0] <= time.time():
+                self._expire()
+
+    def _on_response(self, r_id, w_id, seq_id, response, state=ResponseState.RS_DATA):
+        # requests are added before they are sent , an unknown r_id already finished (or was removed)
+        if r_id in self._closed or r_id not in self.pending_request:
+            return
+        if state == ResponseState.RS_LOST:
+            self.close_request(r_id, WorkerDiedError('request {} lost , worker {} died'.format(r_id, w_id)))
+            return
+        items = self._expand(seq_id, response, state)
+        with self._lock:
+            if r_id in self._closed or r_id not in self.pending_request:
+                return
+            self._waiting.discard(r_id)
+            self._deadline_of.pop(r_id, None)
+            listener = self._listeners.get(r_id, None)
+            future = self._futures.pop(r_id, None) if listener is None else None
+            if future is not None or (listener is not None and any(self._is_last(item) for item in items)):
+                # a future takes the first response only , the rest of a stream is dropped
+                self._finish(r_id)
+            elif listener is None:
+                self._store(r_id, items)
+        if listener is not None:
+            self._notify(listener, items)
+        elif future is not None:
+            self._resolve(future, items[0])
+
+    def _pop_response(self, request_id, request_seq_id):
+        reps = self.pending_response.get(request_id, None)
+        if reps is None:
+            return None
+        # a closed request answers every seq_id with its error
+        item = reps.pop(SEQ_CLOSED if SEQ_CLOSED in reps else request_seq_id)
+        if len(reps) == 0:
+            self.pending_response.pop(request_id)
+        return item
+
+    def _has_response(self, request_id, request_seq_id):
+        reps = self.pending_response.get(request_id, None)
+        if reps is None:
+            return False
+        return request_seq_id is None or request_seq_id in reps or SEQ_CLOSED in reps
+
+    def _wait_response(self, request_id, request_seq_id, deadline=None):
+        '''
+            hold self._lock , wait until a response of request_id arrives , False on deadline
+        '''
+        if self._has_response(request_id, request_seq_id):
+            return True
+        waiter = self._waiters.get(request_id, None)
+        if waiter is None:
+            waiter = self._waiters[request_id] = [threading.Condition(self._lock), 0]
+        waiter[1] += 1
+        try:
+            while not self._has_response(request_id, request_seq_id):
+                if deadline is None:
+                    waiter[0].wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                waiter[0].wait(remaining)
+            return True
+        finally:
+            waiter[1] -= 1
+            if waiter[1] == 0:
+                self._waiters.pop(request_id)
+
+    # request_seq_id initail 1
+    def get(self, request_id, request_seq_id=None, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            if request_id not in self.pending_request:
+                logger.error('bad request_id {}'.format(request_id))
+                return None
+            if not self._wait_response(request_id, request_seq_id, deadline):
+                raise TimeoutError('request {} no response in {}s'.format(request_id, timeout))
+            item = self._pop_response(request_id, request_seq_id)
+            self._on_read(request_id, item)
+            self._check_and_clean()
+        if item[2] == ResponseState.RS_ERROR:
+            raise item[1]
+        return item[1]
+
+    def iter_results(self, request_id, timeout=None):
+        '''
+            yield the responses of request_id in seq_id order , stop at end of stream , a non generator result is yielded once
+            timeout : max wait for each response , raise TimeoutError
+        '''
+        seq_id = None
+        while True:
+            deadline = None if timeout is None else time.time() + timeout
+            with self._lock:
+                if request_id not in self.pending_request:
+                    logger.error('bad request_id {}'.format(request_id))
+                    return
+                if seq_id is None:
+                    # seq_id 0 is a plain result , a stream starts at 1
+                    if not self._wait_response(request_id, None, deadline):
+                        raise TimeoutError('request {} no response in {}s'.format(request_id, timeout))
+                    seq_id = 0 if 0 in self.pending_response[request_id] else 1
+                if not self._wait_response(request_id, seq_id, deadline):
+                    raise TimeoutError('request {} seq {} no response in {}s'.format(request_id, seq_id, timeout))
+                item = self._pop_response(request_id, seq_id)
+                self._on_read(request_id, item)
+            if item[2] == ResponseState.RS_END:
+                return
+            if item[2] == ResponseState.RS_ERROR:
+                raise item[1]
+            yield item[1]
+            if seq_id == 0:
+                return
+            seq_id += 1
+
+    def get_many(self, request_ids, timeout=None):
+        '''
+            first response of every request_id , in the given order
+            raise TimeoutError when they are not all there within timeout , nothing is consumed then
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            for request_id in request_ids:
+                if request_id not in self.pending_request:
+                    continue
+                if not self._wait_response(request_id, None, deadline):
+                    raise TimeoutError('request {} not finished in {}s'.format(request_id, timeout))
+            # a repeated request_id gets the same response
+            popped = {}
+            t = time.time()
+            for request_id in request_ids:
+                if request_id in popped:
+                    continue
+                if request_id not in self.pending_request:
+                    logger.error('bad request_id {}'.format(request_id))
+                    popped[request_id] = None
+                    continue
+                popped[request_id] = self._pop_response(request_id, None)
+                self._on_read(request_id, popped[request_id], t)
+            items = [popped[request_id] for request_id in request_ids]
+            self._check_and_clean()
+        results = []
+        for item in items:
+            if item is not None and item[2] == ResponseState.RS_ERROR:
+                raise item[1]
+            results.append(None if item is None else item[1])
+        return results
+
+    def _on_read(self, request_id, item, t=None):
+        # hold self._lock , get / iter_results / get_many took item
+        if self._is_last(item):
+            self.pending_response.pop(request_id, None)
+            self._finish(request_id)
+        else:
+            self.pending_request[request_id] = t or time.time()
+
+    def _check_and_clean(self):
+        c_t = time.time()
+        if math.floor((c_t - self.__last_t) / 600) > 0:
+            self.__last_t = c_t
+            invalid = set({rid for rid, t in self.pending_request.items() if math.floor((c_t - t) / 3600) > 0})
+            logger.debug('remove {}'.format(str(list(invalid))))
+            for rid in invalid:
+                self.pending_request.pop(rid)
+            invalid = set({rid for rid, t in self.pending_response.items() if math.floor((c_t - t.time) / 3600) > 0})
+            for rid in invalid:
+                self.pending_response.pop(rid)
+            invalid = set({rid for rid, t in self._closed.items() if math.floor((c_t - t) / 3600) > 0})
+            for rid in invalid:
+                self._closed.pop(rid)
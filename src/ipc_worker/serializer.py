@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 17:35
+# @Author  : tk
+
+import pickle
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# pickle protocol 5 , large contiguous buffers (numpy array , pickle.PickleBuffer) are kept out of band
+# (bytes and bytearray are always pickled in band , wrap them in pickle.PickleBuffer)
+# a message is a list of frames : [pickle stream , buffer 1 , buffer 2 ...]
+# frames are written raw into shared memory (or sent as separate zmq frames) and rebuilt as views on the other side
+OOB_THRESHOLD = 4096
+FRAME_ALIGN = 64
+
+
+def dumps_frames(obj, oob_threshold=OOB_THRESHOLD):
+    buffers = []
+
+    def buffer_callback(b: pickle.PickleBuffer):
+        # return a false value to take the buffer out of band
+        try:
+            raw = b.raw()
+        except BufferError:
+            return True
+        if raw.nbytes < oob_threshold:
+            return True
+        buffers.append(raw)
+        return False
+
+    main = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+    return [main] + buffers
+
+
+def loads_frames(frames):
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+
+def wrap_frames(frames):
+    # frames inside an object pickled with protocol 5 go out of band (see SHM_queue)
+    return [pickle.PickleBuffer(f) for f in frames]
+
+
+def _align(n):
+    return (n + FRAME_ALIGN - 1) & ~(FRAME_ALIGN - 1)
+
+
+def _frame_len(f):
+    return f.nbytes if isinstance(f, memoryview) else len(f)
+
+
+# packed layout : n (int64) , n * len (int64) , then every frame starting at a FRAME_ALIGN boundary
+def packed_size(frames):
+    size = _align(8 + 8 * len(frames))
+    for f in frames:
+        size += _align(_frame_len(f))
+    return size
+
+
+def pack_frames(buf, offset, frames):
+    lens = [_frame_len(f) for f in frames]
+    struct.pack_into('q{}q'.format(len(lens)), buf, offset, len(lens), *lens)
+    pos = offset + _align(8 + 8 * len(lens))
+    for f, n in zip(frames, lens):
+        if n:
+            buf[pos:pos + n] = f if not isinstance(f, memoryview) else f.cast('B')
+        pos += _align(n)
+    return pos - offset
+
+
+def unpack_frames(buf, offset=0):
+    # views into buf , no copy
+    buf = memoryview(buf)
+    n = struct.unpack_from('q', buf, offset)[0]
+    lens = struct.unpack_from('{}q'.format(n), buf, offset + 8)
+    pos = offset + _align(8 + 8 * n)
+    frames = []
+    for size in lens:
+        frames.append(buf[pos:pos + size])
+        pos += _align(size)
+    return frames
+
+
+def frames_nbytes(frames):
+    return sum(_frame_len(f) for f in frames)
+
+
+# codecs : object <-> frames , set per instance , request and response codecs may differ
+# pickle  : protocol 5 with out of band buffers (default)
+# msgpack : one frame , needs msgpack installed , both sides must agree on the types
+# raw     : bytes-like in , one frame out , no serialization , the receiver gets a bytes-like (usually a memoryview)
+#           (a worker's request view is valid until run_once / run_batch returns)
+CODEC_PICKLE = 'pickle'
+CODEC_MSGPACK = 'msgpack'
+CODEC_RAW = 'raw'
+
+
+class Codec:
+    '''
+        dumps(obj) -> frames , loads(frames) -> obj
+        dumps_list / loads_list encode the chunks of a coalesced stream response
+    '''
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, frames):
+        raise NotImplementedError
+
+    def dumps_list(self, objs):
+        return self.dumps(list(objs))
+
+    def loads_list(self, frames):
+        return self.loads(frames)
+
+
+class Pickle_codec(Codec):
+    name = CODEC_PICKLE
+
+    def __init__(self, oob_threshold=OOB_THRESHOLD):
+        self.oob_threshold = oob_threshold
+
+    def dumps(self, obj):
+        return dumps_frames(obj, self.oob_threshold)
+
+    def loads(self, frames):
+        return loads_frames(frames)
+
+
+class Msgpack_codec(Codec):
+    name = CODEC_MSGPACK
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('codec msgpack needs msgpack , pip install msgpack')
+
+    def dumps(self, obj):
+        return [msgpack.packb(obj, use_bin_type=True)]
+
+    def loads(self, frames):
+        return msgpack.unpackb(frames[0], raw=False)
+
+
+class Raw_codec(Codec):
+    name = CODEC_RAW
+
+    def dumps(self, obj):
+        if not isinstance(obj, (bytes, bytearray, memoryview)):
+            raise TypeError('codec raw needs bytes , bytearray or memoryview , got {}'.format(type(obj).__name__))
+        return [obj]
+
+    def loads(self, frames):
+        return frames[0]
+
+    # one frame per chunk
+    def dumps_list(self, objs):
+        frames = []
+        for obj in objs:
+            frames.extend(self.dumps(obj))
+        return frames
+
+    def loads_list(self, frames):
+        return list(frames)
+
+
+def get_codec(codec):
+    if isinstance(codec, Codec):
+        return codec
+    if codec == CODEC_PICKLE:
+        return Pickle_codec()
+    if codec == CODEC_MSGPACK:
+        return Msgpack_codec()
+    if codec == CODEC_RAW:
+        return Raw_codec()
+    raise ValueError('bad codec {}'.format(codec))
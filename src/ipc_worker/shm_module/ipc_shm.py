@@ -1,13 +1,22 @@
 #coding: utf-8
-import math
 import multiprocessing
 import time
 import threading
-from collections import deque
-from typing import Optional
+from queue import Full
 from .ipc_shm_utils import SHM_manager,SHM_woker
-import pickle
+from .ipc_shm_queue import SHM_queue
+from .ipc_utils_func import C_sharedata
+from .ipc_shm_spill import SHM_spill,Spill_handle
+from .ipc_shm_scheduler import SHM_scheduler,W_ABSENT,W_ACTIVE,W_DRAINING
+from .ipc_shm_cancel import SHM_cancel
+from .ipc_wait import Wait_strategy,Shm_word,atomic_available
+from ..priority import Priority_selector
 from ..utils import logger,Lock as MyLock
+from ..response_dispatcher import Response_dispatcher,WorkerDiedError
+from ..supervisor import Supervisor,Restart_backoff
+from ..ipc_client import IPC_client_mixin
+from ..serializer import wrap_frames,get_codec
+from ..metrics import SHM_metrics
 
 
 class SHM_process_worker(SHM_woker):
@@ -28,163 +37,407 @@ class SHM_process_worker(SHM_woker):
 
 
 
-class IPC_shm:
+class IPC_shm(IPC_client_mixin):
     def __init__(self,
                  CLS_worker,
                  worker_args: tuple,
                  worker_num: int,
                  manager_num: int,
                  group_name,
-                 evt_quit=multiprocessing.Manager().Event(),
+                 evt_quit=None,
                  shm_size=1 * 1024 * 1024,
                  queue_size=20,
                  is_log_time=False,
-                 daemon=False
+                 daemon=False,
+                 slot_num=1,
+                 wait_strategy='spin',
+                 stream_credit=0,
+                 stream_coalesce_ms=0,
+                 stream_coalesce_num=64,
+                 max_batch_size=1,
+                 max_wait_ms=0,
+                 scheduler='least_outstanding',
+                 worker_weights=None,
+                 codec='pickle',
+                 request_codec=None,
+                 response_codec=None,
+                 metrics=True,
+                 max_worker_num=None,
+                 supervise=True,
+                 supervise_interval=0.5,
+                 max_retries=0,
+                 shard=False,
+                 priorities=1,
+                 priority_policy='strict',
+                 priority_weights=None,
                  ):
         self.__manager_lst = []
         self.__woker_lst = []
-        self.__signal_list = []
         self.__shm_name_list = []
 
-        self.__input_queue = None
+        self.__lanes = []
         self.__output_queue = None
 
 
         self.request_id = 0
-        self.pending_request = {}
-        self.pending_response = {}
-
         self.locker = MyLock()
+        self.__group_name = group_name
+        # created here , a Manager().Event() default argument started a server process at import
+        if evt_quit is None:
+            evt_quit = multiprocessing.Event()
+        self.__evt_quit = evt_quit
 
         assert isinstance(worker_args, tuple)
-        self.__input_queue = multiprocessing.Manager().Queue(queue_size)
-        self.__output_queue = multiprocessing.Manager().Queue(queue_size)
+        # pickle | msgpack | raw | Codec instance , request_codec / response_codec default to codec
+        self.__request_codec = get_codec(request_codec if request_codec is not None else codec)
+        self.__response_codec = get_codec(response_codec if response_codec is not None else codec)
+        # a batch is gathered from the worker's request ring
+        assert max_batch_size <= 1 or slot_num >= max_batch_size,'max_batch_size needs slot_num >= max_batch_size'
+        # client <-> manager 队列在共享内存中 , put/get 不再是到 Manager 服务进程的 RPC
+        # shard : every manager owns the workers i % manager_num == idx and an input lane of its own ,
+        # put picks the lane with the most free workers , an idle manager steals from the longest other lane
+        self.__shard = shard and manager_num > 1
+        # priorities : one queue per priority in every lane , put(data,priority=p) , 0 the highest ,
+        # a manager with a free worker takes the next request by priority_policy strict | weighted (priority_weights) , see priority.py
+        self.__priority = Priority_selector(priorities,priority_policy,priority_weights)
+        self.__lanes = [[SHM_queue('{}_input_queue{}{}'.format(group_name,
+                                                                '_{}'.format(m) if self.__shard else '',
+                                                                '_p{}'.format(p) if p else ''),
+                                   queue_size,queue_size * shm_size) for p in range(priorities)]
+                        for m in range(manager_num if self.__shard else 1)]
+        self.__lane_cursor = 0
+        # shard or priority lanes : managers poll their queues and sleep on the bell
+        self.__is_polling = self.__shard or priorities > 1
+        self.__output_queue = SHM_queue('{}_output_queue'.format(group_name), queue_size, queue_size * shm_size)
+
+        # ring and polling mode managers sleep on this word , bumped by client put and worker response
+        self.__slot_num = slot_num
+        self.__use_bell = slot_num > 1 or self.__is_polling
+        self.__bell_name = '{}_bell'.format(group_name)
+        self.__s_bell = C_sharedata(name=self.__bell_name,create=True,size=64)
+        # client and every worker bump it , fetch_add holds this lock without libatomic
+        self.__bell_lock = None if atomic_available() else multiprocessing.Lock()
+        self.__bell = Shm_word(self.__s_bell.buf,0,self.__bell_lock)
+        self.__waiter = Wait_strategy(wait_strategy)
+
+        # worker slots , add_workers can grow the pool up to max_worker_num at runtime
+        max_worker_num = max(max_worker_num or worker_num,worker_num)
+        # deadlines and cancelled requests , checked by managers before dispatch and by workers (is_cancelled)
+        self.__cancel_table = SHM_cancel('{}_cancel'.format(group_name))
+        # counters and latency histograms of every worker and manager , see stats()
+        self.__metrics = SHM_metrics('{}_metrics'.format(group_name),max_worker_num,manager_num) if metrics else None
 
-        semaphore = multiprocessing.Manager().Semaphore(worker_num)
+        # least_outstanding | round_robin | weighted (worker_weights) | Scheduler_policy instance
+        # also the slot table (active / draining / retired) managers and workers follow
+        self.__scheduler = SHM_scheduler('{}_sched'.format(group_name),max_worker_num,
+                                         capacity=slot_num,policy=scheduler,weights=worker_weights,
+                                         active_num=worker_num,manager_num=manager_num)
 
+        # supervise : dead workers and managers are started again , a request on a dead worker is sent again
+        # up to max_retries times while none of its responses reached the client , else it fails with WorkerDiedError
+        self.__supervise = supervise
+        self.__supervise_interval = supervise_interval
+        self.__supervisor = None
+        self.__backoff = Restart_backoff()
+        # (kind,idx) -> time to start it again
+        self.__restart_at = {}
+
+        # a slot keeps its name across add / remove , the worker sleeps on a word of its own shm and the manager wakes it
+        self.__shm_name_list = ['{}_jid_{}'.format(group_name, i) for i in range(max_worker_num)]
+        self.__scale_lock = threading.Lock()
+        self.__new_worker = lambda i: CLS_worker(
+            *worker_args,
+            evt_quit,
+            self.__shm_name_list[i],
+            shm_size,
+            is_log_time=is_log_time,
+            idx=i,
+            group_name=group_name,
+            slot_num=slot_num,
+            wait_strategy=wait_strategy,
+            bell_name=self.__bell_name,
+            bell_lock=self.__bell_lock,
+            stream_credit=stream_credit,
+            stream_coalesce_ms=stream_coalesce_ms,
+            stream_coalesce_num=stream_coalesce_num,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            request_codec=self.__request_codec,
+            response_codec=self.__response_codec,
+            cancel_table=self.__cancel_table,
+            metrics=self.__metrics,
+            scheduler=self.__scheduler,
+            supervised=supervise,
+            daemon=daemon)
         for i in range(worker_num):
-            shm_name = '{}_jid_{}'.format(group_name, i)
-            worker = CLS_worker(
-                *worker_args,
-                evt_quit,
-                semaphore,
-                shm_name,
-                shm_size,
-                is_log_time=is_log_time,
-                idx=i,
-                group_name=group_name,
-                daemon=daemon)
-            self.__signal_list.append(worker.get_signal())
-            self.__shm_name_list.append(shm_name)
-            self.__woker_lst.append(worker)
-
-        semaphore = multiprocessing.Manager().Semaphore(manager_num)
+            self.__woker_lst.append(self.__new_worker(i))
+        self.__new_manager = lambda i: SHM_manager(evt_quit,
+                                                   self.__scheduler,
+                                                   self.__shm_name_list,
+                                                   self.__lanes[i % len(self.__lanes)][0],
+                                                   self.__output_queue,
+                                                   is_log_time=is_log_time,
+                                                   idx=i,
+                                                   slot_num=slot_num,
+                                                   manager_num=manager_num,
+                                                   wait_strategy=wait_strategy,
+                                                   bell_name=self.__bell_name,
+                                                   group_name=group_name,
+                                                   cancel_table=self.__cancel_table,
+                                                   metrics=self.__metrics,
+                                                   max_retries=max_retries,
+                                                   lanes=self.__lanes if self.__is_polling else None,
+                                                   shard=self.__shard,
+                                                   priority_policy=priority_policy,
+                                                   priority_weights=priority_weights)
         for i in range(manager_num):
-            manager = SHM_manager(evt_quit,
-                                  self.__signal_list,
-                                  semaphore,
-                                  self.__shm_name_list,
-                                  self.__input_queue,
-                                  self.__output_queue,
-                                  is_log_time=is_log_time,
-                                  idx=i)
-            self.__manager_lst.append(manager)
-        self.__last_t = time.time()
-    def start(self):
-        for w in self.__woker_lst:
-            w.start()
-        for w in self.__manager_lst:
+            self.__manager_lst.append(self.__new_manager(i))
+
+        # requests larger than shm_size go to spill blocks , only the handle passes through queue and slot
+        self.__shm_size = shm_size
+        self.__spill = SHM_spill('{}_c'.format(group_name))
+
+        # one thread drains output queue and resolves responses by request_id
+        self._dispatcher = Response_dispatcher(self.__output_queue.get,self._decode,name='{}_dispatcher'.format(group_name))
+        self.pending_request = self._dispatcher.pending_request
+        self.pending_response = self._dispatcher.pending_response
+
+    def start(self,wait_ready=True,timeout=None):
+        '''
+            start every process without waiting for any of them ,
+            wait_ready : return once every worker is through run_begin (TimeoutError after timeout) with the startup timing , see _wait_ready
+        '''
+        t_start = time.time()
+        for w in self.__woker_lst + self.__manager_lst:
             w.start()
+            w.t_start = time.time()
+        self._dispatcher.start()
+        if self.__supervise:
+            self.__supervisor = Supervisor(self._supervise,self.__supervise_interval,name='{}_supervisor'.format(self.__group_name))
+            self.__supervisor.start()
+        if wait_ready:
+            return self._wait_ready(lambda: list(self.__woker_lst),t_start,timeout,supervised=self.__supervise)
 
-    def put(self,data):
+    def _put(self,data,future=None,listener=None,block=True,deadline=None,priority=0):
+        self.__priority.check(priority)
+        # encode before the request is registered , a codec error leaves nothing behind
+        frames = self.__request_codec.dumps(data)
         self.locker.acquire()
-        self.request_id += 1
-        request_id = self.request_id
-        self.pending_request[request_id] = time.time()
-        self.__input_queue.put((request_id,pickle.dumps(data)))
-        self.locker.release()
+        try:
+            self.request_id += 1
+            request_id = self.request_id
+            self._dispatcher.add_request(request_id,future,listener,deadline=deadline)
+            if deadline is not None:
+                self.__cancel_table.set_deadline(request_id,deadline)
+            payload = None
+            try:
+                # protocol 5 frames , large buffers are copied raw into the queue
+                payload = self.__spill.maybe_spill(frames,self.__shm_size - 16)
+                if not isinstance(payload,Spill_handle):
+                    payload = wrap_frames(payload)
+                self.__lanes[self.__pick_lane()][priority].put((request_id,payload,time.time()),block=block)
+            except BaseException:
+                # Full , or anything else , the request never reached a queue
+                if payload is not None:
+                    self.__spill.release(payload)
+                self._dispatcher.remove_listener(request_id)
+                raise
+            if self.__use_bell:
+                self.__ring_bell()
+        finally:
+            self.locker.release()
         return request_id
 
+    def _put_many(self,data_list,futures=None,deadline=None,priority=0):
+        self.__priority.check(priority)
+        frames_list = [self.__request_codec.dumps(data) for data in data_list]
+        self.locker.acquire()
+        try:
+            request_ids = list(range(self.request_id + 1,self.request_id + 1 + len(frames_list)))
+            self.request_id += len(frames_list)
+            self._dispatcher.add_requests(request_ids,futures,deadline=deadline)
+            if deadline is not None:
+                for request_id in request_ids:
+                    self.__cancel_table.set_deadline(request_id,deadline)
+            items = []
+            t_put = time.time()
+            try:
+                for request_id,frames in zip(request_ids,frames_list):
+                    payload = self.__spill.maybe_spill(frames,self.__shm_size - 16)
+                    if not isinstance(payload,Spill_handle):
+                        payload = wrap_frames(payload)
+                    items.append((request_id,payload,t_put))
+            except BaseException:
+                for _,payload,_ in items:
+                    self.__spill.release(payload)
+                for request_id in request_ids:
+                    self._dispatcher.remove_listener(request_id)
+                raise
+            # shard : round robin over the lanes from the one with the most free workers
+            n = len(self.__lanes)
+            first = self.__pick_lane()
+            for k in range(min(n,len(items))):
+                self.__lanes[(first + k) % n][priority].put_many(items[k::n],on_put=self.__ring_bell if self.__use_bell else None)
+        finally:
+            self.locker.release()
+        return request_ids
+
+    def __pick_lane(self):
+        # shard : the lane with the most free workers less queued requests , ties round robin ,
+        # lanes of managers without an active worker only when every lane is so
+        if not self.__shard:
+            return 0
+        n = len(self.__lanes)
+        self.__lane_cursor = (self.__lane_cursor + 1) % n
+        free_list = self.__scheduler.shard_free(n)
+        best,best_score = None,None
+        for k in range(n):
+            m = (self.__lane_cursor + k) % n
+            free = free_list[m]
+            score = float('inf') if free is None else sum(q.qsize() for q in self.__lanes[m]) - free
+            if best is None or score < best_score:
+                best,best_score = m,score
+        return best
 
-    def _check_and_clean(self):
-        c_t = time.time()
-        if math.floor((c_t - self.__last_t) / 600) > 0:
-            self.__last_t = c_t
-            invalid = set({rid for rid, t in self.pending_request.items() if math.floor((c_t - t) / 3600) > 0})
-            logger.debug('remove {}'.format(str(list(invalid))))
-            for rid in invalid:
-                self.pending_request.pop(rid)
-            invalid = set({rid for rid, t in self.pending_response.items() if math.floor((c_t - t["time"]) / 3600) > 0})
-            for rid in invalid:
-                self.pending_response.pop(rid)
-
-    # request_seq_id initail 1
-    def get(self, request_id, request_seq_id=None):
-        d = self._get_private(request_id, request_seq_id)
+    @property
+    def worker_num(self):
+        return self.__scheduler.states().count(W_ACTIVE)
+
+    @property
+    def _max_worker_num(self):
+        return self.__scheduler.worker_num
+
+    def add_workers(self,n=1):
+        '''
+            start n more workers in free slots (up to max_worker_num) , managers pick them up , return their indexes
+        '''
+        with self.__scale_lock:
+            free = [i for i,state in enumerate(self.__scheduler.states()) if state == W_ABSENT][:n]
+            if len(free) < n:
+                raise ValueError('no free worker slot , max_worker_num {}'.format(self.__scheduler.worker_num))
+            for i in free:
+                self.__start_worker(i)
+        return free
+
+    def __start_worker(self,i):
+        worker = self.__new_worker(i)
+        self.__woker_lst.append(worker)
+        self.__scheduler.set_state(i,W_ACTIVE)
+        worker.start()
+        worker.t_start = time.time()
+        if self.__use_bell:
+            self.__ring_bell()
+
+    def _supervise(self):
+        '''
+            supervisor thread , a dead worker gives up its slot (managers send its requests again or fail them) and a new one
+            takes it , a dead manager is replaced and the request it held fails
+        '''
+        if self.__evt_quit.is_set():
+            return
+        now = time.time()
+        scheduler = self.__scheduler
+        with self.__scale_lock:
+            for w in list(self.__woker_lst):
+                if w.is_alive() or scheduler.state(w._idx) != W_ACTIVE:
+                    continue
+                logger.error('worker {} died , exitcode {}'.format(w._idx,w.exitcode))
+                scheduler.set_state(w._idx,W_ABSENT)
+                if self.__use_bell:
+                    self.__ring_bell()
+                self.__woker_lst.remove(w)
+                w.unlink()
+                self.__restart_at[('worker',w._idx)] = now + self.__backoff.delay(('worker',w._idx),now - w.t_start)
+            for m,p in enumerate(self.__manager_lst):
+                if p.is_alive() or ('manager',m) in self.__restart_at:
+                    continue
+                logger.error('manager {} died , exitcode {}'.format(m,p.exitcode))
+                request_id,sel_id = scheduler.inflight(m)
+                scheduler.set_inflight(m)
+                if request_id:
+                    self._dispatcher.close_request(request_id,WorkerDiedError('request {} lost , manager {} died'.format(request_id,m)))
+                if sel_id >= 0:
+                    # single slot mode , the worker may wait for an ack of the dead manager , it is replaced too ,
+                    # shard mode : an idle worker the manager held is only given back
+                    scheduler.release(sel_id)
+                    for w in self.__woker_lst:
+                        if w._idx == sel_id and request_id:
+                            w.terminate()
+                self.__restart_at[('manager',m)] = now + self.__backoff.delay(('manager',m),now - p.t_start)
+            for (kind,i),t in list(self.__restart_at.items()):
+                if now < t:
+                    continue
+                del self.__restart_at[(kind,i)]
+                if kind == 'manager':
+                    p = self.__manager_lst[i] = self.__new_manager(i)
+                    p.start()
+                    p.t_start = time.time()
+                elif scheduler.state(i) == W_ABSENT:
+                    # add_workers may have taken the slot meanwhile
+                    self.__start_worker(i)
+
+    def remove_workers(self,n=1,timeout=None):
+        '''
+            drain and stop n workers (the newest first , one always stays) , return their indexes
+            a draining worker gets no new requests and leaves after its outstanding ones , terminated after timeout
+        '''
+        with self.__scale_lock:
+            active = [i for i,state in enumerate(self.__scheduler.states()) if state == W_ACTIVE]
+            victims = active[::-1][:max(min(n,len(active) - 1),0)]
+            for i in victims:
+                self.__scheduler.set_state(i,W_DRAINING)
+            deadline = None if timeout is None else time.time() + timeout
+            for i in victims:
+                worker = [w for w in self.__woker_lst if w._idx == i][0]
+                while worker.is_alive():
+                    # ring mode : the owning manager retires a drained worker , single slot mode : the worker itself ,
+                    # both notice it within the idle wait timeout
+                    if self.__slot_num > 1:
+                        self.__ring_bell()
+                    worker.join(0.05)
+                    if deadline is not None and time.time() > deadline and worker.is_alive():
+                        logger.warning('worker {} not drained in {}s , terminated'.format(i,timeout))
+                        worker.terminate()
+                        worker.join()
+                self.__woker_lst.remove(worker)
+                worker.unlink()
+                self.__scheduler.set_state(i,W_ABSENT)
+        return victims
+
+    def _cancel(self,request_id):
+        self.__cancel_table.cancel(request_id)
+
+    def _stats(self):
+        d = self.__metrics.snapshot() if self.__metrics is not None else {'workers': [],'managers': []}
+        d['group'] = self.__group_name
+        # only the slots in use
+        states = self.__scheduler.states()
+        d['workers'] = [w for w in d['workers'] if states[w['idx']] != W_ABSENT]
+        d['queue'] = dict(input=sum(q.qsize() for lane in self.__lanes for q in lane),
+                          output=self.__output_queue.qsize(),
+                          **self._dispatcher.depth())
+        if len(self.__lanes[0]) > 1:
+            for p in range(1,len(self.__lanes[0])):
+                d['queue']['input_p{}'.format(p)] = sum(lane[p].qsize() for lane in self.__lanes)
         return d
-        # return d if d is None else pickle.loads(d)
-    def _get_private(self, request_id, request_seq_id=None):
-        response = None
-        is_end = False
-        timeout = 0.005
-        while not is_end:
-            with self.locker:
-                if request_id in self.pending_request:
-                    up_time = time.time()
-                    self.pending_request[request_id] = up_time
-                    reps = self.pending_response.get(request_id, None)
-                    if reps is not None:
-                        reps["time"] = up_time
-                        rep: Optional[deque] = reps["data"]
-                        item_size = len(rep)
-                        if item_size > 0:
-                            if request_seq_id is None:
-                                (seq_id, response) = rep.popleft()
-                                is_end = True
-                            else:
-                                for i, rep_sub in enumerate(rep):
-                                    if rep_sub[0] == request_seq_id:
-                                        (seq_id, response) = rep_sub
-                                        rep.remove(rep_sub)
-                                        is_end = True
-                                        break
-
-                        if len(rep) == 0:
-                            self.pending_response.pop(request_id)
-
-                    if not is_end:
-                        is_empty = False
-                        try:
-                            item = self.__output_queue.get(block=False, timeout=timeout)
-                        except:
-                            item = None
-                            is_empty = True
-                        if not is_empty:
-                            r_id, w_id, seq_id, response = item
-                            if r_id != request_id or (request_seq_id is not None and request_seq_id != seq_id):
-                                if r_id in self.pending_response:
-                                    rep: Optional[deque] = self.pending_response[r_id]["data"]
-                                    for i, node in enumerate(rep):
-                                        if seq_id > node[0]:
-                                            rep.insert(i + 1, (seq_id, response))
-                                            break
-                                else:
-                                    self.pending_response[r_id] = {
-                                        "time": time.time(),
-                                        "data": deque([(seq_id, response)]),
-                                        "last_seq": seq_id - 1,
-                                    }
-                            else:
-                                is_end = True
-                else:
-                    logger.error('bad request_id {}'.format(request_id))
-                    is_end = True
-
-                if is_end:
-                    self._check_and_clean()
-                if is_end:
-                    break
-        return response
+
+    def __ring_bell(self):
+        self.__bell.fetch_add(1)
+        if self.__is_polling:
+            # polling managers (shard , priority lanes) sleep on it whatever the wait strategy
+            self.__bell.wake()
+        else:
+            self.__waiter.wake(self.__bell)
+
+    def _decode(self,payload,is_chunks=False):
+        if isinstance(payload,Spill_handle):
+            # copy out of the spill block so it can go back to the worker pool
+            frames = [bytearray(f) for f in self.__spill.frames(payload)]
+            self.__spill.release(payload)
+            payload = frames
+        if is_chunks:
+            return self.__response_codec.loads_list(payload)
+        return self.__response_codec.loads(payload)
 
     def join(self,timeout=None):
         for p in self.__manager_lst:
@@ -193,12 +446,26 @@ class IPC_shm:
             p.join(timeout)
 
     def terminate(self):
+        if self.__supervisor is not None:
+            self.__supervisor.stop()
+            self.__supervisor.join()
+        self._stop_autoscaler()
+        self._stop_metrics_server()
+        self._dispatcher.stop()
         for p in self.__woker_lst + self.__manager_lst:
             try:
                 p.release()
             except Exception as e:
                 pass
             p.terminate()
+        for q in [q for lane in self.__lanes for q in lane] + [self.__output_queue,self.__scheduler,self.__cancel_table,self.__metrics]:
+            if q is not None:
+                q.unlink()
+        self.__spill.close()
+        try:
+            self.__s_bell.shm.unlink()
+        except Exception:
+            pass
 
     @property
     def manager_process_list(self):
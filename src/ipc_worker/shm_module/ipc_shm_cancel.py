@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 22:10
+# @Author  : tk
+
+import struct
+from time import time
+from .ipc_utils_func import C_sharedata
+
+# 取消 / 截止时间表 , 客户端写入 , manager 派发前和 worker 运行中读取
+# 第 request_id % entry_num 项: request_id (int64) , deadline (float64 , 0 表示无) , cancelled (int64)
+# 项被更新的请求覆盖后 , 旧请求视为未取消 (早于 entry_num 个请求之前)
+CANCEL_ENTRY_SIZE = 24
+
+
+class SHM_cancel:
+    def __init__(self, name, entry_num=4096):
+        self._name = name
+        self._entry_num = entry_num
+        self._s_data = C_sharedata(name=name, create=True, size=CANCEL_ENTRY_SIZE * entry_num)
+        self._s_data.buf[:CANCEL_ENTRY_SIZE * entry_num] = bytes(CANCEL_ENTRY_SIZE * entry_num)
+        self._is_owner = True
+
+    def __getstate__(self):
+        return self._name, self._entry_num
+
+    def __setstate__(self, state):
+        self._name, self._entry_num = state
+        self._s_data = C_sharedata(name=self._name, create=False)
+        self._is_owner = False
+
+    def _offset(self, request_id):
+        return CANCEL_ENTRY_SIZE * (request_id % self._entry_num)
+
+    def set_deadline(self, request_id, deadline):
+        offset = self._offset(request_id)
+        # request_id last , a reader never pairs it with the fields of the previous entry
+        struct.pack_into('dq', self._s_data.buf, offset + 8, deadline, 0)
+        struct.pack_into('q', self._s_data.buf, offset, request_id)
+
+    def cancel(self, request_id):
+        offset = self._offset(request_id)
+        if struct.unpack_from('q', self._s_data.buf, offset)[0] == request_id:
+            struct.pack_into('q', self._s_data.buf, offset + 16, 1)
+        else:
+            struct.pack_into('dq', self._s_data.buf, offset + 8, 0.0, 1)
+            struct.pack_into('q', self._s_data.buf, offset, request_id)
+
+    def is_dead(self, request_id):
+        '''
+            cancelled or past its deadline
+        '''
+        rid, deadline, cancelled = struct.unpack_from('qdq', self._s_data.buf, self._offset(request_id))
+        if rid != request_id:
+            return False
+        return cancelled != 0 or (deadline > 0 and time() > deadline)
+
+    def close(self):
+        self._s_data.close()
+
+    def unlink(self):
+        if self._is_owner:
+            try:
+                self._s_data.shm.unlink()
+            except Exception:
+                pass
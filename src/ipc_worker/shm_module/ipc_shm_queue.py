@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 10:12
+# @Author  : tk
+
+import multiprocessing
+import pickle
+import struct
+import time
+from queue import Empty, Full
+from .ipc_utils_func import C_sharedata
+from ..serializer import packed_size, pack_frames, unpack_frames
+
+# 有界多生产者多消费者队列 , 数据在共享内存中 , 不经过 Manager 服务进程.
+# 控制头: head,tail,count,used,maxsize,data_size,free (int64)
+# 数据区为字节环 , 每条记录: len (int64) + 数据 (按 8 字节对齐) , len == -1 表示回绕到数据区开头
+# 数据为 pickle protocol 5 的 frames , 对象中的 pickle.PickleBuffer 不进入 pickle 流 , 直接拷贝进共享内存
+# get 在锁内只取走记录 (head) , 锁外从共享内存反序列化 , 再标记为已读 (len = -len - 2) , free 按顺序回收已读记录的空间
+QUEUE_CTL_SIZE = 64
+QUEUE_WRAP = -1
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+class SHM_queue:
+    def __init__(self, name, maxsize, data_size):
+        self.name = name
+        self.maxsize = max(maxsize, 1)
+        self.data_size = _align8(data_size)
+        self._s_data = C_sharedata(name=name, create=True, size=QUEUE_CTL_SIZE + self.data_size)
+        struct.pack_into('7q', self._s_data.buf, 0, 0, 0, 0, 0, self.maxsize, self.data_size, 0)
+        self._lock = multiprocessing.Lock()
+        self._not_empty = multiprocessing.Condition(self._lock)
+        self._not_full = multiprocessing.Condition(self._lock)
+        self._is_owner = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_s_data')
+        state['_is_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._s_data = C_sharedata(name=self.name, create=False)
+
+    @property
+    def buf(self):
+        return self._s_data.buf
+
+    def qsize(self):
+        return struct.unpack_from('q', self.buf, 16)[0]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def _try_put(self, frames, size):
+        buf = self.buf
+        head, tail, count, used = struct.unpack_from('4q', buf, 0)
+        if count >= self.maxsize:
+            return False
+        need = 8 + _align8(size)
+        skip = 0
+        if tail + need > self.data_size:
+            skip = self.data_size - tail
+        if used + skip + need > self.data_size:
+            return False
+        if skip:
+            struct.pack_into('q', buf, QUEUE_CTL_SIZE + tail, QUEUE_WRAP)
+            tail = 0
+        offset = QUEUE_CTL_SIZE + tail
+        struct.pack_into('q', buf, offset, size)
+        pack_frames(buf, offset + 8, frames)
+        tail = (tail + need) % self.data_size
+        struct.pack_into('q', buf, 8, tail)
+        struct.pack_into('2q', buf, 16, count + 1, used + skip + need)
+        return True
+
+    def _take_one(self):
+        '''
+            under the lock , the oldest record is taken off the queue but its space stays in use until _release ,
+            return (offset,size) of the record
+        '''
+        buf = self.buf
+        head, _, count = struct.unpack_from('3q', buf, 0)
+        size = struct.unpack_from('q', buf, QUEUE_CTL_SIZE + head)[0]
+        if size == QUEUE_WRAP:
+            head = 0
+            size = struct.unpack_from('q', buf, QUEUE_CTL_SIZE)[0]
+        offset = QUEUE_CTL_SIZE + head
+        struct.pack_into('q', buf, 0, (head + 8 + _align8(size)) % self.data_size)
+        struct.pack_into('q', buf, 16, count - 1)
+        return offset, size
+
+    def _release(self, offset, size):
+        '''
+            under the lock , mark the record read and reclaim the read records from free on , in queue order
+        '''
+        buf = self.buf
+        struct.pack_into('q', buf, offset, -size - 2)
+        head, tail, count, used = struct.unpack_from('4q', buf, 0)
+        free = struct.unpack_from('q', buf, 48)[0]
+        # records from head on are not read yet , a wrap marker at head is still needed by the next reader
+        while used > 0 and (free != head or count == 0):
+            n = struct.unpack_from('q', buf, QUEUE_CTL_SIZE + free)[0]
+            if n == QUEUE_WRAP:
+                used -= self.data_size - free
+                free = 0
+            elif n <= -2:
+                used -= 8 + _align8(-n - 2)
+                free = (free + 8 + _align8(-n - 2)) % self.data_size
+            else:
+                # taken by a consumer that is still reading it , or not read yet
+                break
+        if used == 0 and count == 0:
+            head, tail, free = 0, 0, 0
+        struct.pack_into('4q', buf, 0, head, tail, count, used)
+        struct.pack_into('q', buf, 48, free)
+
+    def _loads(self, offset, size):
+        # the pickle stream is read straight from shared memory , out of band buffers are copied once , the record is reused after _release
+        frames = unpack_frames(self.buf[offset + 8:offset + 8 + size])
+        try:
+            return pickle.loads(frames[0], buffers=[bytearray(f) for f in frames[1:]])
+        finally:
+            for f in frames:
+                f.release()
+
+    def _dumps(self, obj):
+        buffers = []
+        # every PickleBuffer goes out of band
+        main = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        frames = [main] + [b.raw() for b in buffers]
+        size = packed_size(frames)
+        if 8 + _align8(size) > self.data_size:
+            raise ValueError('item size {} exceed queue size {}'.format(size, self.data_size))
+        return frames, size
+
+    def put(self, obj, block=True, timeout=None):
+        frames, size = self._dumps(obj)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._not_full:
+            while not self._try_put(frames, size):
+                if not block:
+                    raise Full
+                if deadline is None:
+                    self._not_full.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._not_full.wait(remaining):
+                        raise Full
+            self._not_empty.notify()
+
+    def put_many(self, objs, on_put=None):
+        '''
+            blocking , write as many items as fit per lock hold , consumers are woken after every round
+            on_put() is called after every round too
+        '''
+        items = [self._dumps(obj) for obj in objs]
+        i = 0
+        with self._not_full:
+            while i < len(items):
+                n = i
+                while i < len(items) and self._try_put(*items[i]):
+                    i += 1
+                if i > n:
+                    self._not_empty.notify_all()
+                    if on_put is not None:
+                        on_put()
+                if i < len(items):
+                    self._not_full.wait()
+
+    def put_nowait(self, obj):
+        return self.put(obj, block=False)
+
+    def get(self, block=True, timeout=None):
+        # 非阻塞轮询时先不加锁检查 , 空队列不产生任何系统调用
+        if not block and self.qsize() == 0:
+            raise Empty
+        deadline = None if timeout is None else time.time() + timeout
+        with self._not_empty:
+            while self.qsize() == 0:
+                if not block:
+                    raise Empty
+                if deadline is None:
+                    self._not_empty.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._not_empty.wait(remaining):
+                        raise Empty
+            offset, size = self._take_one()
+        # 反序列化不持有锁 , 锁持有时间与数据大小无关
+        try:
+            return self._loads(offset, size)
+        finally:
+            with self._not_full:
+                self._release(offset, size)
+                # 不同大小的写入者等待的空间不同 , 全部唤醒
+                self._not_full.notify_all()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def close(self):
+        self._s_data.close()
+
+    def unlink(self):
+        if self._is_owner:
+            try:
+                self._s_data.shm.unlink()
+            except Exception:
+                pass
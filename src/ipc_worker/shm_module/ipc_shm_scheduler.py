@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 19:20
+# @Author  : tk
+
+import multiprocessing
+import struct
+import time
+from .ipc_utils_func import C_sharedata
+from .ipc_wait import Shm_word, atomic_available, idle_strategy
+
+# 调度策略: 为下一个请求选择 worker
+# least_outstanding : 未完成请求最少的 worker , 相同时从游标处轮转
+# round_robin       : 从游标处起第一个有空闲容量的 worker
+# weighted          : (未完成请求数 + 1) / 权重 最小的 worker , 权重可按 worker 的算力设置
+SCHED_LEAST_OUTSTANDING = 'least_outstanding'
+SCHED_ROUND_ROBIN = 'round_robin'
+SCHED_WEIGHTED = 'weighted'
+
+# worker slot 状态 , 运行中增删 worker 时 managers 按此表跟随
+# draining : 不再派发新请求 , 没有未完成请求后转为 retired , worker 随即退出 , join 后 slot 回到 absent
+W_ABSENT = 0
+W_ACTIVE = 1
+W_DRAINING = 2
+W_RETIRED = 3
+
+
+class Scheduler_policy:
+    '''
+        select(loads,capacity,cursor) -> worker index , None when every worker is full
+        loads : outstanding requests per worker , cursor : worker after the last selected one
+    '''
+    def select(self, loads, capacity, cursor):
+        raise NotImplementedError
+
+
+class Least_outstanding_policy(Scheduler_policy):
+    def select(self, loads, capacity, cursor):
+        n = len(loads)
+        best = None
+        for k in range(n):
+            i = (cursor + k) % n
+            if loads[i] < capacity and (best is None or loads[i] < loads[best]):
+                best = i
+                if loads[i] == 0:
+                    break
+        return best
+
+
+class Round_robin_policy(Scheduler_policy):
+    def select(self, loads, capacity, cursor):
+        n = len(loads)
+        for k in range(n):
+            i = (cursor + k) % n
+            if loads[i] < capacity:
+                return i
+        return None
+
+
+class Weighted_policy(Scheduler_policy):
+    def __init__(self, weights):
+        assert all(w > 0 for w in weights), 'worker weights must be positive'
+        self.weights = list(weights)
+
+    def select(self, loads, capacity, cursor):
+        n = len(loads)
+        best = None
+        best_score = None
+        for k in range(n):
+            i = (cursor + k) % n
+            if loads[i] >= capacity:
+                continue
+            score = (loads[i] + 1) / self.weights[i]
+            if best is None or score < best_score:
+                best, best_score = i, score
+        return best
+
+
+def get_policy(policy, worker_num, weights=None):
+    if isinstance(policy, Scheduler_policy):
+        return policy
+    if policy == SCHED_LEAST_OUTSTANDING:
+        return Least_outstanding_policy()
+    if policy == SCHED_ROUND_ROBIN:
+        return Round_robin_policy()
+    if policy == SCHED_WEIGHTED:
+        weights = list(weights) if weights is not None else []
+        assert len(weights) <= worker_num, 'worker_weights needs one weight per worker'
+        # slots beyond the initial workers (add_workers) weigh 1
+        weights += [1] * (worker_num - len(weights))
+        return Weighted_policy(weights)
+    raise ValueError('bad scheduler {}'.format(policy))
+
+
+class SHM_scheduler:
+    '''
+        worker load counters and slot states in shared memory , shared by all managers
+        layout : cursor , version , changes , sleepers (int32) , outstanding , state , generation (int32 * worker_num each) ,
+        in flight request of each manager : request_id , worker (int64 * 2 * manager_num) , read by the supervisor when a manager dies
+        worker_num is the slot count , the first active_num slots start active
+        outstanding counters and state transitions are compare and swap on the words , no lock and no server process ,
+        acquire sleeps on changes (bumped by release and state changes) until the policy finds an active worker below capacity ,
+        requests are never requeued
+        version is bumped by every state change , generation by every activation of a slot
+    '''
+    def __init__(self, name, worker_num, capacity=1, policy=SCHED_LEAST_OUTSTANDING, weights=None, active_num=None,
+                 manager_num=1):
+        self._name = name
+        self._worker_num = worker_num
+        self._manager_num = manager_num
+        self._capacity = capacity
+        self._policy = get_policy(policy, worker_num, weights)
+        # only without libatomic , Shm_word.cas then holds it
+        self._lock = None if atomic_available() else multiprocessing.Lock()
+        self._s_data = C_sharedata(name=name, create=True, size=self._inflight_offset() + 16 * manager_num)
+        active_num = worker_num if active_num is None else active_num
+        states = [W_ACTIVE if i < active_num else W_ABSENT for i in range(worker_num)]
+        gens = [1 if i < active_num else 0 for i in range(worker_num)]
+        struct.pack_into('4i{}i'.format(3 * worker_num), self._s_data.buf, 0, 0, 0, 0, 0, *([0] * worker_num + states + gens))
+        struct.pack_into('{}q'.format(2 * manager_num), self._s_data.buf, self._inflight_offset(), *([0, -1] * manager_num))
+        self._is_owner = True
+        self._init_words()
+
+    def __getstate__(self):
+        return self._name, self._worker_num, self._manager_num, self._capacity, self._policy, self._lock
+
+    def __setstate__(self, state):
+        self._name, self._worker_num, self._manager_num, self._capacity, self._policy, self._lock = state
+        self._s_data = C_sharedata(name=self._name, create=False)
+        self._is_owner = False
+        self._init_words()
+
+    def _init_words(self):
+        buf = self._s_data.buf
+        n = self._worker_num
+        self._version = Shm_word(buf, 4, self._lock)
+        self._changes = Shm_word(buf, 8, self._lock)
+        self._sleepers = Shm_word(buf, 12, self._lock)
+        self._load_words = [Shm_word(buf, 16 + 4 * i, self._lock) for i in range(n)]
+        self._state_words = [Shm_word(buf, 16 + 4 * (n + i), self._lock) for i in range(n)]
+        self._idle = idle_strategy()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def worker_num(self):
+        return self._worker_num
+
+    def loads(self):
+        return list(struct.unpack_from('{}i'.format(self._worker_num), self._s_data.buf, 16))
+
+    def version(self):
+        return self._version.get()
+
+    def states(self):
+        return list(struct.unpack_from('{}i'.format(self._worker_num), self._s_data.buf, 16 + 4 * self._worker_num))
+
+    def state(self, i):
+        return self._state_words[i].get()
+
+    def generation(self, i):
+        return struct.unpack_from('i', self._s_data.buf, 16 + 4 * (2 * self._worker_num + i))[0]
+
+    def _inflight_offset(self):
+        # int64 aligned after the int32 arrays
+        return (16 + 12 * self._worker_num + 7) // 8 * 8
+
+    def set_inflight(self, m, request_id=0, worker=-1):
+        # manager m took request_id (0 none) , worker : where it runs (single slot mode) or -1
+        struct.pack_into('qq', self._s_data.buf, self._inflight_offset() + 16 * m, request_id, worker)
+
+    def inflight(self, m):
+        return struct.unpack_from('qq', self._s_data.buf, self._inflight_offset() + 16 * m)
+
+    def _notify(self):
+        self._changes.fetch_add(1)
+        if self._sleepers.get() > 0:
+            self._changes.wake()
+
+    def set_state(self, i, state):
+        # parent process only (IPC_shm) , workers and managers only retire
+        if state == W_ACTIVE and self.state(i) == W_ABSENT:
+            struct.pack_into('i', self._s_data.buf, 16 + 4 * (2 * self._worker_num + i), self.generation(i) + 1)
+        self._state_words[i].set(state)
+        self._version.fetch_add(1)
+        self._notify()
+
+    def try_retire(self, i):
+        '''
+            draining -> retired once nothing is outstanding on worker i (single slot mode counters ,
+            ring mode : the owning manager calls it when the ring is empty)
+        '''
+        if self.state(i) != W_DRAINING or self._load_words[i].get() > 0:
+            return False
+        # acquire takes the counter before it checks the state , so a request taken meanwhile is given back there
+        if not self._state_words[i].cas(W_DRAINING, W_RETIRED):
+            return False
+        self._version.fetch_add(1)
+        self._notify()
+        return True
+
+    def in_shard(self, i, shard):
+        # shard : (manager index , manager count) , worker i belongs to manager i % manager count
+        return shard is None or i % shard[1] == shard[0]
+
+    def shard_free(self, shard_num):
+        '''
+            free places of the active workers of every shard , None for a shard without active worker
+        '''
+        free = [None] * shard_num
+        for i, (n, state) in enumerate(zip(self.loads(), self.states())):
+            if state == W_ACTIVE:
+                free[i % shard_num] = (free[i % shard_num] or 0) + max(self._capacity - n, 0)
+        return free
+
+    def acquire(self, timeout=None, shard=None):
+        '''
+            return worker index with its outstanding counter taken , None on timeout
+            shard : only the workers of that shard , see in_shard
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changes = self._changes.get()
+            cursor = struct.unpack_from('i', self._s_data.buf, 0)[0]
+            loads = self.loads()
+            # inactive slots and slots of other shards count as full
+            masked = [n if state == W_ACTIVE and self.in_shard(i, shard) else self._capacity
+                      for i, (n, state) in enumerate(zip(loads, self.states()))]
+            i = self._policy.select(masked, self._capacity, cursor)
+            if i is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._sleepers.fetch_add(1)
+                try:
+                    self._idle.wait_for(self._changes, lambda v: v != changes, timeout=remaining)
+                finally:
+                    self._sleepers.fetch_add(-1)
+                continue
+            # another manager took it since the snapshot
+            if not self._load_words[i].cas(loads[i], loads[i] + 1):
+                continue
+            if self.state(i) != W_ACTIVE:
+                # draining or gone since the snapshot
+                self.release(i)
+                continue
+            struct.pack_into('i', self._s_data.buf, 0, (i + 1) % self._worker_num)
+            return i
+
+    def release(self, i):
+        word = self._load_words[i]
+        while True:
+            n = word.get()
+            if n <= 0 or word.cas(n, n - 1):
+                break
+        self._notify()
+
+    def close(self):
+        self._s_data.close()
+
+    def unlink(self):
+        if self._is_owner:
+            try:
+                self._s_data.shm.unlink()
+            except Exception:
+                pass
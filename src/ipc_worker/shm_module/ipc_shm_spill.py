@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 18:10
+# @Author  : tk
+
+import os
+import struct
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from ..utils import logger
+from ..serializer import packed_size, pack_frames, unpack_frames
+
+# 超过槽位容量的数据写入单独分配的共享内存块 , 槽位中只写块的句柄 , 槽位按常见消息大小分配即可
+# 块头: in_use (int32) , 写入方置 1 , 读取方用完后置 0 , 写入方之后复用该块 (块池属于写入进程)
+# 槽位中的句柄: SPILL_MARK (int64 , 位于 frames 个数的位置) , name 长度 (int64) , name
+SPILL_MARK = -1
+SPILL_HEADER_SIZE = 64
+SPILL_MIN_BLOCK = 1 << 20
+
+
+class Spill_handle:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, state):
+        self.name = state
+
+
+class SHM_spill:
+    '''
+        one per process
+        writer side : pool of owned blocks , a block is reused once the reader clears in_use
+        reader side : lru cache of attached blocks
+    '''
+    def __init__(self, prefix, max_idle=4, max_attach=4):
+        self._prefix = prefix
+        self._max_idle = max_idle
+        self._max_attach = max_attach
+        self._pool = []
+        self._attached = OrderedDict()
+        self._n = 0
+
+    def _new_block(self, need):
+        size = max(SPILL_MIN_BLOCK, 1 << (need - 1).bit_length())
+        self._n += 1
+        name = '{}_spill_{}_{}'.format(self._prefix, os.getpid(), self._n)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._pool.append(shm)
+        return shm
+
+    def _unlink(self, shm):
+        self._pool.remove(shm)
+        try:
+            shm.close()
+            shm.unlink()
+        except Exception as e:
+            logger.warning('spill block unlink except {}'.format(e))
+
+    def _acquire(self, need):
+        idle = [shm for shm in self._pool if struct.unpack_from('i', shm.buf, 0)[0] == 0]
+        fit = [shm for shm in idle if shm.size >= need]
+        block = min(fit, key=lambda shm: shm.size) if fit else None
+        if block is not None:
+            idle.remove(block)
+        # keep at most max_idle free blocks , the largest ones
+        idle.sort(key=lambda shm: shm.size)
+        for shm in idle[:max(len(idle) - self._max_idle, 0)]:
+            self._unlink(shm)
+        if block is None:
+            block = self._new_block(need)
+        struct.pack_into('i', block.buf, 0, 1)
+        return block
+
+    def spill(self, frames):
+        block = self._acquire(SPILL_HEADER_SIZE + packed_size(frames))
+        pack_frames(block.buf, SPILL_HEADER_SIZE, frames)
+        return Spill_handle(block.name)
+
+    def maybe_spill(self, frames, capacity):
+        if isinstance(frames, Spill_handle) or packed_size(frames) <= capacity:
+            return frames
+        return self.spill(frames)
+
+    def pack_into(self, buf, offset, payload, capacity):
+        '''
+            write frames (or a handle) at buf[offset:] , spill when larger than capacity , return size written
+        '''
+        if not isinstance(payload, Spill_handle):
+            size = packed_size(payload)
+            if size <= capacity:
+                pack_frames(buf, offset, payload)
+                return size
+            payload = self.spill(payload)
+        name = payload.name.encode('utf-8')
+        struct.pack_into('qq', buf, offset, SPILL_MARK, len(name))
+        buf[offset + 16:offset + 16 + len(name)] = name
+        return 16 + len(name)
+
+    @staticmethod
+    def unpack_from(buf, offset):
+        '''
+            return frames (views into buf) or Spill_handle
+        '''
+        n = struct.unpack_from('q', buf, offset)[0]
+        if n != SPILL_MARK:
+            return unpack_frames(buf, offset)
+        size = struct.unpack_from('q', buf, offset + 8)[0]
+        return Spill_handle(bytes(buf[offset + 16:offset + 16 + size]).decode('utf-8'))
+
+    def _attach(self, name):
+        shm = self._attached.pop(name, None)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+        self._attached[name] = shm
+        while len(self._attached) > self._max_attach:
+            old_name, old = self._attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                # views still exported , keep it mapped
+                self._attached[old_name] = old
+                self._attached.move_to_end(old_name, last=False)
+                break
+        return shm
+
+    def frames(self, payload):
+        '''
+            frames of a payload , views into the block for a handle , valid until release(payload)
+        '''
+        if not isinstance(payload, Spill_handle):
+            return payload
+        return unpack_frames(self._attach(payload.name).buf, SPILL_HEADER_SIZE)
+
+    def release(self, payload):
+        '''
+            reader is done with payload , an own block (never sent) is released too
+        '''
+        if isinstance(payload, Spill_handle):
+            shm = self._attached.get(payload.name, None)
+            if shm is None:
+                shm = next((b for b in self._pool if b.name == payload.name), None)
+            if shm is not None:
+                struct.pack_into('i', shm.buf, 0, 0)
+
+    def discard(self, payload):
+        '''
+            reader drops payload unread (cancelled request) , the block goes back to its writer
+        '''
+        if isinstance(payload, Spill_handle):
+            self.frames(payload)
+            self.release(payload)
+
+    def close(self):
+        for shm in self._attached.values():
+            try:
+                shm.close()
+            except Exception:
+                pass
+        self._attached.clear()
+        for shm in list(self._pool):
+            self._unlink(shm)
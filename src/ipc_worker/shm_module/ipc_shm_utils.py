@@ -1,33 +1,71 @@
 # -*- coding: utf-8 -*-
 # @Time    : 2021/11/23 9:33
 # @Author  : tk
-import json
-import random
 import struct
 import multiprocessing
+import time
 import traceback
-from multiprocessing import Event,Condition,Process
+from multiprocessing import Process
+from queue import Empty
 from datetime import datetime
-import pickle
 import typing
-from .ipc_utils_func import C_sharedata, WorkState
+from collections import deque
+from .ipc_utils_func import C_sharedata, C_ringdata, WorkState
+from .ipc_wait import Wait_strategy, Shm_word, idle_strategy
 from ..utils import logger
+from ..response_dispatcher import ResponseState
+from ..stream_utils import Stream_writer
+from .ipc_shm_spill import SHM_spill, Spill_handle
+from .ipc_shm_scheduler import W_ACTIVE, W_DRAINING, W_RETIRED
+from ..serializer import wrap_frames, frames_nbytes, get_codec
+from ..metrics import record_run
+from ..priority import Priority_selector
 
 
 class SHM_manager(Process):
     def __init__(self,evt_quit,
-                 signal_list,semaphore,
+                 scheduler,
                  shm_name_list,
                  input_queue,
                  output_queue,
                  is_log_time,
                  idx,
+                 slot_num=1,
+                 manager_num=1,
+                 wait_strategy='spin',
+                 bell_name=None,
+                 group_name='',
+                 cancel_table=None,
+                 metrics=None,
+                 max_retries=0,
+                 lanes=None,
+                 shard=False,
+                 priority_policy='strict',
+                 priority_weights=None,
                  daemon=False):
         super().__init__(daemon=daemon)
         self._evt_quit = evt_quit
-        self._signal_list = signal_list
+        self._group_name = group_name
+        # lanes : [lane][priority] input queues when managers poll them (shard or priorities) , else None
+        # shard mode : a lane per manager , this manager only uses workers i % manager_num == idx and takes from other lanes when its own is empty
+        self._lanes = lanes
+        self._shard = (idx,manager_num) if shard else None
+        self._lane_idx = idx if shard else 0
+        self._priority = Priority_selector(len(lanes[0]),priority_policy,priority_weights) if lanes is not None else None
+        # a request on a worker that died is sent again up to max_retries times , see _on_lost
+        self._max_retries = max_retries
+        # SHM_metrics , this manager writes its own section
+        self._metrics = metrics
+        self._stat = None
+        # SHM_cancel , cancelled or expired requests are dropped before dispatch
+        self._cancel_table = cancel_table
+        self._slot_num = slot_num
+        self._manager_num = manager_num
+        self._waiter = Wait_strategy(wait_strategy)
+        self._bell_name = bell_name
 
-        self._semaphore = semaphore
+        # SHM_scheduler , load counters shared by managers (single slot mode) and the selection policy
+        self._scheduler = scheduler
         self._shm_name_list = shm_name_list
 
         self._input_queue = input_queue
@@ -44,11 +82,112 @@ class SHM_manager(Process):
     def get_output_queue(self):
         return self._output_queue
 
+    @staticmethod
+    def _wrap_payload(payload):
+        # frames are views into the slot , wrapped so the output queue copies them straight out of band ,
+        # a spill handle is passed on as is and the block is released by the client
+        return payload if isinstance(payload,Spill_handle) else wrap_frames(payload)
+
+    def _is_dead(self,request_id):
+        return self._cancel_table is not None and self._cancel_table.is_dead(request_id)
+
+    def _on_dispatch(self,t_put,is_dropped=False):
+        if self._stat is None:
+            return
+        if is_dropped:
+            self._stat.add('dropped')
+        else:
+            self._stat.add('dispatched')
+            self._stat.observe('dispatch_wait_us',(time.time() - t_put) * 1e6)
+
+    def _sync_slots(self,slots,open_fn,on_close=None):
+        '''
+            follow workers added / removed at runtime , slots : worker index -> (generation,shm) of the workers this manager uses
+            on_close(i,shm) : before a slot of a removed or dead worker is closed
+        '''
+        scheduler = self._scheduler
+        for i,state in enumerate(scheduler.states()):
+            if (self._slot_num > 1 or self._shard is not None) and i % self._manager_num != self.idx:
+                continue
+            gen = scheduler.generation(i)
+            if i in slots and (state not in (W_ACTIVE,W_DRAINING) or slots[i][0] != gen):
+                _,shm = slots.pop(i)
+                if on_close is not None:
+                    on_close(i,shm)
+                shm.close()
+            if i not in slots and state in (W_ACTIVE,W_DRAINING):
+                slots[i] = (gen,open_fn(self._shm_name_list[i]))
+
+    def _is_gone(self,i,gen):
+        # worker i of generation gen was removed or died (the supervisor took its slot)
+        return self._scheduler.generation(i) != gen or self._scheduler.state(i) not in (W_ACTIVE,W_DRAINING)
+
+    def _on_lost(self,request_id,worker_id,payload,n_sent,attempt):
+        '''
+            worker died with request_id , True when it is sent again (nothing of it reached the client yet) ,
+            else the client is told to fail it
+        '''
+        if n_sent == 0 and attempt < self._max_retries:
+            logger.warning('worker {} died , request {} retry {}'.format(worker_id,request_id,attempt + 1))
+            return True
+        logger.warning('worker {} died , request {} lost'.format(worker_id,request_id))
+        self._spill.discard(payload)
+        self._output_queue.put((request_id,worker_id,0,None,ResponseState.RS_LOST))
+        return False
+
+    def _get_request(self):
+        '''
+            polling mode , the priority is picked among the non empty ones (priority_policy) ,
+            a request of this manager's lane , else (shard) one of the longest other lane , None when every lane is empty
+        '''
+        own = self._lanes[self._lane_idx]
+        others = [lane for m,lane in enumerate(self._lanes) if m != self._lane_idx] if self._shard is not None else []
+        ready = [p for p in range(len(own)) if own[p].qsize() > 0 or any(lane[p].qsize() > 0 for lane in others)]
+        while ready:
+            p = self._priority.select(ready)
+            try:
+                return own[p].get(block=False)
+            except Empty:
+                pass
+            for lane in sorted(others,key=lambda lane: lane[p].qsize(),reverse=True):
+                if lane[p].qsize() == 0:
+                    continue
+                try:
+                    item = lane[p].get(block=False)
+                except Empty:
+                    continue
+                if self._stat is not None:
+                    self._stat.add('stolen')
+                return item
+            # taken by another manager since the check
+            ready.remove(p)
+        return None
+
+    def _take_request(self,bell,idle):
+        '''
+            polling mode , single slot , a free worker (of the shard) first , then the request to run on it ,
+            so a request put meanwhile with a higher priority still goes first ,
+            (sel_id,item) , (None,None) when nothing came within the idle timeout
+        '''
+        scheduler = self._scheduler
+        sel_id = scheduler.acquire(timeout=0.1,shard=self._shard)
+        if sel_id is None:
+            return None,None
+        # the supervisor gives the worker back if this manager dies while holding it
+        scheduler.set_inflight(self.idx,0,sel_id)
+        while True:
+            bell_v = bell.get()
+            item = self._get_request()
+            if item is not None:
+                return sel_id,item
+            # the client rings the bell after every put , the timeout lets the caller check quit
+            if not idle.wait_for(bell,lambda v: v != bell_v,timeout=0.1) or scheduler.state(sel_id) != W_ACTIVE:
+                scheduler.set_inflight(self.idx)
+                scheduler.release(sel_id)
+                return None,None
+
     def get_real_data(self,buf):
-        len = struct.unpack('i',buf[12:16])[0]
-        d = buf[16:16+len]
-        #队列不能序列化 bytes
-        return pickle.loads(d)
+        return self._wrap_payload(SHM_spill.unpack_from(buf,16))
 
     def release(self):
         if not getattr(self,'__is_closed',False):
@@ -59,103 +198,338 @@ class SHM_manager(Process):
             setattr(self,'__is_closed',True)
 
     def run(self):
-        shm_list = []
-        for shm_name in self._shm_name_list:
-            s_d = C_sharedata(name=shm_name,create=False)
-            shm_list.append(s_d)
-        task_queue1 = self._input_queue
+        # requests that fit shm_size but not a ring slot are spilled here
+        self._spill = SHM_spill('{}_m{}'.format(self._group_name,self.idx))
+        if self._metrics is not None:
+            self._stat = self._metrics.writer('manager',self.idx)
+        if self._slot_num > 1:
+            self._run_ring()
+        else:
+            self._run_single()
+        self._spill.close()
+        self.release()
+
+    def _forward_responses(self,i,ring,inflight,start_t_map):
+        # responses of worker i to the client , return the number forwarded
         task_queue2 = self._output_queue
+        n = 0
+        while True:
+            item = ring.peek_response()
+            if item is None:
+                break
+            n += 1
+            request_id, worker_id, seq_id, flag, payload = item
+            if flag == WorkState.WS_FINISH and seq_id > 0:
+                # generator exhausted
+                task_queue2.put((request_id, worker_id, seq_id, None, ResponseState.RS_END))
+            elif flag == WorkState.WS_FINISH_STEPS:
+                task_queue2.put((request_id, worker_id, seq_id, self._wrap_payload(payload), ResponseState.RS_CHUNKS))
+            else:
+                task_queue2.put((request_id, worker_id, seq_id, self._wrap_payload(payload), ResponseState.RS_DATA))
+            del payload,item
+            ring.finish_response()
+            if flag == WorkState.WS_FINISH:
+                inflight.pop(request_id,None)
+            elif request_id in inflight:
+                inflight[request_id][2] += 1
+            if self._is_log_time and flag == WorkState.WS_FINISH:
+                deata = datetime.now() - start_t_map.pop(request_id,datetime.now())
+                micros = deata.seconds * 1000 + deata.microseconds / 1000
+                logger.info('manager workerId {} , runtime {}'.format(i, micros))
+        return n
+
+    def _run_ring(self):
+        # ring mode: worker i is owned by manager i % manager_num , so every ring is single producer single consumer
+        # workers may be added or removed later (see IPC_shm.add_workers) , rings follow the scheduler slot table
+        scheduler = self._scheduler
+        slots = {}
+        version = None
+        open_fn = lambda shm_name: C_ringdata(name=shm_name,create=False,spill=self._spill)
+        policy = scheduler.policy
+        cursor = 0
+        # bumped by client put and by worker response , wait here when nothing to do
+        s_bell = C_sharedata(name=self._bell_name,create=False)
+        bell = Shm_word(s_bell.buf,0)
+        waiter = self._waiter
+        idle = idle_strategy()
+        task_queue1 = self._input_queue
+        start_t_map = {}
+        # worker -> {request_id: [payload,t_put,responses forwarded,attempt]} , requests pushed to its ring and not finished
+        inflight_map = {}
+        # (request_id,payload,t_put,attempt) of dead workers , sent before new requests
+        retry = deque()
+
+        def on_close(i,ring):
+            # a dead worker may have answered before it died
+            inflight = inflight_map.pop(i,{})
+            self._forward_responses(i,ring,inflight,start_t_map)
+            for request_id,(payload,t_put,n_sent,attempt) in inflight.items():
+                if self._on_lost(request_id,i,payload,n_sent,attempt):
+                    retry.append((request_id,payload,t_put,attempt + 1))
 
-        s_d_id_list = []
         try:
             while True:
-                request_id,msg = task_queue1.get()
+                bell_v = bell.get()
+                is_busy = False
+                if scheduler.version() != version:
+                    version = scheduler.version()
+                    self._sync_slots(slots,open_fn,on_close)
+                ring_list = [(i,ring) for i,(_,ring) in slots.items()]
+                for i,ring in ring_list:
+                    if self._forward_responses(i,ring,inflight_map.get(i,{}),start_t_map):
+                        is_busy = True
+                        # worker may wait for response slots
+                        waiter.wake(ring.rsp_head_word)
+
+                # rings of other managers and of draining workers count as full
+                pending = len(retry)
+                loads = [self._slot_num] * len(self._shm_name_list)
+                for i,ring in ring_list:
+                    ring_pending = ring.request_pending() + ring.response_pending()
+                    pending += ring_pending
+                    if scheduler.state(i) == W_ACTIVE:
+                        loads[i] = ring.request_pending()
+                    elif ring_pending == 0 and scheduler.try_retire(i):
+                        # drained , this manager is its only producer so nothing more can arrive
+                        ring.req_tail_word.wake()
+                sel_id = policy.select(loads,self._slot_num,cursor)
+                if sel_id is not None:
+                    attempt = 0
+                    if retry:
+                        request_id,payload,t_put,attempt = retry.popleft()
+                    elif self._lanes is not None:
+                        # waits on the bell below when every lane is empty
+                        request_id,payload,t_put = self._get_request() or (None,None,None)
+                    else:
+                        try:
+                            request_id,payload,t_put = task_queue1.get(block=pending == 0)
+                        except Exception:
+                            request_id,payload,t_put = None,None,None
+                    if self._evt_quit.is_set():
+                        break
+                    if request_id is not None:
+                        scheduler.set_inflight(self.idx,request_id)
+                    if request_id is not None and self._is_dead(request_id):
+                        # the client already failed it
+                        self._spill.discard(payload)
+                        self._on_dispatch(t_put,is_dropped=True)
+                        is_busy = True
+                    elif request_id is not None:
+                        is_busy = True
+                        cursor = (sel_id + 1) % len(loads)
+                        ring = slots[sel_id][1]
+                        try:
+                            # spilled here so a retry sends the same block
+                            payload = self._spill.maybe_spill(payload,ring.capacity)
+                            ring.push_request(request_id,payload)
+                        except ValueError as e:
+                            logger.error('request {} dropped , {}'.format(request_id,e))
+                            scheduler.set_inflight(self.idx)
+                            continue
+                        if attempt == 0:
+                            self._on_dispatch(t_put)
+                        # the payload is kept only when it may be sent again or is a spill block to give back
+                        keep = payload if self._max_retries > 0 or isinstance(payload,Spill_handle) else None
+                        inflight_map.setdefault(sel_id,{})[request_id] = [keep,t_put,0,attempt]
+                        if self._is_log_time:
+                            start_t_map[request_id] = datetime.now()
+                        ring.req_tail_word.wake()
+                    scheduler.set_inflight(self.idx)
+                if not is_busy:
+                    # polling : nothing in flight , sleep until a put (the client wakes the bell) instead of spinning
+                    (idle if self._lanes is not None and pending == 0 else waiter).wait_for(bell,lambda v: v != bell_v,timeout=0.1)
+        except KeyboardInterrupt:
+            ...
+        except Exception as e:
+            traceback.print_exc()
+            logger.info(e)
+
+    def _run_request(self,sel_id,gen,s_d,request_id,payload):
+        '''
+            single slot mode , run request_id on worker sel_id and forward its responses
+            return (is_lost,n_sent) , is_lost : the worker died first , n_sent : responses forwarded
+        '''
+        waiter = self._waiter
+        task_queue2 = self._output_queue
+        size = self._spill.pack_into(s_d.buf, 16, payload, s_d.shm.size - 16)
+        # request_id in the response header fields , read by the worker before it answers
+        struct.pack_into('q', s_d.buf, 4, request_id)
+        s_d.buf[12:16] = struct.pack("i", size)
+        flag_word = Shm_word(s_d.buf,0)
+        flag_word.set(WorkState.WS_REQUEST)
+        # 唤醒空闲的 worker
+        flag_word.wake()
+        n_sent = 0
+        while True:
+            flag = struct.unpack("i", s_d.buf[0:4])[0]
+            if flag == WorkState.WS_FINISH:
+                break
+            elif flag != WorkState.WS_FINISH_STEP and flag != WorkState.WS_FINISH_STEPS:
+                # the supervisor takes the slot of a dead worker , checked while the flag does not move
+                if not waiter.wait_for(flag_word, lambda v: v != flag, timeout=0.1) and self._is_gone(sel_id,gen):
+                    return True,n_sent
+            else:
+                p_result = self.get_real_data(s_d.buf)
+                worker_id = struct.unpack("i", s_d.buf[4:8])[0]
+                seq_id = struct.unpack("i", s_d.buf[8:12])[0]
+                state = ResponseState.RS_CHUNKS if flag == WorkState.WS_FINISH_STEPS else ResponseState.RS_DATA
+                task_queue2.put((request_id,worker_id,seq_id, p_result, state))
+                del p_result
+                n_sent += 1
+
+                # ack the step , slot stays owned by the worker until WS_FINISH
+                s_d.buf[0:4] = struct.pack('i', WorkState.WS_RECIEVE)
+                waiter.wake(flag_word)
+        worker_id = struct.unpack("i", s_d.buf[4:8])[0]
+        seq_id = struct.unpack("i", s_d.buf[8:12])[0]
+        # seq_id > 0 : end of stream , a generator may also finish without any step
+        if seq_id == 0:
+            p_result = self.get_real_data(s_d.buf)
+            task_queue2.put((request_id,worker_id,seq_id,p_result,ResponseState.RS_DATA))
+            del p_result
+            s_d.buf[0:4] = struct.pack('i',WorkState.WS_FREE)
+        else:
+            s_d.buf[0:4] = struct.pack('i', WorkState.WS_FREE)
+            task_queue2.put((request_id,worker_id,seq_id,None,ResponseState.RS_END))
+        return False,n_sent + 1
+
+    def _run_single(self):
+        # workers may be added or removed later , slots follow the scheduler slot table
+        slots = {}
+        version = None
+        task_queue1 = self._input_queue
+
+        scheduler = self._scheduler
+        if self._lanes is not None:
+            s_bell = C_sharedata(name=self._bell_name,create=False)
+            bell = Shm_word(s_bell.buf,0)
+            idle = idle_strategy()
+        try:
+            while not self._evt_quit.is_set():
+                sel_id = None
+                if self._lanes is None:
+                    request_id,payload,t_put = task_queue1.get()
+                else:
+                    sel_id,item = self._take_request(bell,idle)
+                    if item is None:
+                        continue
+                    request_id,payload,t_put = item
                 if self._evt_quit.is_set():
+                    if sel_id is not None:
+                        scheduler.release(sel_id)
                     break
-                s_d_id_list.clear()
-                self._semaphore.acquire()
-                for i,node in enumerate(shm_list):
-                    flag = struct.unpack("i", node.buf[0:4])[0]
-                    if flag == WorkState.WS_FREE:
-                        s_d_id_list.append(i)
-                if len(s_d_id_list) == 0:
-                    self._semaphore.release()
-                    logger.info('service busy  , no worker consume')
-                    task_queue1.put((request_id,msg))
-                    continue
-                sel_id = random.choices(s_d_id_list)[0]
-                s_d = shm_list[sel_id]
-
-                #if isinstance(msg,dict) else msg
-                # d = pickle.dumps(msg)
-                # print(d)
-
-                d = msg
-                s_d.buf[12:16] = struct.pack("i", len(d))
-                s_d.buf[16:16 + len(d)] = d
-                s_d.buf[0:4] = struct.pack("i", WorkState.WS_REQUEST)
-                #是否信号，给其他进程
-                self._semaphore.release()
-                self._signal_list[sel_id].set()
-                start_t = datetime.now()
-                Flag_step = False
+                scheduler.set_inflight(self.idx,request_id,-1 if sel_id is None else sel_id)
+                attempt = 0
                 while True:
-                    flag = struct.unpack("i", s_d.buf[0:4])[0]
-                    if flag == WorkState.WS_FINISH:
+                    # wait for a free worker , the request keeps its place instead of going back to the queue
+                    while sel_id is None and not self._evt_quit.is_set():
+                        sel_id = scheduler.acquire(timeout=0.1,shard=self._shard)
+                    if sel_id is None:
                         break
-                    elif flag == WorkState.WS_FINISH_STEP:
-                        Flag_step = True
-                        p_result = self.get_real_data(s_d.buf)
-                        worker_id = struct.unpack("i", s_d.buf[4:8])[0]
-                        seq_id = struct.unpack("i", s_d.buf[8:12])[0]
-
-                        s_d.buf[0:4] = struct.pack('i', WorkState.WS_FREE)
-                        task_queue2.put((request_id,worker_id,seq_id, p_result))
-                if not Flag_step:
-                    p_result = self.get_real_data(s_d.buf)
-                    worker_id = struct.unpack("i", s_d.buf[4:8])[0]
-                    seq_id = struct.unpack("i", s_d.buf[8:12])[0]
-
-                    s_d.buf[0:4] = struct.pack('i',WorkState.WS_FREE)
-                    task_queue2.put((request_id,worker_id,seq_id,p_result))
-                else:
-                    s_d.buf[0:4] = struct.pack('i', WorkState.WS_FREE)
-
-                if self._is_log_time:
-                    deata = datetime.now() - start_t
-                    micros = deata.seconds * 1000 + deata.microseconds / 1000
-                    logger.info('manager workerId {} , runtime {}'.format(sel_id, micros))
+                    if self._is_dead(request_id):
+                        # expired while waiting for a worker , the client already failed it
+                        scheduler.release(sel_id)
+                        self._spill.discard(payload)
+                        self._on_dispatch(t_put,is_dropped=True)
+                        break
+                    if attempt == 0:
+                        self._on_dispatch(t_put)
+                    if scheduler.version() != version or sel_id not in slots:
+                        version = scheduler.version()
+                        self._sync_slots(slots,lambda shm_name: C_sharedata(name=shm_name,create=False))
+                    gen,s_d = slots[sel_id]
+                    # spilled here so a retry sends the same block
+                    payload = self._spill.maybe_spill(payload,s_d.shm.size - 16)
+                    scheduler.set_inflight(self.idx,request_id,sel_id)
+                    start_t = datetime.now()
+                    is_lost,n_sent = self._run_request(sel_id,gen,s_d,request_id,payload)
+                    scheduler.release(sel_id)
+                    if not is_lost:
+                        if self._is_log_time:
+                            deata = datetime.now() - start_t
+                            micros = deata.seconds * 1000 + deata.microseconds / 1000
+                            logger.info('manager workerId {} , runtime {}'.format(sel_id, micros))
+                        break
+                    if not self._on_lost(request_id,sel_id,payload,n_sent,attempt):
+                        break
+                    attempt += 1
+                    sel_id = None
+                del payload
+                scheduler.set_inflight(self.idx)
         except KeyboardInterrupt:
             ...
         except Exception as e:
             traceback.print_exc()
             logger.info(e)
-        self.release()
 
 class SHM_woker(Process):
     def __init__(self,
                  evt_quit,
-                 semaphore,
                  shm_name,
                  shm_size,
                  is_log_time,
                  idx,
                  group_name,
+                 slot_num=1,
+                 wait_strategy='spin',
+                 bell_name=None,
+                 bell_lock=None,
+                 stream_credit=0,
+                 stream_coalesce_ms=0,
+                 stream_coalesce_num=64,
+                 max_batch_size=1,
+                 max_wait_ms=0,
+                 request_codec='pickle',
+                 response_codec='pickle',
+                 cancel_table=None,
+                 metrics=None,
+                 scheduler=None,
+                 supervised=False,
                  daemon=False):
         super().__init__(daemon=daemon)
+        # supervised : an exception in run_once ends this process only , the supervisor starts a new one
+        self._supervised = supervised
+        # SHM_scheduler slot table , a worker removed at runtime leaves once it is retired
+        self._scheduler = scheduler
+        self._is_retired = False
+        # SHM_metrics , this worker writes its own section
+        self._metrics = metrics
+        self._stat = None
+        # SHM_cancel , see is_cancelled
+        self._cancel_table = cancel_table
+        self._request_ids = []
 
         self._evt_quit = evt_quit
-        self._semaphore= semaphore
+        self._request_codec = get_codec(request_codec)
+        self._response_codec = get_codec(response_codec)
+        # ring mode only , max_batch_size <= slot_num
+        self._max_batch_size = max_batch_size
+        self._max_wait_ms = max_wait_ms
+        # ring mode : max unconsumed chunks of a stream , 0 means the whole response ring
+        self._stream_credit = stream_credit if stream_credit > 0 else slot_num
+        self._stream_coalesce_ms = stream_coalesce_ms
+        self._stream_coalesce_num = stream_coalesce_num
+        self._waiter = Wait_strategy(wait_strategy)
+        # idle : waiting for the next request , woken by the manager through the slot flag (ring : req_tail)
+        self._idle = idle_strategy()
+        self._bell_name = bell_name
+        self._bell_lock = bell_lock
         self._idx = idx
         self._group_name = group_name
         self._shm_name = shm_name
+        self._slot_num = slot_num
 
-        self._s_data = C_sharedata(name=shm_name, create=True, size=shm_size)
-        self._evt_signal = multiprocessing.Manager().Event()
+        if slot_num > 1:
+            self._s_data = C_ringdata(name=shm_name, create=True, size=shm_size, slot_num=slot_num)
+        else:
+            self._s_data = C_sharedata(name=shm_name, create=True, size=shm_size)
         self._is_log_time = is_log_time
+        # time.time() once run_begin returned , 0 before , read by IPC_shm.start(wait_ready=True)
+        self._t_ready = multiprocessing.RawValue('d',0)
 
-    def get_signal(self):
-        return self._evt_signal
+    @property
+    def t_ready(self):
+        return self._t_ready.value or None
 
     def run_begin(self):
         raise NotImplementedError
@@ -166,56 +540,236 @@ class SHM_woker(Process):
     def run_once(self,request_data):
         raise NotImplementedError
 
+    # max_batch_size > 1 : requests queued within max_wait_ms are passed together , return one result per request
+    def run_batch(self,request_list):
+        return [self.run_once(request_data) for request_data in request_list]
+
+    def _is_dead(self,request_id):
+        return self._cancel_table is not None and self._cancel_table.is_dead(request_id)
+
+    # call from run_once / run_batch , True when the current request (every request of the batch) was cancelled or expired
+    def is_cancelled(self):
+        return len(self._request_ids) > 0 and all(self._is_dead(request_id) for request_id in self._request_ids)
+
+    def _check_retired(self):
+        # ring mode : the owning manager retires the drained worker , single slot mode : the worker itself
+        if self._scheduler is None:
+            return False
+        state = self._scheduler.state(self._idx)
+        if state == W_DRAINING and self._slot_num == 1:
+            self._is_retired = self._scheduler.try_retire(self._idx)
+        else:
+            self._is_retired = state == W_RETIRED
+        return self._is_retired
+
+    def unlink(self):
+        # parent side , after the process has exited
+        self._s_data.close()
+        try:
+            self._s_data.shm.unlink()
+        except Exception:
+            pass
+
     def release(self):
         if not getattr(self, '__is_closed', False):
-            self._evt_signal.set()
-            self._evt_quit.set()
+            # a retired worker leaves alone , the group keeps running
+            if not self._is_retired and not self._supervised:
+                self._evt_quit.set()
             setattr(self, '__is_closed', True)
 
     def run(self):
+        # responses larger than a slot are spilled here , a slot reused by add_workers gets new block names
+        gen = self._scheduler.generation(self._idx) if self._scheduler is not None else 0
+        self._spill = SHM_spill('{}_w{}'.format(self._group_name,self._idx) if gen <= 1 else '{}_w{}g{}'.format(self._group_name,self._idx,gen))
+        if self._slot_num > 1:
+            self._s_data.spill = self._spill
+        if self._metrics is not None:
+            self._stat = self._metrics.writer('worker',self._idx)
         self.run_begin()
-        s_data = self._s_data
+        self._t_ready.value = time.time()
+        if self._slot_num > 1:
+            self._run_ring()
+        else:
+            self._run_single()
+        self.run_end()
+        self._spill.close()
+        self.release()
+
+    def _stream_writer(self,send_fn):
+        return Stream_writer(send_fn,self._stream_coalesce_ms,self._stream_coalesce_num)
+
+    def _pack_chunks(self,chunks):
+        if len(chunks) == 1:
+            return WorkState.WS_FINISH_STEP,self._response_codec.dumps(chunks[0])
+        return WorkState.WS_FINISH_STEPS,self._response_codec.dumps_list(chunks)
+
+    def _push_response(self,ring,request_id,seq_id,flag,X,credit=None):
+        # response ring full or stream out of credit , wait for manager to consume
+        while True:
+            head_v = ring.rsp_head_word.get()
+            if (credit is None or ring.response_pending() < credit) and \
+                    ring.push_response(request_id,self._idx,seq_id,flag,X):
+                break
+            if self._evt_quit.is_set():
+                return
+            self._waiter.wait_for(ring.rsp_head_word,lambda v: v != head_v,timeout=0.1)
+        self._bell.fetch_add(1)
+        self._waiter.wake(self._bell)
+
+    def _send_result(self,ring,request_id,XX):
+        seq_id = 0
+        if isinstance(XX, typing.Generator):
+            def send_fn(seq_id,chunks):
+                flag,X = self._pack_chunks(chunks)
+                self._push_response(ring,request_id,seq_id,flag,X,credit=self._stream_credit)
+            seq_id = self._stream_writer(send_fn).run(XX,is_cancelled=lambda: self._is_dead(request_id))
+            # end of stream
+            self._push_response(ring,request_id,seq_id + 1,WorkState.WS_FINISH,[])
+        else:
+            self._push_response(ring,request_id,seq_id,WorkState.WS_FINISH,self._response_codec.dumps(XX))
+
+    def _wait_batch(self,ring,items):
+        # wait at most max_wait_ms for the manager to queue more requests , up to max_batch_size
+        deadline = time.time() + self._max_wait_ms / 1000
+        while len(items) < self._max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            tail_v = ring.req_tail_word.get()
+            items = ring.peek_requests(self._max_batch_size)
+            if len(items) < self._max_batch_size:
+                self._idle.wait_for(ring.req_tail_word,lambda v: v != tail_v,timeout=remaining)
+        return ring.peek_requests(self._max_batch_size)
+
+    def _run_ring(self):
+        ring = self._s_data
+        s_bell = C_sharedata(name=self._bell_name,create=False)
+        self._bell = Shm_word(s_bell.buf,0,self._bell_lock)
         try:
-            while True :
-                self._evt_signal.wait()
-                if self._evt_quit.is_set():
-                    break
-                self._semaphore.acquire()
-                flag = struct.unpack("i", s_data.buf[0:4])[0]
-                if flag != WorkState.WS_REQUEST:
-                    self._semaphore.release()
+            while True:
+                # read before draining so a request pushed meanwhile is never missed
+                tail_v = ring.req_tail_word.get()
+                if ring.request_pending() == 0:
+                    if self._check_retired():
+                        break
+                    # quit and retire are noticed on the timeout
+                    if not self._idle.wait_for(ring.req_tail_word,lambda v: v != tail_v,timeout=0.1) and \
+                            self._evt_quit.is_set():
+                        break
                     continue
-                self._evt_signal.clear()
+                while True:
+                    items = ring.peek_requests(self._max_batch_size)
+                    if len(items) == 0:
+                        break
+                    if self._max_batch_size > 1:
+                        items = self._wait_batch(ring,items)
+                    # cancelled or expired requests get an empty end of stream , the client drops it
+                    live = []
+                    for request_id,payload in items:
+                        if self._is_dead(request_id):
+                            self._spill.discard(payload)
+                            self._push_response(ring,request_id,1,WorkState.WS_FINISH,[])
+                        else:
+                            live.append((request_id,payload))
+                    start_t = datetime.now()
+                    t0 = time.perf_counter()
+                    msg_size = 0
+                    if live:
+                        self._request_ids = [request_id for request_id,_ in live]
+                        payload_list = [payload for _,payload in live]
+                        frames_list = [self._spill.frames(payload) for payload in payload_list]
+                        size_list = [frames_nbytes(frames) for frames in frames_list]
+                        msg_size = sum(size_list)
+                        # large buffers are rebuilt as views into the request slot (or spill block) , valid until run_once returns
+                        request_list = [self._request_codec.loads(frames) for frames in frames_list]
+                        if self._max_batch_size > 1:
+                            XX_list = self.run_batch(request_list)
+                            assert len(XX_list) == len(request_list),'run_batch must return one result per request'
+                        else:
+                            XX_list = [self.run_once(request_list[0])]
+                        for (request_id,_),XX in zip(live,XX_list):
+                            self._send_result(ring,request_id,XX)
+                        self._request_ids = []
+                        del frames_list,request_list,XX_list
+                        for payload in payload_list:
+                            self._spill.release(payload)
+                        record_run(self._stat,size_list,time.perf_counter() - t0)
+                    ring.finish_request(len(items))
 
-                s_data.buf[0:4] = struct.pack('i',WorkState.WS_RECIEVE)
-                self._semaphore.release()
+                    if self._is_log_time:
+                        deata = datetime.now() - start_t
+                        micros = deata.seconds * 1000 + deata.microseconds / 1000
+                        logger.info('worker msg_size {} , runtime {}'.format(msg_size,micros))
+        except KeyboardInterrupt:
+            ...
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(e)
+        del ring
 
-                # s_data.buf[8:12] = struct.pack('i',0)
+    def _run_single(self):
+        s_data = self._s_data
+        flag_word = Shm_word(s_data.buf,0)
+        waiter = self._waiter
+        try:
+            while True :
+                # quit and retire are noticed on the timeout
+                if not self._idle.wait_for(flag_word,lambda v: v == WorkState.WS_REQUEST,timeout=0.1):
+                    if self._evt_quit.is_set() or self._check_retired():
+                        break
+                    continue
+                # take the request
+                if not flag_word.cas(WorkState.WS_REQUEST,WorkState.WS_RECIEVE):
+                    continue
 
-                msg_size = struct.unpack("i", s_data.buf[12:16])[0]
-                msg = s_data.buf[16:16 + msg_size]
-                request_data = pickle.loads(msg)
+                payload = SHM_spill.unpack_from(s_data.buf,16)
+                request_id = struct.unpack_from('q',s_data.buf,4)[0]
+                if self._is_dead(request_id):
+                    # cancelled after dispatch , answer with an empty end of stream
+                    self._spill.discard(payload)
+                    s_data.buf[4:8] = struct.pack('i', self._idx)
+                    s_data.buf[8:12] = struct.pack('i', 1)
+                    s_data.buf[12:16] = struct.pack("i", 0)
+                    s_data.buf[0:4] = struct.pack("i", WorkState.WS_FINISH)
+                    waiter.wake(flag_word)
+                    continue
+                self._request_ids = [request_id]
+                frames = self._spill.frames(payload)
+                msg_size = frames_nbytes(frames)
+                # large buffers are rebuilt as views into the slot (or spill block) , valid until run_once returns
+                request_data = self._request_codec.loads(frames)
+                del frames
                 start_t = datetime.now()
+                t0 = time.perf_counter()
                 XX = self.run_once(request_data)
                 seq_id = 0
                 if isinstance(XX, typing.Generator):
-                    for X in XX:
-                        seq_id += 1
-                        X = pickle.dumps(X)
+                    def send_fn(seq_id,chunks):
+                        flag,X = self._pack_chunks(chunks)
                         s_data.buf[4:8] = struct.pack('i', self._idx)
                         s_data.buf[8:12] = struct.pack('i', seq_id)
-                        s_data.buf[12:16] = struct.pack("i", len(X))
-                        s_data.buf[16:16 + len(X)] = X
-                        s_data.buf[0:4] = struct.pack("i", WorkState.WS_FINISH_STEP)
-                        while struct.unpack("i", s_data.buf[0:4])[0] != WorkState.WS_FREE:
-                            continue
+                        s_data.buf[12:16] = struct.pack("i", self._spill.pack_into(s_data.buf, 16, X, s_data.shm.size - 16))
+                        s_data.buf[0:4] = struct.pack("i", flag)
+                        waiter.wake(flag_word)
+                        waiter.wait_for(flag_word,lambda v: v == WorkState.WS_RECIEVE)
+                    seq_id = self._stream_writer(send_fn).run(XX,is_cancelled=self.is_cancelled)
+                    # end of stream
+                    s_data.buf[4:8] = struct.pack('i', self._idx)
+                    s_data.buf[8:12] = struct.pack('i', seq_id + 1)
+                    s_data.buf[12:16] = struct.pack("i", 0)
+                    s_data.buf[0:4] = struct.pack("i", WorkState.WS_FINISH)
+                    waiter.wake(flag_word)
                 else:
-                    X = pickle.dumps(XX)
+                    X = self._response_codec.dumps(XX)
                     s_data.buf[4:8] = struct.pack('i', self._idx)
                     s_data.buf[8:12] = struct.pack('i', seq_id)
-                    s_data.buf[12:16] = struct.pack("i", len(X))
-                    s_data.buf[16:16 + len(X)] = X
+                    s_data.buf[12:16] = struct.pack("i", self._spill.pack_into(s_data.buf, 16, X, s_data.shm.size - 16))
                     s_data.buf[0:4] = struct.pack("i", WorkState.WS_FINISH)
+                    waiter.wake(flag_word)
+                del request_data,XX
+                self._request_ids = []
+                self._spill.release(payload)
+                record_run(self._stat,[msg_size],time.perf_counter() - t0)
 
                 if self._is_log_time:
                     deata = datetime.now() - start_t
@@ -226,6 +780,4 @@ class SHM_woker(Process):
         except Exception as e:
             traceback.print_exc()
             logger.error(e)
-        del s_data
-        self.run_end()
-        self.release()
\ No newline at end of file
+        del s_data
\ No newline at end of file
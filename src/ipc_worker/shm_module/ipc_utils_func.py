@@ -2,8 +2,12 @@
 # @Time    : 2021/11/23 10:03
 # @Author  : tk
 
+import struct
 from multiprocessing import shared_memory, Event, Condition
 from ..utils import logger
+from .ipc_wait import Shm_word
+from ..serializer import packed_size, pack_frames
+from .ipc_shm_spill import SHM_spill
 
 class WorkState:
     WS_FREE = 0
@@ -11,6 +15,8 @@ class WorkState:
     WS_RECIEVE = 2
     WS_FINISH = 3
     WS_FINISH_STEP = 4
+    # several coalesced stream chunks , data is a pickled list , seq_id is the first chunk
+    WS_FINISH_STEPS = 5
 
 # 进程数据交换协议. 标志状态是否空闲（空闲 为0 ， 由数据请求方置为 1 ， 工作者接收该任务置为 2 ,工作完成处理方式置为 3 ， 数据请求方读取万结果后置为0）
 # 数据长度
@@ -52,6 +58,111 @@ class C_sharedata:
         return self.shm.buf
 
 
+# 环形缓冲区协议 (slot_num > 1).
+# 控制头: slot_num,slot_size (int32) , req_head,req_tail,rsp_head,rsp_tail (int64 单调递增计数 , 槽位 = 计数 % slot_num)
+# 请求槽 slot_num 个 , 响应槽 slot_num 个 , 每个槽: flag,worker_id,seq_id,len (int32) , request_id (int64) , 数据
+# 请求方向 manager 写 req_tail , worker 写 req_head ; 响应方向 worker 写 rsp_tail , manager 写 rsp_head
+RING_CTL_SIZE = 64
+RING_SLOT_HEADER_SIZE = 32
+
+class C_ringdata(C_sharedata):
+    def __init__(self, name, create=True, size=0, slot_num=2, spill=None):
+        super(C_ringdata, self).__init__(name, create=create, size=size)
+        # SHM_spill of the current process , data larger than a slot goes to a spill block
+        self.spill = spill
+        if create:
+            slot_size = (size - RING_CTL_SIZE) // (2 * slot_num)
+            assert slot_size > RING_SLOT_HEADER_SIZE, 'shm_size too small for slot_num {}'.format(slot_num)
+            struct.pack_into('ii4q', self.buf, 0, slot_num, slot_size, 0, 0, 0, 0)
+        self.slot_num, self.slot_size = struct.unpack_from('ii', self.buf, 0)
+        # low half of rsp_head , changes whenever manager consumes a response
+        self.rsp_head_word = Shm_word(self.buf, 24)
+        # low half of req_tail , changes whenever manager pushes a request , an idle worker sleeps on it
+        self.req_tail_word = Shm_word(self.buf, 16)
+
+    @property
+    def capacity(self):
+        return self.slot_size - RING_SLOT_HEADER_SIZE
+
+    def _slot_offset(self, seq, is_response):
+        idx = seq % self.slot_num + (self.slot_num if is_response else 0)
+        return RING_CTL_SIZE + idx * self.slot_size
+
+    def request_pending(self):
+        head, tail = struct.unpack_from('2q', self.buf, 8)
+        return tail - head
+
+    def request_free(self):
+        return self.slot_num - self.request_pending()
+
+    def response_pending(self):
+        head, tail = struct.unpack_from('2q', self.buf, 24)
+        return tail - head
+
+    def _push(self, ctl_offset, is_response, request_id, worker_id, seq_id, flag, payload):
+        if self.spill is None and packed_size(payload) > self.capacity:
+            raise ValueError('data size {} exceed slot capacity {}'.format(packed_size(payload), self.capacity))
+        head, tail = struct.unpack_from('2q', self.buf, ctl_offset)
+        if tail - head >= self.slot_num:
+            return False
+        offset = self._slot_offset(tail, is_response)
+        if self.spill is None:
+            size = pack_frames(self.buf, offset + RING_SLOT_HEADER_SIZE, payload)
+        else:
+            size = self.spill.pack_into(self.buf, offset + RING_SLOT_HEADER_SIZE, payload, self.capacity)
+        struct.pack_into('iiiiq', self.buf, offset, flag, worker_id, seq_id, size, request_id)
+        # 数据写完后再发布 tail
+        struct.pack_into('q', self.buf, ctl_offset + 8, tail + 1)
+        return True
+
+    def _peek(self, ctl_offset, is_response, i=0):
+        head, tail = struct.unpack_from('2q', self.buf, ctl_offset)
+        if head + i >= tail:
+            return None
+        offset = self._slot_offset(head + i, is_response)
+        flag, worker_id, seq_id, size, request_id = struct.unpack_from('iiiiq', self.buf, offset)
+        payload = SHM_spill.unpack_from(self.buf, offset + RING_SLOT_HEADER_SIZE)
+        return request_id, worker_id, seq_id, flag, payload
+
+    def _advance(self, ctl_offset, n=1):
+        head = struct.unpack_from('q', self.buf, ctl_offset)[0]
+        struct.pack_into('q', self.buf, ctl_offset, head + n)
+
+    # manager side , payload is frames or Spill_handle
+    def push_request(self, request_id, payload):
+        return self._push(8, False, request_id, 0, 0, WorkState.WS_REQUEST, payload)
+
+    # payload frames are views into the slot , valid until finish_response
+    def peek_response(self):
+        return self._peek(24, True)
+
+    def finish_response(self):
+        self._advance(24)
+
+    # worker side , request slot is kept until finish_request so frames stay valid while processing
+    def peek_request(self):
+        item = self._peek(8, False)
+        if item is None:
+            return None
+        return item[0], item[4]
+
+    # up to n pending requests from head , for batching
+    def peek_requests(self, n):
+        items = []
+        for i in range(n):
+            item = self._peek(8, False, i)
+            if item is None:
+                break
+            items.append((item[0], item[4]))
+        return items
+
+    def finish_request(self, n=1):
+        self._advance(8, n)
+
+    def push_response(self, request_id, worker_id, seq_id, flag, payload):
+        return self._push(24, True, request_id, worker_id, seq_id, flag, payload)
+
+
 def get_device_num():
     try:
         import GPUtil
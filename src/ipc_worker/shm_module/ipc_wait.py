@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 15:30
+# @Author  : tk
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import struct
+import time
+from ..utils import logger
+
+# 等待共享内存标志位变化的策略
+# spin  : 纯自旋 , 延迟最低 , 等待期间占满一个核
+# yield : 先自旋 , 再 sched_yield , 最后指数退避 sleep , 空闲时几乎不占 cpu , 唤醒延迟最多为退避上限
+# block : 先短暂自旋 , 然后在共享内存字上 futex 等待 , 由写入方唤醒 , 空闲不占 cpu , 每次写入多一次 syscall
+WAIT_SPIN = 'spin'
+WAIT_YIELD = 'yield'
+WAIT_BLOCK = 'block'
+
+_SYS_FUTEX = {
+    'x86_64': 202,
+    'amd64': 202,
+    'i386': 240,
+    'i686': 240,
+    'aarch64': 98,
+    'arm64': 98,
+    'armv7l': 240,
+}
+_FUTEX_WAIT = 0
+_FUTEX_WAKE = 1
+_SEQ_CST = 5
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_futex():
+    if not platform.system() == 'Linux':
+        return None
+    nr = _SYS_FUTEX.get(platform.machine().lower(), None)
+    if nr is None:
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fn = libc.syscall
+        fn.restype = ctypes.c_long
+        return nr, fn
+    except Exception:
+        return None
+
+
+def _load_atomic():
+    # gcc libatomic , the __atomic builtins called through ctypes , no extension to build
+    try:
+        try:
+            lib = ctypes.CDLL('libatomic.so.1')
+        except OSError:
+            name = ctypes.util.find_library('atomic')
+            if name is None:
+                return None
+            lib = ctypes.CDLL(name)
+        cas = getattr(lib, '__atomic_compare_exchange_4')
+        cas.restype = ctypes.c_bool
+        cas.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32, ctypes.c_int, ctypes.c_int]
+        fetch_add = getattr(lib, '__atomic_fetch_add_4')
+        fetch_add.restype = ctypes.c_uint32
+        fetch_add.argtypes = [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_int]
+        return cas, fetch_add
+    except (OSError, AttributeError):
+        return None
+
+
+_futex = _load_futex()
+_atomic = _load_atomic()
+_sched_yield = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+
+def futex_available():
+    return _futex is not None
+
+
+def atomic_available():
+    return _atomic is not None
+
+
+def _int32(v):
+    return v - (1 << 32) if v >= 1 << 31 else v
+
+
+class Shm_word:
+    '''
+        int32 word inside a shared memory buffer , can be used as a futex (little endian low half of an int64 counter too)
+        cas / fetch_add are atomic across processes with libatomic , else they hold lock (a multiprocessing.Lock) ,
+        without both they are plain read and write , safe only with a single writer
+    '''
+    def __init__(self, buf, offset, lock=None):
+        self.buf = buf
+        self.offset = offset
+        self._lock = lock
+        self._addr = None
+
+    def get(self):
+        return struct.unpack_from('i', self.buf, self.offset)[0]
+
+    def set(self, value):
+        struct.pack_into('i', self.buf, self.offset, value)
+
+    def add(self, n=1):
+        v = (self.get() + n) & 0xffffffff
+        struct.pack_into('I', self.buf, self.offset, v)
+
+    def cas(self, expected, value):
+        '''
+            store value when the word is expected , True when stored
+        '''
+        if _atomic is not None:
+            e = ctypes.c_uint32(expected & 0xffffffff)
+            return _atomic[0](self.addr, ctypes.byref(e), value & 0xffffffff, _SEQ_CST, _SEQ_CST)
+        if self._lock is None:
+            if self.get() != expected:
+                return False
+            self.set(value)
+            return True
+        with self._lock:
+            if self.get() != expected:
+                return False
+            self.set(value)
+            return True
+
+    def fetch_add(self, n=1):
+        # return the value before the add
+        if _atomic is not None:
+            return _int32(_atomic[1](self.addr, n & 0xffffffff, _SEQ_CST))
+        if self._lock is None:
+            v = self.get()
+            self.add(n)
+            return v
+        with self._lock:
+            v = self.get()
+            self.add(n)
+            return v
+
+    def wake(self):
+        # wake processes sleeping on the word , whatever their wait strategy
+        if _futex is not None:
+            self.futex_wake()
+
+    @property
+    def addr(self):
+        if self._addr is None:
+            # only keep the address , a live ctypes view would pin the buffer and block SharedMemory.close
+            c = ctypes.c_char.from_buffer(self.buf)
+            self._addr = ctypes.addressof(c) + self.offset
+            del c
+        return self._addr
+
+    def futex_wait(self, value, timeout):
+        nr, fn = _futex
+        ts = _timespec(int(timeout), int((timeout - int(timeout)) * 1e9))
+        fn(ctypes.c_long(nr), ctypes.c_void_p(self.addr), ctypes.c_int(_FUTEX_WAIT), ctypes.c_int(value),
+           ctypes.byref(ts), None, ctypes.c_int(0))
+
+    def futex_wake(self, n=0x7fffffff):
+        nr, fn = _futex
+        fn(ctypes.c_long(nr), ctypes.c_void_p(self.addr), ctypes.c_int(_FUTEX_WAKE), ctypes.c_int(n),
+           None, None, ctypes.c_int(0))
+
+
+class Wait_strategy:
+    def __init__(self, mode=WAIT_SPIN, spin_count=100, yield_count=100, max_sleep=0.001, block_timeout=0.1):
+        assert mode in (WAIT_SPIN, WAIT_YIELD, WAIT_BLOCK), 'bad wait strategy {}'.format(mode)
+        if mode == WAIT_BLOCK and not futex_available():
+            logger.warning('futex is not available on {} , wait strategy fall back to {}'.format(platform.machine(), WAIT_YIELD))
+            mode = WAIT_YIELD
+        self.mode = mode
+        self.spin_count = spin_count
+        self.yield_count = yield_count
+        self.max_sleep = max_sleep
+        self.block_timeout = block_timeout
+
+    @property
+    def is_block(self):
+        return self.mode == WAIT_BLOCK
+
+    def wake(self, word: Shm_word):
+        # writer side , only block mode has sleepers to wake
+        if self.mode == WAIT_BLOCK:
+            word.futex_wake()
+
+    def wait_for(self, word: Shm_word, predicate, timeout=None):
+        '''
+            wait until predicate(word.get()) is True , return False on timeout
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        i = 0
+        sleep_t = 0.00001
+        while True:
+            v = word.get()
+            if predicate(v):
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            i += 1
+            if self.mode == WAIT_SPIN or i < self.spin_count:
+                continue
+            if self.mode == WAIT_BLOCK:
+                t = self.block_timeout
+                if deadline is not None:
+                    t = max(min(t, deadline - time.time()), 0)
+                word.futex_wait(v, t)
+            elif i < self.spin_count + self.yield_count:
+                _sched_yield()
+            else:
+                time.sleep(sleep_t)
+                sleep_t = min(sleep_t * 2, self.max_sleep)
+
+
+def idle_strategy():
+    '''
+        wait of idle workers and of managers without a free worker , sleeps in the kernel and is woken by Shm_word.wake ,
+        the timeout lets the waiter check quit and retire
+    '''
+    return Wait_strategy(WAIT_BLOCK if futex_available() else WAIT_YIELD, block_timeout=0.1)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 16:40
+# @Author  : tk
+
+import queue
+import threading
+import time
+
+_END = object()
+
+
+class Stream_writer:
+    '''
+        send the chunks of a generator result , send_fn(seq_id,chunks) sends a list of chunks starting at seq_id (initail 1)
+        coalesce_ms > 0 : a sender thread packs chunks yielded within coalesce_ms (at most coalesce_num) into one transfer ,
+        the generator keeps running while the previous transfer waits for credit
+    '''
+    def __init__(self, send_fn, coalesce_ms=0, coalesce_num=64):
+        self._send_fn = send_fn
+        self._coalesce_ms = coalesce_ms
+        self._coalesce_num = max(coalesce_num, 1)
+        self._seq_id = 0
+        self._error = None
+
+    def run(self, generator, is_cancelled=None):
+        '''
+            return last seq_id
+            is_cancelled() is checked between yields , the generator is closed once it returns True
+        '''
+        if self._coalesce_ms <= 0:
+            seq_id = 0
+            for X in generator:
+                seq_id += 1
+                self._send_fn(seq_id, [X])
+                if is_cancelled is not None and is_cancelled():
+                    generator.close()
+                    break
+            return seq_id
+
+        q = queue.Queue(self._coalesce_num)
+        t = threading.Thread(target=self._sender, args=(q,), daemon=True)
+        t.start()
+        try:
+            for X in generator:
+                q.put(X)
+                if is_cancelled is not None and is_cancelled():
+                    generator.close()
+                    break
+        finally:
+            q.put(_END)
+            t.join()
+        if self._error is not None:
+            raise self._error
+        return self._seq_id
+
+    def _sender(self, q: queue.Queue):
+        budget = self._coalesce_ms / 1000
+        is_end = False
+        while not is_end:
+            X = q.get()
+            if X is _END:
+                break
+            batch = [X]
+            deadline = time.time() + budget
+            while len(batch) < self._coalesce_num:
+                remaining = deadline - time.time()
+                try:
+                    X = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                if X is _END:
+                    is_end = True
+                    break
+                batch.append(X)
+            if self._error is not None:
+                # keep draining so the generator never blocks on a dead sender
+                continue
+            try:
+                self._send_fn(self._seq_id + 1, batch)
+                self._seq_id += len(batch)
+            except Exception as e:
+                self._error = e
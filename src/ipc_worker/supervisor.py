@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 00:20
+# @Author  : tk
+
+import threading
+from .utils import logger
+
+
+class Supervisor(threading.Thread):
+    '''
+        every interval seconds check_fn() finds the dead processes of an instance and replaces them (see IPC_shm / IPC_zmq _supervise)
+    '''
+    def __init__(self, check_fn, interval=0.5, name=None):
+        super(Supervisor, self).__init__(name=name, daemon=True)
+        self._check_fn = check_fn
+        self.interval = interval
+        self._evt_stop = threading.Event()
+
+    def run(self):
+        while not self._evt_stop.wait(self.interval):
+            try:
+                self._check_fn()
+            except Exception as e:
+                logger.error('supervisor except {}'.format(e))
+
+    def stop(self):
+        self._evt_stop.set()
+
+
+class Restart_backoff:
+    '''
+        delay before a dead process is started again , 0 the first time ,
+        doubles up to max_delay while it keeps dying within min_uptime seconds of its start (a crash in run_begin)
+    '''
+    def __init__(self, base=0.5, max_delay=30, min_uptime=10):
+        self.base = base
+        self.max_delay = max_delay
+        self.min_uptime = min_uptime
+        self._fails = {}
+
+    def delay(self, key, uptime):
+        n = self._fails.get(key, 0) + 1 if uptime < self.min_uptime else 0
+        self._fails[key] = n
+        return min(self.base * 2 ** (n - 1), self.max_delay) if n > 1 else 0
@@ -6,10 +6,15 @@ import os
 import uuid
 import zmq
 
-def auto_bind(socket):
+def auto_bind(socket,host=None):
     # socket.bind_to_random_port('tcp://127.0.0.1')
     # return socket.getsockopt(zmq.LAST_ENDPOINT).decode('ascii')
 
+    # tcp transport , reachable from other hosts when host is a public interface or 0.0.0.0
+    if host is not None:
+        port = socket.bind_to_random_port('tcp://{}'.format(host))
+        return 'tcp://{}:{}'.format(host,port)
+
     if os.name == 'nt':  # for Windows
         socket.bind_to_random_port('tcp://127.0.0.1')
     else:
@@ -23,4 +28,14 @@ def auto_bind(socket):
             tmp_dir = '*'
 
         socket.bind('ipc://{}'.format(tmp_dir))
-    return socket.getsockopt(zmq.LAST_ENDPOINT).decode('ascii')
\ No newline at end of file
+    return socket.getsockopt(zmq.LAST_ENDPOINT).decode('ascii')
+
+
+def advertise_addr(addr,host):
+    # tcp://0.0.0.0:port is only usable locally , tell remote workers the host name instead
+    if host is None or not addr.startswith('tcp://'):
+        return addr
+    bind_host,port = addr[len('tcp://'):].rsplit(':',1)
+    if bind_host in ('0.0.0.0','*'):
+        bind_host = host
+    return 'tcp://{}:{}'.format(bind_host,port)
@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 # @Time    : 2021/11/29 13:45
 # @Author  : tk
-import math
 import multiprocessing
 import os
 import random
 import threading
+import socket
 import time
-from typing import Optional
-from .ipc_zmq_utils import ZMQ_manager,ZMQ_sink,ZMQ_worker
-import pickle
+from queue import Full
+from .ipc_zmq_utils import ZMQ_manager,ZMQ_sink,ZMQ_worker,DISPATCH_PUB,DISPATCH_ROUTER,Inflight_requests
+from .ipc_zmq_direct import ZMQ_direct_io
+from .ipc_zmq_registry import ZMQ_registry
+from .ipc_utils_func import advertise_addr
 from ..utils import logger,Lock as MyLock
-from collections import deque
+from ..response_dispatcher import Response_dispatcher,ResponseState,WorkerDiedError
+from ..supervisor import Supervisor,Restart_backoff
+from ..ipc_client import IPC_client_mixin
+from ..serializer import get_codec
+from ..metrics import SHM_metrics
+from ..priority import Priority_selector
 
 
 class ZMQ_process_worker(ZMQ_worker):
@@ -32,47 +39,157 @@ class ZMQ_process_worker(ZMQ_worker):
 
 
 
-class IPC_zmq:
+class IPC_zmq(IPC_client_mixin):
     def __init__(self,
                  CLS_worker,
                  worker_args: tuple,
                  worker_num: int,
                  group_name,
-                 evt_quit=multiprocessing.Manager().Event(),
+                 evt_quit=None,
                  queue_size=20,
                  is_log_time=False,
-                 daemon=False
+                 daemon=False,
+                 stream_coalesce_ms=0,
+                 stream_coalesce_num=64,
+                 max_batch_size=1,
+                 max_wait_ms=0,
+                 dispatch=DISPATCH_PUB,
+                 prefetch=1,
+                 direct=False,
+                 transport='ipc',
+                 host='127.0.0.1',
+                 registry_port=0,
+                 advertise_host=None,
+                 codec='pickle',
+                 request_codec=None,
+                 response_codec=None,
+                 metrics=True,
+                 max_worker_num=None,
+                 supervise=True,
+                 supervise_interval=0.5,
+                 max_retries=0,
+                 priorities=1,
+                 priority_policy='strict',
+                 priority_weights=None,
                  ):
         self.__manager_lst = []
         self.__woker_lst = []
         self.__group_idenity = []
 
         assert isinstance(worker_args, tuple)
-        manager = ZMQ_manager(0, queue_size, group_name,evt_quit)
-        self.__manager_lst.append(manager)
-
-        sink = ZMQ_sink(queue_size,group_name,evt_quit)
-        self.__manager_lst.append(sink)
+        # pickle | msgpack | raw | Codec instance , request_codec / response_codec default to codec
+        self.__request_codec = get_codec(request_codec if request_codec is not None else codec)
+        self.__response_codec = get_codec(response_codec if response_codec is not None else codec)
+        # pub : client picks the worker round robin , router : manager picks the worker with free prefetch credits
+        assert dispatch in (DISPATCH_PUB,DISPATCH_ROUTER),'bad dispatch {}'.format(dispatch)
+        self.__dispatch = dispatch
+        # tcp : sockets bind on host , workers on other machines join through the registry (see zmq_worker)
+        assert transport in ('ipc','tcp'),'bad transport {}'.format(transport)
+        self.__group_name = group_name
+        self.__host = host if transport == 'tcp' else None
+        self.__registry_port = registry_port
+        self.__advertise_host = advertise_host if advertise_host is not None else socket.gethostname()
+        self.__registry = None
+        self.__addr = None
+        # created here , a Manager().Event() default argument started a server process at import
+        if evt_quit is None:
+            evt_quit = multiprocessing.Event()
+        self.__evt_quit = evt_quit
+        # supervise : a dead local worker is started again in its slot , a request it held is sent again
+        # up to max_retries times while none of its responses reached the client , else it fails with WorkerDiedError
+        # remote workers are not supervised , a dead manager / sink is not started again
+        self.__supervise = supervise
+        self.__supervise_interval = supervise_interval
+        self.__supervisor = None
+        self.__backoff = Restart_backoff()
+        # slot -> time to start its worker again
+        self.__restart_at = {}
+        self.__dead_managers = set()
+        # pub : requests to send again once a worker is back
+        self.__retry_later = []
+        self.__inflight = Inflight_requests(max_retries) if supervise else None
+        # priorities : put(data,priority=p) , 0 the highest , requests waiting for worker credits are taken by priority_policy ,
+        # pub sends every request as soon as it is put , so only router dispatch reorders them
+        if priorities > 1 and dispatch == DISPATCH_PUB:
+            raise ValueError('priorities {} need dispatch router , pub sends requests in put order'.format(priorities))
+        self.__priority = Priority_selector(priorities,priority_policy,priority_weights)
+        priority_options = dict(priorities=priorities,priority_policy=priority_policy,priority_weights=priority_weights)
+        self.__worker_options = dict(is_log_time=is_log_time,
+                                     stream_coalesce_ms=stream_coalesce_ms,
+                                     stream_coalesce_num=stream_coalesce_num,
+                                     max_batch_size=max_batch_size,
+                                     max_wait_ms=max_wait_ms,
+                                     dispatch=dispatch,
+                                     prefetch=prefetch,
+                                     request_codec=self.__request_codec.name,
+                                     response_codec=self.__response_codec.name)
+        # local worker slots , add_workers can grow the pool up to max_worker_num at runtime
+        max_worker_num = max(max_worker_num or worker_num,worker_num)
+        self.__slots = [None] * max_worker_num
+        # identities are never reused , a removed worker may still have messages in flight
+        self.__next_serial = 0
+        # local workers and the manager (direct : the io thread) , remote workers are not counted
+        self.__metrics = SHM_metrics('{}_metrics'.format(group_name),max_worker_num,1) if metrics else None
+        # direct : this process owns the sockets , no manager / sink process and no multiprocessing.Queue hop
+        self.__direct_io = None
+        if not direct:
+            sink = ZMQ_sink(queue_size,group_name,evt_quit,host=self.__host)
+            manager = ZMQ_manager(0, queue_size, group_name,evt_quit,dispatch=dispatch,host=self.__host,metrics=self.__metrics,
+                                  out_queue=sink.get_queue() if supervise else None,**priority_options)
+            self.__manager_lst.append(manager)
+            self.__manager_lst.append(sink)
 
+        self.__new_worker = lambda identity,i: CLS_worker(
+            *worker_args,
+            identity=identity,
+            group_name=group_name,
+            evt_quit=evt_quit,
+            is_log_time=is_log_time,
+            idx=i,
+            stream_coalesce_ms=stream_coalesce_ms,
+            stream_coalesce_num=stream_coalesce_num,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            dispatch=dispatch,
+            prefetch=prefetch,
+            request_codec=self.__request_codec,
+            response_codec=self.__response_codec,
+            metrics=self.__metrics,
+            daemon=daemon
+        )
         for i in range(worker_num):
-            identity = bytes('{}_{}'.format(group_name,i),encoding='utf-8')
-            worker = CLS_worker(
-                *worker_args,
-                identity=identity,
-                group_name=group_name,
-                evt_quit=evt_quit,
-                is_log_time=is_log_time,
-                idx=i,
-                daemon=daemon
-            )
+            identity = self.__new_identity()
+            worker = self.__new_worker(identity,i)
+            self.__slots[i] = worker
             self.__group_idenity.append(identity)
             self.__woker_lst.append(worker)
         self.__last_worker_id = len(self.__group_idenity) - 1
-        self.pending_request = {}
-        self.pending_response = {}
         self.locker = MyLock()
-        self.__last_t = time.time()
-    def start(self):
+        self.__scale_lock = threading.Lock()
+
+        if direct:
+            self.request_id = 0
+            self.__direct_io = ZMQ_direct_io(group_name,self.__group_idenity,queue_size,dispatch,metrics=self.__metrics,
+                                             inflight=self.__inflight,**priority_options)
+            # the dispatcher thread is also the io thread
+            get_fn = self.__direct_io.poll
+        elif supervise:
+            self.__sink_queue = sink.get_queue()
+            get_fn = self._get_response
+        else:
+            get_fn = sink.get_queue().get
+        # one thread drains sink queue and resolves responses by request_id
+        self._dispatcher = Response_dispatcher(get_fn,self._decode,name='{}_dispatcher'.format(group_name))
+        self.pending_request = self._dispatcher.pending_request
+        self.pending_response = self._dispatcher.pending_response
+
+    def start(self,wait_ready=True,timeout=None):
+        '''
+            start every process without waiting for any of them ,
+            wait_ready : return once every local worker is through run_begin (TimeoutError after timeout) with the startup timing ,
+            see _wait_ready , remote workers join later through the registry
+        '''
+        t_start = time.time()
         for w in self.__manager_lst:
             w.start()
 
@@ -81,105 +198,357 @@ class IPC_zmq:
             if i == 0:
                 w.set_signal()
 
-
+        if self.__direct_io is not None:
+            addr_sink,addr_pub = self.__direct_io.bind(self.__host)
+        else:
+            addr_sink,addr_pub = self.__manager_lst[1].addr,self.__manager_lst[0].addr
+        self.__addr = (addr_sink,addr_pub)
         for w in self.__woker_lst:
-            w._set_addr(self.__manager_lst[1].addr,self.__manager_lst[0].addr)
+            w._set_addr(addr_sink,addr_pub)
             w.start()
+            w.t_start = time.time()
+
+        if self.__host is not None:
+            self.__registry = ZMQ_registry(self.__host,self.__registry_port,self._on_register,
+                                           name='{}_registry'.format(self.__group_name))
+            self.__registry.start()
+            logger.info('group {} registry {}'.format(self.__group_name,self.registry_addr))
 
+        # subscribed (pub) or credits sent (router) before the first request , set before run_begin
         for w in self.__woker_lst:
-            while not w.signal.is_set():
+            while not w.signal.wait(0.1) and w.is_alive():
                 pass
             del w.signal
+        self._dispatcher.start()
+        if self.__supervise:
+            self.__supervisor = Supervisor(self._supervise,self.__supervise_interval,name='{}_supervisor'.format(self.__group_name))
+            self.__supervisor.start()
+        if wait_ready:
+            return self._wait_ready(lambda: list(self.__woker_lst),t_start,timeout,supervised=self.__supervise)
 
 
-    def put(self,data):
-        self.__last_worker_id = (self.__last_worker_id + 1 ) % len(self.__group_idenity)
-        idenity = self.__group_idenity[self.__last_worker_id]
-        request_id = self.__manager_lst[0].put(idenity,pickle.dumps(data))
+    def _on_register(self,info):
+        # registry thread , a remote worker joins the group
+        if self.__request_codec.name is None or self.__response_codec.name is None:
+            raise ValueError('remote workers need a codec by name (pickle , msgpack , raw)')
         self.locker.acquire()
-        self.pending_request[request_id] = time.time()
-        self.locker.release()
-        return request_id
+        try:
+            # remote workers are numbered after the local slots
+            idx = len(self.__slots) + self.__next_serial
+            identity = self.__new_identity()
+            self.__group_idenity.append(identity)
+        finally:
+            self.locker.release()
+        logger.info('worker {} registered from {}'.format(idx,info))
+        reply = dict(self.__worker_options)
+        reply.update(group_name=self.__group_name,
+                     idx=idx,
+                     identity=identity.decode('utf-8'),
+                     addr_sink=advertise_addr(self.__addr[0],self.__advertise_host),
+                     addr_pub=advertise_addr(self.__addr[1],self.__advertise_host))
+        return reply
+
+    def __new_identity(self):
+        # fixed width , SUB topics match by prefix (group_1 would also get group_10 ...)
+        identity = bytes('{}_{:08d}'.format(self.__group_name,self.__next_serial),encoding='utf-8')
+        self.__next_serial += 1
+        return identity
+
+    @property
+    def worker_num(self):
+        # local workers
+        return len(self.__woker_lst)
+
+    @property
+    def _max_worker_num(self):
+        return len(self.__slots)
+
+    def add_workers(self,n=1):
+        '''
+            after start , start n more local workers (up to max_worker_num) , return their slot indexes
+        '''
+        with self.__scale_lock:
+            free = [i for i,w in enumerate(self.__slots) if w is None][:n]
+            if len(free) < n:
+                raise ValueError('no free worker slot , max_worker_num {}'.format(len(self.__slots)))
+            for i in free:
+                self.__start_worker(i)
+        return free
+
+    def __start_worker(self,i):
+        self.locker.acquire()
+        try:
+            identity = self.__new_identity()
+        finally:
+            self.locker.release()
+        worker = self.__new_worker(identity,i)
+        worker._set_addr(*self.__addr)
+        worker.start()
+        worker.t_start = time.time()
+        # subscribed (pub) or credits sent (router) before it gets requests
+        worker.signal.wait()
+        del worker.signal
+        self.__slots[i] = worker
+        self.__woker_lst.append(worker)
+        self.locker.acquire()
+        try:
+            self.__group_idenity.append(identity)
+            retry,self.__retry_later = self.__retry_later,[]
+        finally:
+            self.locker.release()
+        self.__send_again(retry)
+
+    def _supervise(self):
+        '''
+            supervisor thread , a dead local worker is replaced in its slot under a new identity ,
+            the requests it held are sent again or fail , a dead manager / sink fails every request without a response
+        '''
+        if self.__evt_quit.is_set():
+            return
+        now = time.time()
+        with self.__scale_lock:
+            for m,p in enumerate(self.__manager_lst):
+                if p.is_alive():
+                    continue
+                if m not in self.__dead_managers:
+                    self.__dead_managers.add(m)
+                    logger.error('group {} {} died , exitcode {}'.format(self.__group_name,type(p).__name__,p.exitcode))
+                self._dispatcher.fail_pending(WorkerDiedError('group {} {} died'.format(self.__group_name,type(p).__name__)))
+            for i,w in enumerate(self.__slots):
+                if w is None or w.is_alive():
+                    continue
+                logger.error('worker {} died , exitcode {}'.format(i,w.exitcode))
+                self.__slots[i] = None
+                self.__woker_lst.remove(w)
+                self.__on_worker_dead(w.identity,i)
+                self.__restart_at[i] = now + self.__backoff.delay(i,now - w.t_start)
+            for i,t in list(self.__restart_at.items()):
+                if now < t:
+                    continue
+                del self.__restart_at[i]
+                # add_workers may have taken the slot meanwhile
+                if self.__slots[i] is None:
+                    self.__start_worker(i)
+
+    def __on_worker_dead(self,identity,i):
+        if self.__direct_io is not None:
+            self.__direct_io.retire(identity,dead=i)
+            return
+        if self.__dispatch == DISPATCH_ROUTER:
+            # the manager knows the requests it held , see _get_response
+            self.__manager_lst[0].worker_died(identity,i)
+            return
+        self.locker.acquire()
+        try:
+            if identity in self.__group_idenity:
+                self.__group_idenity.remove(identity)
+        finally:
+            self.locker.release()
+        retry,lost = self.__inflight.take(identity)
+        self.__send_again(retry,i)
+        for r_id in lost:
+            self._dispatcher.close_request(r_id,WorkerDiedError('request {} lost , worker {} died'.format(r_id,i)))
+
+    def __send_again(self,retry,w_id=None):
+        for r_id,frames,deadline,priority in retry:
+            if w_id is not None:
+                logger.warning('worker {} died , request {} sent again'.format(w_id,r_id))
+            if self.__dispatch != DISPATCH_PUB:
+                self.__manager_lst[0].put(None,frames,deadline=deadline,request_id=r_id,priority=priority)
+                continue
+            self.locker.acquire()
+            try:
+                if not self.__group_idenity:
+                    # every local worker died , see __start_worker
+                    self.__retry_later.append((r_id,frames,deadline,priority))
+                    continue
+                identity = self.__pick_identity()
+                self.__inflight.set_identity(r_id,identity)
+                self.__manager_lst[0].put(identity,frames,deadline=deadline,request_id=r_id,priority=priority)
+            finally:
+                self.locker.release()
 
-    # request_seq_id initail 1
-    def get(self,request_id,request_seq_id=None):
-        d = self._get_private(request_id,request_seq_id)
-        return d if d is None else pickle.loads(d)
-
-    def _check_and_clean(self):
-        c_t = time.time()
-        if math.floor((c_t - self.__last_t) / 600) > 0:
-            self.__last_t = c_t
-            invalid = set({rid for rid, t in self.pending_request.items() if math.floor((c_t - t) / 3600) > 0})
-            logger.debug('remove {}'.format(str(list(invalid))))
-            for rid in invalid:
-                self.pending_request.pop(rid)
-            invalid = set({rid for rid, t in self.pending_response.items() if math.floor((c_t - t["time"]) / 3600) > 0})
-            for rid in invalid:
-                self.pending_response.pop(rid)
-    def _get_private(self, request_id,request_seq_id=None):
-        sink = self.__manager_lst[1]
-        response = None
-        is_end = False
-        timeout = 0.005
-        while not is_end:
-            with self.locker:
-                if request_id in self.pending_request:
-                    up_time = time.time()
-                    self.pending_request[request_id] = up_time
-                    reps = self.pending_response.get(request_id,None)
-                    if reps is not None:
-                        reps["time"] = up_time
-                        rep: Optional[deque] = reps["data"]
-                        item_size = len(rep)
-                        if item_size > 0:
-                            if request_seq_id is None:
-                                (seq_id,response) = rep.popleft()
-                                is_end = True
-                            else:
-                                for i,rep_sub in enumerate(rep):
-                                    if rep_sub[0] == request_seq_id:
-                                        (seq_id,response) = rep_sub
-                                        rep.remove(rep_sub)
-                                        is_end = True
-                                        break
-
-                        if len(rep) == 0:
-                            self.pending_response.pop(request_id)
-
-                    if not is_end:
-                        is_empty = False
-                        try:
-                            item = sink.get_queue().get(block=False,timeout=timeout)
-                        except:
-                            item = None
-                            is_empty = True
-                        if not is_empty:
-                            r_id, w_id, seq_id, response = item
-                            if r_id != request_id or (request_seq_id is not None and request_seq_id != seq_id):
-                                if r_id in self.pending_response:
-                                    rep: Optional[deque] = self.pending_response[r_id]["data"]
-                                    for i,node in enumerate(rep):
-                                        if seq_id > node[0]:
-                                            rep.insert(i+1,(seq_id,response))
-                                            break
-                                else:
-                                    self.pending_response[r_id] = {
-                                        "time": time.time(),
-                                        "data": deque([(seq_id,response)]),
-                                        "last_seq": seq_id - 1,
-                                    }
-                            else:
-                                is_end = True
+    def _get_response(self,timeout=None):
+        '''
+            get_fn with supervise , not direct : the record sees every response , RS_LOST of the manager (router) is sent again here
+        '''
+        item = self.__sink_queue.get(timeout=timeout)
+        r_id,w_id,seq_id,_,state = item
+        if state != ResponseState.RS_LOST:
+            self.__inflight.on_response(r_id,seq_id,state)
+            return item
+        retry,lost = self.__inflight.take(request_ids=[r_id])
+        self.__send_again(retry,w_id)
+        # finished before its credit came back : nothing to report
+        return item if lost else None
+
+    def remove_workers(self,n=1,timeout=None):
+        '''
+            stop n local workers (the newest first , one always stays) , return their slot indexes
+            a stopped worker gets no new requests and leaves after the ones it holds , terminated after timeout
+        '''
+        with self.__scale_lock:
+            used = [i for i,w in enumerate(self.__slots) if w is not None]
+            victims = used[::-1][:max(min(n,len(used) - 1),0)]
+            for i in victims:
+                worker = self.__slots[i]
+                identity = worker.identity
+                if self.__direct_io is not None:
+                    self.__direct_io.retire(identity)
                 else:
-                    logger.error('bad request_id {}'.format(request_id))
-                    is_end = True
+                    # pub : requests take their identity and enter the queue under locker , so the stop comes after them
+                    self.locker.acquire()
+                    try:
+                        if identity in self.__group_idenity:
+                            self.__group_idenity.remove(identity)
+                        self.__manager_lst[0].retire(identity)
+                    finally:
+                        self.locker.release()
+            for i in victims:
+                worker = self.__slots[i]
+                worker.join(timeout)
+                if worker.is_alive():
+                    logger.warning('worker {} not stopped in {}s , terminated'.format(i,timeout))
+                    worker.terminate()
+                    worker.join()
+                self.__slots[i] = None
+                self.__woker_lst.remove(worker)
+        return victims
+
+    @property
+    def registry_addr(self):
+        if self.__registry is None:
+            return None
+        return advertise_addr(self.__registry.addr,self.__advertise_host)
+
+    def _decode(self,frames,is_chunks=False):
+        if is_chunks:
+            return self.__response_codec.loads_list(frames)
+        return self.__response_codec.loads(frames)
+
+    def _put_direct(self,data,future=None,listener=None,block=True,deadline=None,priority=0):
+        frames = self.__request_codec.dumps(data)
+        self.locker.acquire()
+        try:
+            self.request_id += 1
+            request_id = self.request_id
+            self.__add_request(request_id,frames,future,listener,deadline,priority=priority)
+            try:
+                self.__direct_io.put(request_id,frames,block=block,deadline=deadline,priority=priority)
+            except Full:
+                self.__remove_request(request_id)
+                raise
+        finally:
+            self.locker.release()
+        return request_id
+
+    def _put_many(self,data_list,futures=None,deadline=None,priority=0):
+        self.__priority.check(priority)
+        frames_list = [self.__request_codec.dumps(data) for data in data_list]
+        if self.__direct_io is not None:
+            self.locker.acquire()
+            try:
+                request_ids = list(range(self.request_id + 1,self.request_id + 1 + len(frames_list)))
+                self.request_id += len(frames_list)
+                self.__add_requests(request_ids,frames_list,futures,deadline,priority=priority)
+                self.__direct_io.put_many(request_ids,frames_list,deadline=deadline,priority=priority)
+            finally:
+                self.locker.release()
+            return request_ids
+        identity_list = [None] * len(frames_list)
+        frames_list = [[bytes(f) for f in frames] for frames in frames_list]
+        put_many = lambda: self.__manager_lst[0].put_many(identity_list,frames_list,
+                                                          on_requests=lambda r_ids: self.__add_requests(r_ids,frames_list,futures,deadline,identity_list,priority),
+                                                          deadline=deadline,
+                                                          priority=priority)
+        if self.__dispatch != DISPATCH_PUB:
+            return put_many()
+        self.__wait_worker()
+        # remove_workers : a picked identity is queued before its stop
+        self.locker.acquire()
+        try:
+            for i in range(len(identity_list)):
+                identity_list[i] = self.__pick_identity()
+            return put_many()
+        finally:
+            self.locker.release()
 
-                if is_end:
-                    self._check_and_clean()
-                if is_end:
-                    break
-        return response
+    def _put(self,data,future=None,listener=None,block=True,deadline=None,priority=0):
+        self.__priority.check(priority)
+        if self.__direct_io is not None:
+            return self._put_direct(data,future,listener,block,deadline,priority)
+        # multiprocessing queue pickles its items , so frames are copied to bytes here once
+        frames = [bytes(f) for f in self.__request_codec.dumps(data)]
+        put = lambda idenity: self.__manager_lst[0].put(idenity,frames,
+                                                        on_request=lambda r_id: self.__add_request(r_id,frames,future,listener,deadline,idenity,priority),
+                                                        on_full=self.__remove_request,
+                                                        block=block,
+                                                        deadline=deadline,
+                                                        priority=priority)
+        if self.__dispatch != DISPATCH_PUB:
+            return put(None)
+        self.__wait_worker(block)
+        # remove_workers : a picked identity is queued before its stop
+        self.locker.acquire()
+        try:
+            return put(self.__pick_identity())
+        finally:
+            self.locker.release()
+
+    def __wait_worker(self,block=True):
+        # pub : every local worker died , wait until the supervisor started one again
+        while not self.__group_idenity and self.__restart_at:
+            if not block:
+                raise Full
+            time.sleep(0.01)
+
+    def __pick_identity(self):
+        # pub round robin , under locker
+        if not self.__group_idenity:
+            raise WorkerDiedError('group {} has no live worker'.format(self.__group_name))
+        self.__last_worker_id = (self.__last_worker_id + 1) % len(self.__group_idenity)
+        return self.__group_idenity[self.__last_worker_id]
+
+    def __add_request(self,request_id,frames,future=None,listener=None,deadline=None,identity=None,priority=0):
+        self._dispatcher.add_request(request_id,future,listener,deadline=deadline)
+        if self.__inflight is not None:
+            self.__inflight.add(request_id,frames,deadline,identity,priority)
+
+    def __add_requests(self,request_ids,frames_list,futures=None,deadline=None,identity_list=None,priority=0):
+        self._dispatcher.add_requests(request_ids,futures,deadline=deadline)
+        if self.__inflight is not None:
+            for i,request_id in enumerate(request_ids):
+                self.__inflight.add(request_id,frames_list[i],deadline,identity_list[i] if identity_list else None,priority)
+
+    def __remove_request(self,request_id):
+        self._dispatcher.remove_listener(request_id)
+        if self.__inflight is not None:
+            self.__inflight.remove(request_id)
+
+    def _cancel(self,request_id):
+        if self.__inflight is not None:
+            self.__inflight.remove(request_id)
+        if self.__direct_io is not None:
+            self.__direct_io.cancel(request_id)
+        else:
+            self.__manager_lst[0].cancel(request_id)
+
+    def _stats(self):
+        d = self.__metrics.snapshot() if self.__metrics is not None else {'workers': [],'managers': []}
+        d['group'] = self.__group_name
+        # only the slots in use
+        d['workers'] = [w for w in d['workers'] if self.__slots[w['idx']] is not None]
+        d['queue'] = self._dispatcher.depth()
+        if self.__direct_io is None:
+            try:
+                d['queue'].update(input=self.__manager_lst[0].queue.qsize(),
+                                  output=self.__manager_lst[1].get_queue().qsize())
+            except NotImplementedError:
+                # multiprocessing.Queue.qsize on macOS
+                pass
+        else:
+            d['queue']['input'] = self.__direct_io.qsize()
+        return d
 
     def join(self,timeout=None):
         for p in self.__manager_lst:
@@ -197,9 +566,23 @@ class IPC_zmq:
         return self.__woker_lst
 
     def terminate(self):
+        if self.__supervisor is not None:
+            self.__supervisor.stop()
+            self.__supervisor.join()
+        self._stop_autoscaler()
+        self._stop_metrics_server()
+        if self.__registry is not None:
+            self.__registry.stop()
+        self._dispatcher.stop()
+        if self.__direct_io is not None:
+            # sockets belong to the dispatcher thread
+            self._dispatcher.join(1)
+            self.__direct_io.close()
         for p in self.__woker_lst + self.__manager_lst:
             try:
                 p.release()
             except Exception as e:
                 pass
-            p.terminate()
\ No newline at end of file
+            p.terminate()
+        if self.__metrics is not None:
+            self.__metrics.unlink()
\ No newline at end of file
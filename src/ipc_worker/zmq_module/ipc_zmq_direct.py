@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 20:10
+# @Author  : tk
+
+import threading
+import time
+from collections import OrderedDict, deque
+from queue import Empty, Full
+import zmq
+from .ipc_utils_func import auto_bind
+from .ipc_zmq_utils import DISPATCH_PUB,DISPATCH_ROUTER,CANCEL_TOPIC,STOP_TOPIC,pack_deadline,is_expired,recv_subscriptions
+from ..utils import logger
+from ..response_dispatcher import ResponseState
+from ..priority import Priority_selector, Priority_deque
+
+# direct 模式: 客户端进程自己持有 zmq socket , 不经过 manager / sink 进程和 multiprocessing.Queue
+# 请求: 调用线程 -> inproc PUSH -> io 线程 -> PUB / ROUTER -> worker
+# 响应: worker PUSH -> PULL -> io 线程 (即 Response_dispatcher 线程 , poll 为其 get_fn)
+
+
+class ZMQ_direct_io:
+    def __init__(self, group_name, identity_list, queue_size=20, dispatch=DISPATCH_PUB, metrics=None, inflight=None,
+                 priorities=1, priority_policy='strict', priority_weights=None):
+        self.group_name = group_name
+        # Inflight_requests of the client , the io thread records the worker of each request and its responses
+        self._inflight = inflight
+        self._identity_list = identity_list
+        self._queue_size = queue_size
+        self._dispatch = dispatch
+        self._lock = threading.Lock()
+        # identity_list may grow when remote workers register , workers are removed from it by the io thread (retire)
+        self._rr = -1
+        self._retired = set()
+        # pub : identities whose SUB subscription reached the XPUB , only they take part in the round robin
+        self._subscribed = set()
+        # pub : stops of workers not subscribed yet
+        self._stop_pending = set()
+        # (t_recv,parts,priority) of requests waiting for a worker credit (router) , taken by priority
+        self._pending = Priority_deque(Priority_selector(priorities, priority_policy, priority_weights), lambda item: item[2])
+        # SHM_metrics , the io thread writes the manager section
+        self._metrics = metrics
+        self._stat = None
+        self._credits = OrderedDict()
+        self._results = deque()
+        self._in_paused = False
+        self._context = None
+        self.addr = None
+        self.addr_sink = None
+
+    def bind(self,host=None):
+        self._context = zmq.Context()
+        if self._dispatch == DISPATCH_ROUTER:
+            self._sender = self._context.socket(zmq.ROUTER)
+            self._sender.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        else:
+            self._sender = self._context.socket(zmq.XPUB)
+        self._sender.setsockopt(zmq.LINGER, 0)
+        self.addr = auto_bind(self._sender,host)
+
+        self._receiver = self._context.socket(zmq.PULL)
+        self._receiver.setsockopt(zmq.LINGER, 0)
+        self.addr_sink = auto_bind(self._receiver,host)
+
+        inproc = 'inproc://{}_direct_{}'.format(self.group_name, id(self))
+        # queue_size bounds requests not yet taken by the io thread , an inproc pipe holds SNDHWM + RCVHWM messages ,
+        # the default RCVHWM (1000) would let put(block=False) go on long after the io thread stopped reading
+        self._in = self._context.socket(zmq.PULL)
+        self._in.setsockopt(zmq.RCVHWM, self._queue_size)
+        self._in.bind(inproc)
+        self._in_sender = self._context.socket(zmq.PUSH)
+        self._in_sender.setsockopt(zmq.SNDHWM, self._queue_size)
+        self._in_sender.setsockopt(zmq.LINGER, 0)
+        self._in_sender.connect(inproc)
+
+        if self._metrics is not None:
+            self._stat = self._metrics.writer('manager', 0)
+
+        self._poller = zmq.Poller()
+        self._poller.register(self._in, zmq.POLLIN)
+        self._poller.register(self._receiver, zmq.POLLIN)
+        # router : credits , pub : subscriptions
+        self._poller.register(self._sender, zmq.POLLIN)
+        return self.addr_sink, self.addr
+
+    # caller threads , inproc message : [request_id,deadline,priority,*frames] , [CANCEL_TOPIC,request_id] or [STOP_TOPIC,identity(,idx)]
+    # the io thread strips the priority frame , workers get [request_id,deadline,*frames]
+    def put(self, request_id, frames, block=True, deadline=None, priority=0):
+        b_request_id = request_id.to_bytes(4, byteorder='little', signed=False)
+        with self._lock:
+            try:
+                self._in_sender.send_multipart([b_request_id, pack_deadline(deadline), bytes([priority])] + frames, copy=False,
+                                               flags=0 if block else zmq.NOBLOCK)
+            except zmq.Again:
+                raise Full
+
+    def put_many(self, request_ids, frames_list, deadline=None, priority=0):
+        b_deadline = pack_deadline(deadline)
+        b_priority = bytes([priority])
+        with self._lock:
+            for request_id, frames in zip(request_ids, frames_list):
+                self._in_sender.send_multipart([request_id.to_bytes(4, byteorder='little', signed=False),
+                                                b_deadline, b_priority] + frames, copy=False)
+
+    def cancel(self, request_id):
+        with self._lock:
+            self._in_sender.send_multipart([CANCEL_TOPIC, request_id.to_bytes(4, byteorder='little', signed=False)])
+
+    def retire(self, identity, dead=None):
+        '''
+            the io thread stops picking identity , then sends it the stop after its last request
+            dead : worker index when it died , its requests are sent again or reported lost (RS_LOST)
+        '''
+        msg = [STOP_TOPIC, identity]
+        if dead is not None:
+            msg.append(dead.to_bytes(4, byteorder='little', signed=False))
+        with self._lock:
+            self._in_sender.send_multipart(msg)
+
+    def qsize(self):
+        # requests taken by the io thread and waiting for a worker
+        return len(self._pending)
+
+    # io thread
+    def _on_dispatch(self, t_recv, is_dropped=False):
+        if self._stat is None:
+            return
+        if is_dropped:
+            self._stat.add('dropped')
+        else:
+            self._stat.add('dispatched')
+            self._stat.observe('dispatch_wait_us', (time.time() - t_recv) * 1e6)
+
+    def _cancel(self, b_request_id):
+        for item in self._pending:
+            if item[1][0].bytes == b_request_id:
+                self._pending.remove(item)
+                self._on_dispatch(item[0], is_dropped=True)
+                return
+        # already sent
+        if self._dispatch == DISPATCH_ROUTER:
+            for identity in self._credits:
+                try:
+                    self._sender.send_multipart([identity, b'', CANCEL_TOPIC, b_request_id])
+                except zmq.ZMQError:
+                    # the worker is gone
+                    pass
+        else:
+            self._sender.send_multipart([CANCEL_TOPIC, CANCEL_TOPIC, b_request_id])
+
+    def _retire(self, identity, dead=None):
+        if self._dispatch == DISPATCH_ROUTER:
+            self._retired.add(identity)
+            self._credits.pop(identity, None)
+            if dead is None:
+                self._sender.send_multipart([identity, b'', STOP_TOPIC])
+        else:
+            if identity in self._identity_list:
+                self._identity_list.remove(identity)
+            if dead is None:
+                if identity in self._subscribed:
+                    self._sender.send_multipart([identity, STOP_TOPIC])
+                else:
+                    self._stop_pending.add(identity)
+        if dead is not None and self._inflight is not None:
+            self._on_dead(identity, int.from_bytes(dead, byteorder='little', signed=False))
+
+    def _on_dead(self, identity, idx):
+        # responses already received count before a request is sent again
+        self._recv_results()
+        retry, lost = self._inflight.take(identity)
+        for request_id, frames, deadline, priority in reversed(retry):
+            logger.warning('worker {} died , request {} sent again'.format(idx, request_id))
+            parts = [request_id.to_bytes(4, byteorder='little', signed=False), pack_deadline(deadline)] + list(frames)
+            self._pending.appendleft((time.time(), [zmq.Frame(p) for p in parts], priority))
+        for request_id in lost:
+            self._results.append((request_id, idx, 0, None, ResponseState.RS_LOST))
+
+    def _send_pending(self):
+        while self._pending:
+            if is_expired(self._pending.peek()[1][1].bytes):
+                self._on_dispatch(self._pending.popleft()[0], is_dropped=True)
+                continue
+            if self._dispatch == DISPATCH_ROUTER and not any(self._credits.values()):
+                return
+            # every worker died or none subscribed yet , requests wait for them
+            if self._dispatch != DISPATCH_ROUTER and not any(identity in self._subscribed for identity in self._identity_list):
+                return
+            item = self._pending.popleft()
+            t_recv, parts, _ = item
+            if self._dispatch == DISPATCH_ROUTER:
+                identity = max(self._credits, key=self._credits.get)
+                self._credits[identity] -= 1
+                self._credits.move_to_end(identity)
+                try:
+                    self._sender.send_multipart([identity, b''] + parts, copy=False)
+                except zmq.ZMQError:
+                    # ROUTER_MANDATORY , the worker is gone , its credits with it
+                    self._credits.pop(identity, None)
+                    self._pending.appendleft(item)
+                    continue
+            else:
+                while True:
+                    self._rr = (self._rr + 1) % len(self._identity_list)
+                    identity = self._identity_list[self._rr]
+                    if identity in self._subscribed:
+                        break
+                self._sender.send_multipart([identity] + parts, copy=False)
+            if self._inflight is not None:
+                self._inflight.set_identity(int.from_bytes(parts[0].bytes, byteorder='little', signed=False), identity)
+            self._on_dispatch(t_recv)
+
+    def _on_result(self, parts):
+        request_id, w_id, seq_id, state = [p.bytes for p in parts[:4]]
+        item = (int.from_bytes(request_id, byteorder='little', signed=False),
+                int.from_bytes(w_id, byteorder='little', signed=False),
+                int.from_bytes(seq_id, byteorder='little', signed=False),
+                [p.buffer for p in parts[4:]],
+                int.from_bytes(state, byteorder='little', signed=False))
+        if self._inflight is not None:
+            self._inflight.on_response(item[0], item[2], item[4])
+        self._results.append(item)
+
+    def _recv_results(self):
+        while True:
+            try:
+                self._on_result(self._receiver.recv_multipart(zmq.NOBLOCK, copy=False))
+            except zmq.Again:
+                break
+
+    def poll(self, timeout=None):
+        '''
+            get_fn of Response_dispatcher , move requests to workers while waiting for a result
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._results:
+            t = -1 if deadline is None else max(int((deadline - time.time()) * 1000), 0)
+            events = dict(self._poller.poll(t))
+            if not events and deadline is not None and time.time() >= deadline:
+                # requests left while no worker was there
+                self._send_pending()
+                raise Empty
+            if self._in in events:
+                while len(self._pending) < self._queue_size:
+                    try:
+                        parts = self._in.recv_multipart(zmq.NOBLOCK, copy=False)
+                    except zmq.Again:
+                        break
+                    if parts[0].bytes == CANCEL_TOPIC:
+                        self._cancel(parts[1].bytes)
+                    elif parts[0].bytes == STOP_TOPIC:
+                        self._retire(parts[1].bytes, parts[2].bytes if len(parts) > 2 else None)
+                    else:
+                        self._pending.append((time.time(), parts[:2] + parts[3:], parts[2].bytes[0]))
+            if self._sender in events and self._dispatch != DISPATCH_ROUTER:
+                recv_subscriptions(self._sender, self._subscribed)
+                for identity in self._stop_pending & self._subscribed:
+                    self._stop_pending.discard(identity)
+                    self._sender.send_multipart([identity, STOP_TOPIC])
+            elif self._sender in events:
+                while True:
+                    try:
+                        identity, b_n = self._sender.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    if identity in self._retired:
+                        continue
+                    self._credits[identity] = self._credits.get(identity, 0) + \
+                                              int.from_bytes(b_n, byteorder='little', signed=False)
+            self._send_pending()
+            # stop taking requests while queue_size of them wait for credits , callers then see Full
+            is_full = len(self._pending) >= self._queue_size
+            if is_full != self._in_paused:
+                if is_full:
+                    self._poller.unregister(self._in)
+                else:
+                    self._poller.register(self._in, zmq.POLLIN)
+                self._in_paused = is_full
+            if self._receiver in events:
+                self._recv_results()
+        return self._results.popleft()
+
+    def close(self):
+        if self._context is None:
+            return
+        try:
+            for s in (self._in_sender, self._in, self._sender, self._receiver):
+                s.close()
+            self._context.term()
+        except Exception as e:
+            logger.warning('direct io close except {}'.format(e))
+        self._context = None
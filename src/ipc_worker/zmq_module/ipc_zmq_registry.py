@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 20:50
+# @Author  : tk
+
+import json
+import os
+import socket
+import threading
+import zmq
+from ..utils import logger
+
+
+class ZMQ_registry(threading.Thread):
+    '''
+        tcp transport , workers started on other hosts (python -m ipc_worker.zmq_worker --connect addr)
+        send a register request to this REP socket and get their idx , identity , socket addresses and worker options
+        on_register(info) -> dict , info is the json request of the worker (hostname , pid)
+    '''
+    def __init__(self, host, port, on_register, name=None):
+        super(ZMQ_registry, self).__init__(name=name, daemon=True)
+        self._host = host
+        self._port = port
+        self._on_register = on_register
+        self._evt_stop = threading.Event()
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.REP)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        if port:
+            self._socket.bind('tcp://{}:{}'.format(host, port))
+        else:
+            self._port = self._socket.bind_to_random_port('tcp://{}'.format(host))
+        self.addr = 'tcp://{}:{}'.format(host, self._port)
+
+    def stop(self):
+        self._evt_stop.set()
+
+    def run(self):
+        try:
+            while not self._evt_stop.is_set():
+                if not self._socket.poll(100):
+                    continue
+                info = json.loads(self._socket.recv())
+                try:
+                    reply = self._on_register(info)
+                except Exception as e:
+                    logger.error('register worker {} failed , {}'.format(info, e))
+                    reply = {'error': str(e)}
+                self._socket.send(json.dumps(reply).encode('utf-8'))
+        finally:
+            self._socket.close()
+            self._context.term()
+
+
+def register_worker(addr, timeout=10):
+    '''
+        worker side , return the reply of ZMQ_registry
+    '''
+    context = zmq.Context()
+    s = context.socket(zmq.REQ)
+    s.setsockopt(zmq.LINGER, 0)
+    try:
+        s.connect(addr)
+        s.send(json.dumps({'hostname': socket.gethostname(), 'pid': os.getpid()}).encode('utf-8'))
+        if not s.poll(timeout * 1000):
+            raise TimeoutError('no reply from {}'.format(addr))
+        reply = json.loads(s.recv())
+    finally:
+        s.close()
+        context.term()
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return reply
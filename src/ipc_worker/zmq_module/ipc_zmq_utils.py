@@ -1,29 +1,165 @@
 # @Time    : 2021/11/26 21:15
 # @Author  : tk
 # @FileName: zmq_utils.py
+import queue
+import struct
 import threading
+import time
 import traceback
 import typing
 import zmq
-from multiprocessing import Queue,Event,Process
-import pickle
+from collections import OrderedDict, deque
+from multiprocessing import Queue,Event,Process,RawValue
 from datetime import datetime
 from .ipc_utils_func import auto_bind
 from ..utils import logger,Lock as MyLock
+from ..response_dispatcher import ResponseState
+from ..stream_utils import Stream_writer
+from ..serializer import frames_nbytes,get_codec
+from ..metrics import record_run
+from ..priority import Priority_selector,Priority_deque
+
+
+# pub    : manager publishes on the identity picked by the client (round robin) , a worker SUB socket filters its own
+# router : worker DEALER announces credits (prefetch) , manager ROUTER sends every request to the worker with most credits
+DISPATCH_PUB = 'pub'
+DISPATCH_ROUTER = 'router'
+
+# worker side messages , route is the SUB topic or the DEALER empty delimiter
+# request : [route,request_id,deadline (float64 , 0 none),*frames]
+# cancel  : [route,CANCEL_TOPIC,request_id] , pub sends it on CANCEL_TOPIC to every worker
+CANCEL_TOPIC = b'\x00cancel'
+# cancelled request_ids a worker remembers
+CANCEL_KEEP = 4096
+# stop    : [route,STOP_TOPIC] , sent by remove_workers after the last request of the worker , it leaves once its backlog is done
+STOP_TOPIC = b'\x00stop'
+# pub : the publisher is an XPUB socket , a worker's SUB subscription arrives as SUBSCRIBE_PREFIX + identity ,
+# nothing is published to an identity before (a SUB drops what was sent before its subscription reached the publisher)
+SUBSCRIBE_PREFIX = b'\x01'
+
+
+def recv_subscriptions(sender,subscribed):
+    # add the identities subscribed since the last call , non blocking
+    while True:
+        try:
+            msg = sender.recv(zmq.NOBLOCK)
+        except zmq.Again:
+            return
+        if msg[:1] == SUBSCRIBE_PREFIX and msg[1:] != CANCEL_TOPIC:
+            subscribed.add(msg[1:])
+
+
+class Inflight_requests:
+    '''
+        client side record of the requests not finished yet , read by the supervisor when a worker dies
+        request_id -> [identity,frames,deadline,attempt,n_sent,priority] , identity None while unknown (router picks it in the manager)
+        frames are kept only with max_retries , a request is sent again while nothing of it reached the client
+    '''
+    def __init__(self,max_retries=0):
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def add(self,request_id,frames,deadline=None,identity=None,priority=0):
+        with self._lock:
+            self._items[request_id] = [identity,frames if self.max_retries else None,deadline,0,0,priority]
+
+    def set_identity(self,request_id,identity):
+        with self._lock:
+            item = self._items.get(request_id,None)
+            if item is not None:
+                item[0] = identity
+
+    def remove(self,request_id):
+        with self._lock:
+            self._items.pop(request_id,None)
+
+    def on_response(self,request_id,seq_id,state):
+        with self._lock:
+            item = self._items.get(request_id,None)
+            if item is None:
+                return
+            # a plain result (seq_id 0) or the end of a stream
+            if seq_id == 0 or state == ResponseState.RS_END:
+                del self._items[request_id]
+            else:
+                item[4] += 1
+
+    def take(self,identity=None,request_ids=None):
+        '''
+            requests of a dead worker (by identity or request_ids) -> (retry,lost) , finished ones are skipped
+            retry : [(request_id,frames,deadline,priority)] still recorded with attempt + 1 , lost : request_ids no longer recorded
+        '''
+        retry,lost = [],[]
+        with self._lock:
+            if request_ids is None:
+                request_ids = [r_id for r_id,item in self._items.items() if item[0] == identity]
+            for r_id in request_ids:
+                item = self._items.get(r_id,None)
+                if item is None:
+                    continue
+                if item[4] == 0 and item[3] < self.max_retries:
+                    item[0],item[3] = None,item[3] + 1
+                    retry.append((r_id,item[1],item[2],item[5]))
+                else:
+                    del self._items[r_id]
+                    lost.append(r_id)
+        return retry,lost
+
+
+def pack_deadline(deadline):
+    return struct.pack('d',deadline or 0.0)
+
+
+def is_expired(b_deadline):
+    deadline = struct.unpack('d',b_deadline)[0]
+    return deadline > 0 and time.time() > deadline
 
 
 class ZMQ_worker(Process):
-    def __init__(self,identity,group_name,evt_quit,is_log_time,idx,daemon=False):
+    def __init__(self,identity,group_name,evt_quit,is_log_time,idx,
+                 stream_coalesce_ms=0,stream_coalesce_num=64,
+                 max_batch_size=1,max_wait_ms=0,
+                 dispatch=DISPATCH_PUB,prefetch=1,
+                 request_codec='pickle',response_codec='pickle',metrics=None,daemon=False):
         super(ZMQ_worker,self).__init__(daemon=daemon)
+        # SHM_metrics of the group , local workers only
+        self._metrics = metrics
+        self._stat = None
         self.__identity = identity
+        self._request_codec = get_codec(request_codec)
+        self._response_codec = get_codec(response_codec)
+        self._dispatch = dispatch
+        # requests queued to this worker in router mode , at least a full batch
+        self._prefetch = max(prefetch,max_batch_size,1)
+        self._max_batch_size = max_batch_size
+        self._max_wait_ms = max_wait_ms
+        self._stream_coalesce_ms = stream_coalesce_ms
+        self._stream_coalesce_num = stream_coalesce_num
         self._group_name = group_name
         self._evt_quit = evt_quit
         self._idx = idx
         self._is_log_time = is_log_time
 
+        # subscribed (pub) or credits sent (router)
         self.signal = Event()
+        # time.time() once run_begin returned , 0 before , read by IPC_zmq.start(wait_ready=True)
+        self._t_ready = RawValue('d',0)
         self.__is_closed = False
+        # requests read while checking for cancels , cancelled request_ids , requests being run (request_id -> deadline)
+        self._backlog = deque()
+        self._cancelled = OrderedDict()
+        self._running = {}
+        self._is_stopping = False
+
+
+    @property
+    def identity(self):
+        return self.__identity
 
+    @property
+    def t_ready(self):
+        return self._t_ready.value or None
 
     def _set_addr(self,addr_sink,addr_pub):
         self._addr_sink = addr_sink
@@ -41,14 +177,26 @@ class ZMQ_worker(Process):
     def run_once(self, request_data):
         raise NotImplementedError
 
+    # max_batch_size > 1 : requests arrived within max_wait_ms are passed together , return one result per request
+    def run_batch(self, request_list):
+        return [self.run_once(request_data) for request_data in request_list]
+
     def __processinit__(self):
         self._context = zmq.Context()
-        self._receiver = self._context.socket(zmq.SUB)
-        self._receiver.setsockopt(zmq.SUBSCRIBE, self.__identity)
-        # self._receiver.setsockopt(zmq.SUBSCRIBE, b'')
-
-        # self._receiver.connect('tcp://{}:{}'.format(self._ip, self._port))
-        self._receiver.connect(self._addr_pub)
+        if self._dispatch == DISPATCH_ROUTER:
+            self._receiver = self._context.socket(zmq.DEALER)
+            self._receiver.setsockopt(zmq.IDENTITY, self.__identity)
+            self._receiver.setsockopt(zmq.LINGER, 0)
+            self._receiver.connect(self._addr_pub)
+            self._send_credit(self._prefetch)
+        else:
+            self._receiver = self._context.socket(zmq.SUB)
+            self._receiver.setsockopt(zmq.SUBSCRIBE, self.__identity)
+            self._receiver.setsockopt(zmq.SUBSCRIBE, CANCEL_TOPIC)
+            # self._receiver.setsockopt(zmq.SUBSCRIBE, b'')
+
+            # self._receiver.connect('tcp://{}:{}'.format(self._ip, self._port))
+            self._receiver.connect(self._addr_pub)
 
         self._sender = self._context.socket(zmq.PUSH)
         self._sender.setsockopt(zmq.LINGER, 0)
@@ -59,35 +207,139 @@ class ZMQ_worker(Process):
         try:
             if not self.__is_closed:
                 self.__is_closed = True
+                # term blocks until every socket is closed
                 self._receiver.close()
-                self._context.term()
                 self._sender.close()
+                self._context.term()
         except Exception as e:
             ...
 
+    def _on_control(self,parts):
+        # True when parts is a cancel or stop message
+        if parts[1].bytes == STOP_TOPIC:
+            self._is_stopping = True
+            return True
+        if parts[1].bytes != CANCEL_TOPIC:
+            return False
+        self._cancelled[parts[2].bytes] = True
+        while len(self._cancelled) > CANCEL_KEEP:
+            self._cancelled.popitem(last=False)
+        return True
+
+    def _poll_control(self):
+        # drain the socket without blocking , requests wait in the backlog
+        while self._receiver.poll(0):
+            parts = self._receiver.recv_multipart(copy=False)
+            if not self._on_control(parts):
+                self._backlog.append(parts)
+
+    def _is_dead(self,b_request_id,b_deadline):
+        return b_request_id in self._cancelled or is_expired(b_deadline)
+
+    # call from run_once / run_batch , True when the current request (every request of the batch) was cancelled or expired
+    def is_cancelled(self):
+        if not self._running:
+            return False
+        self._poll_control()
+        return all(self._is_dead(b_request_id,b_deadline) for b_request_id,b_deadline in self._running.items())
+
+    def _recv(self,timeout=None):
+        '''
+            next live request , None on timeout (ms) or once stopped , cancels and dead requests are consumed here
+        '''
+        while True:
+            if self._is_stopping and not self._backlog:
+                return None
+            if self._backlog:
+                parts = self._backlog.popleft()
+            else:
+                if timeout is not None and not self._receiver.poll(timeout):
+                    return None
+                parts = self._receiver.recv_multipart(copy=False)
+            if self._on_control(parts):
+                continue
+            if self._is_dead(parts[1].bytes,parts[2].bytes):
+                if self._dispatch == DISPATCH_ROUTER:
+                    self._send_credit(1)
+                continue
+            return parts
+
+    def _send_credit(self,n):
+        self._receiver.send(int.to_bytes(n,4,byteorder="little",signed=False))
+
+    def _send(self,b_request_id,seq_id,frames,state):
+        # [request_id,worker_id,seq_id,state,*frames] , out of band buffers go as their own zmq frames without copy
+        self._sender.send_multipart([b_request_id,
+                                     int.to_bytes(self._idx,4,byteorder="little",signed=False),
+                                     int.to_bytes(seq_id,4,byteorder="little",signed=False),
+                                     int.to_bytes(state,1,byteorder="little",signed=False)] + frames,copy=False)
+
+    def _send_result(self,b_request_id,XX):
+        seq_id = 0
+        if isinstance(XX, typing.Generator):
+            def send_fn(seq_id,chunks):
+                if len(chunks) == 1:
+                    self._send(b_request_id,seq_id,self._response_codec.dumps(chunks[0]),ResponseState.RS_DATA)
+                else:
+                    self._send(b_request_id,seq_id,self._response_codec.dumps_list(chunks),ResponseState.RS_CHUNKS)
+
+            def is_cancelled():
+                self._poll_control()
+                return self._is_dead(b_request_id,self._running[b_request_id])
+            seq_id = Stream_writer(send_fn,self._stream_coalesce_ms,self._stream_coalesce_num).run(XX,is_cancelled=is_cancelled)
+            # end of stream
+            self._send(b_request_id,seq_id + 1,[],ResponseState.RS_END)
+        else:
+            self._send(b_request_id,seq_id,self._response_codec.dumps(XX),ResponseState.RS_DATA)
+
+    def _recv_batch(self):
+        # block for the first request , then gather up to max_batch_size within max_wait_ms
+        parts = self._recv()
+        if parts is None:
+            return []
+        parts_list = [parts]
+        if self._max_batch_size > 1:
+            deadline = time.time() + self._max_wait_ms / 1000
+            while len(parts_list) < self._max_batch_size:
+                parts = self._recv(max(int((deadline - time.time()) * 1000),0))
+                if parts is None:
+                    break
+                parts_list.append(parts)
+        return parts_list
+
     def run(self):
         self.__processinit__()
+        if self._metrics is not None:
+            self._stat = self._metrics.writer('worker',self._idx)
         self.signal.set()
         self.run_begin()
+        self._t_ready.value = time.time()
 
         try:
             while not self._evt_quit.is_set():
-                _,msg,b_request_id = self._receiver.recv_multipart()
-                if self.__is_closed:
+                parts_list = self._recv_batch()
+                if self.__is_closed or not parts_list:
                     break
-                msg_size = len(msg)
-                request_data = pickle.loads(msg)
+                b_request_ids = [parts[1].bytes for parts in parts_list]
+                self._running = {parts[1].bytes: parts[2].bytes for parts in parts_list}
+                frames_list = [[p.buffer for p in parts[3:]] for parts in parts_list]
+                size_list = [frames_nbytes(frames) for frames in frames_list]
+                msg_size = sum(size_list)
+                request_list = [self._request_codec.loads(frames) for frames in frames_list]
                 start_t = datetime.now()
-                XX = self.run_once(request_data)
-                seq_id = 0
-                if isinstance(XX, typing.Generator):
-                    for X in XX:
-                        seq_id += 1
-                        X = pickle.dumps(X)
-                        self._sender.send_multipart([b_request_id,int.to_bytes(self._idx,4,byteorder="little",signed=False),int.to_bytes(seq_id,4,byteorder="little",signed=False),X])
+                t0 = time.perf_counter()
+                if self._max_batch_size > 1:
+                    XX_list = self.run_batch(request_list)
+                    assert len(XX_list) == len(request_list),'run_batch must return one result per request'
                 else:
-                    X = pickle.dumps(XX)
-                    self._sender.send_multipart([b_request_id,int.to_bytes(self._idx,4,byteorder="little",signed=False),int.to_bytes(seq_id,4,byteorder="little",signed=False), X])
+                    XX_list = [self.run_once(request_list[0])]
+                for b_request_id,XX in zip(b_request_ids,XX_list):
+                    self._send_result(b_request_id,XX)
+                self._running = {}
+                record_run(self._stat,size_list,time.perf_counter() - t0)
+                if self._dispatch == DISPATCH_ROUTER:
+                    self._send_credit(len(b_request_ids))
+                del parts_list,frames_list,request_list,XX_list
 
                 if self._is_log_time:
                     deata = datetime.now() - start_t
@@ -106,10 +358,11 @@ class ZMQ_worker(Process):
 
 
 class ZMQ_sink(Process):
-    def __init__(self,queue_size,group_name,evt_quit,**kwargs):
+    def __init__(self,queue_size,group_name,evt_quit,host=None,**kwargs):
         super(ZMQ_sink,self).__init__(**kwargs)
 
         self.group_name = group_name
+        self.host = host
         self.__is_closed = False
         self.evt_quit = evt_quit
 
@@ -128,7 +381,7 @@ class ZMQ_sink(Process):
         self.receiver = self.context.socket(zmq.PULL)
         self.receiver.setsockopt(zmq.LINGER, 0)
         # self.receiver.bind('tcp://*:{}'.format(self.port_out))
-        self.addr = auto_bind(self.receiver)
+        self.addr = auto_bind(self.receiver,self.host)
         logger.debug('group {} sink bind {}'.format(self.group_name,self.addr))
         self.queue.put(self.addr)
 
@@ -149,13 +402,14 @@ class ZMQ_sink(Process):
         self.__processinit__()
         try:
             while not self.evt_quit.is_set():
-                request_id,w_id,seq_id,response = self.receiver.recv_multipart()
+                request_id,w_id,seq_id,state,*frames = self.receiver.recv_multipart()
                 if self.__is_closed:
                     break
                 r_id = int.from_bytes(request_id, byteorder='little', signed=False)
                 w_id = int.from_bytes(w_id, byteorder='little', signed=False)
                 seq_id = int.from_bytes(seq_id, byteorder='little', signed=False)
-                self.queue.put((r_id,w_id,seq_id,response))
+                state = int.from_bytes(state, byteorder='little', signed=False)
+                self.queue.put((r_id,w_id,seq_id,frames,state))
         except KeyboardInterrupt:
             ...
         except Exception as e:
@@ -169,13 +423,25 @@ class ZMQ_sink(Process):
 
 
 class ZMQ_manager(Process):
-    def __init__(self,idx,queue_size,group_name,evt_quit,**kwargs):
+    def __init__(self,idx,queue_size,group_name,evt_quit,dispatch=DISPATCH_PUB,host=None,metrics=None,out_queue=None,
+                 priorities=1,priority_policy='strict',priority_weights=None,**kwargs):
         super(ZMQ_manager, self).__init__(**kwargs)
+        # sink queue , router : requests of a dead worker are reported there as RS_LOST
+        self.out_queue = out_queue
+        self._metrics = metrics
+        self._stat = None
         self.group_name = group_name
+        self.host = host
+        self.dispatch = dispatch
         self.request_id = 0
         self.idx = idx
 
+        self.queue_size = queue_size
+        # items : (request_id,identity,frames,deadline,t_put,priority) , frames None cancels request_id ,
+        # request_id None stops identity , or reports it dead when frames is its worker index
         self.queue = Queue(queue_size)
+        # router : requests waiting for worker credits are taken by priority , see priority.py
+        self.priority = Priority_selector(priorities,priority_policy,priority_weights)
         self.evt_quit = evt_quit
         self.locker = MyLock()
         self.addr = None
@@ -188,20 +454,65 @@ class ZMQ_manager(Process):
     def wait_init(self):
         self.addr = self.queue.get()
 
-    def put(self,identity,msg):
+    def put(self,identity,frames,on_request=None,on_full=None,block=True,deadline=None,request_id=None,priority=0):
+        # request_id : a request sent again keeps its id
+        if request_id is None:
+            self.locker.acquire()
+            self.request_id += 1
+            request_id = self.request_id
+            self.locker.release()
+        # register before the request can be answered
+        if on_request is not None:
+            on_request(request_id)
+        try:
+            self.queue.put((request_id,identity,frames,deadline,time.time(),priority),block=block)
+        except queue.Full:
+            if on_full is not None:
+                on_full(request_id)
+            raise
+        return request_id
+
+    def put_many(self,identity_list,frames_list,on_requests=None,deadline=None,priority=0):
+        '''
+            blocking , the whole list is one queue item
+        '''
         self.locker.acquire()
-        self.request_id += 1
-        request_id = self.request_id
+        request_ids = list(range(self.request_id + 1,self.request_id + 1 + len(frames_list)))
+        self.request_id += len(frames_list)
         self.locker.release()
-        self.queue.put((request_id,identity,msg))
-        return request_id
+        if on_requests is not None:
+            on_requests(request_ids)
+        t_put = time.time()
+        self.queue.put([(request_id,identity,frames,deadline,t_put,priority) for request_id,identity,frames in zip(request_ids,identity_list,frames_list)])
+        return request_ids
+
+    def cancel(self,request_id):
+        self.queue.put((request_id,None,None,None,None,0))
+
+    def retire(self,identity):
+        # after every request queued to identity (pub)
+        self.queue.put((None,identity,None,None,None,0))
+
+    def worker_died(self,identity,idx):
+        # router , drop identity and report the requests it held
+        self.queue.put((None,identity,idx,None,None,0))
+
+    def _get_requests(self,block=True,timeout=None):
+        # an item is one request or the list of a put_many
+        item = self.queue.get(block=block,timeout=timeout)
+        return item if isinstance(item,list) else [item]
 
     def __processinit__(self):
         self.context = zmq.Context()
-        self.sender = self.context.socket(zmq.PUB)
+        if self.dispatch == DISPATCH_ROUTER:
+            self.sender = self.context.socket(zmq.ROUTER)
+            # fail loudly instead of dropping a message to an unknown worker
+            self.sender.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        else:
+            self.sender = self.context.socket(zmq.XPUB)
         self.sender.setsockopt(zmq.LINGER, 0)
         # self.sender.bind('tcp://*:{}'.format(self.port))
-        self.addr = auto_bind(self.sender)
+        self.addr = auto_bind(self.sender,self.host)
         self.queue.put(self.addr)
 
     def _remove_signal(self):
@@ -210,6 +521,155 @@ class ZMQ_manager(Process):
             del self.signal
             self.signal = None
 
+    def _on_dispatch(self,t_put,is_dropped=False):
+        if self._stat is None:
+            return
+        if is_dropped:
+            self._stat.add('dropped')
+        else:
+            self._stat.add('dispatched')
+            self._stat.observe('dispatch_wait_us',(time.time() - t_put) * 1e6)
+
+    def _recv_credit(self,credits,timeout):
+        while self.sender.poll(timeout):
+            identity,b_n = self.sender.recv_multipart()
+            timeout = 0
+            # a stopped worker still returns the credits of its last requests
+            if identity in self._retired:
+                continue
+            n = int.from_bytes(b_n,byteorder='little',signed=False)
+            credits[identity] = credits.get(identity,0) + n
+            # a worker takes its requests in order , a credit finishes the oldest one
+            sent = self._sent.get(identity,None)
+            while n and sent:
+                sent.popleft()
+                n -= 1
+
+    def _retire_router(self,identity,credits):
+        self._retired.add(identity)
+        credits.pop(identity,None)
+        self.sender.send_multipart([identity,b'',STOP_TOPIC])
+
+    def _worker_died(self,identity,idx,credits):
+        self._retired.add(identity)
+        credits.pop(identity,None)
+        for request_id in self._sent.pop(identity,()):
+            self.out_queue.put((request_id,idx,0,None,ResponseState.RS_LOST))
+
+    def _cancel_router(self,request_id,pending,credits):
+        for item in pending:
+            if item[0] == request_id:
+                pending.remove(item)
+                self._on_dispatch(item[4],is_dropped=True)
+                return
+        # already sent , every worker may hold it
+        b_request_id = request_id.to_bytes(4,byteorder='little',signed=False)
+        for identity in credits:
+            try:
+                self.sender.send_multipart([identity,b'',CANCEL_TOPIC,b_request_id])
+            except zmq.ZMQError:
+                # the worker is gone
+                pass
+
+    def _send_router(self,pending,credits):
+        while pending and any(credits.values()):
+            item = pending.popleft()
+            request_id,_,frames,deadline,t_put,_ = item
+            if deadline is not None and time.time() > deadline:
+                self._on_dispatch(t_put,is_dropped=True)
+                continue
+            identity = max(credits,key=credits.get)
+            credits[identity] -= 1
+            credits.move_to_end(identity)
+            # DEALER gets [b'',request_id,deadline,*frames] , same layout as the SUB side
+            try:
+                self.sender.send_multipart([identity,b'',request_id.to_bytes(4,byteorder='little',signed=False),
+                                            pack_deadline(deadline)] + frames,copy=False)
+            except zmq.ZMQError:
+                # ROUTER_MANDATORY , the worker is gone , its credits with it
+                credits.pop(identity,None)
+                pending.appendleft(item)
+                continue
+            if self.out_queue is not None:
+                self._sent.setdefault(identity,deque()).append(request_id)
+            self._on_dispatch(t_put)
+
+    def _run_router(self):
+        # worker -> credits left , the one with most credits has the fewest requests in flight
+        credits = OrderedDict()
+        pending = Priority_deque(self.priority,lambda item: item[5])
+        self._retired = set()
+        # identity -> request_ids sent and not credited back , kept when requests of a dead worker are reported
+        self._sent = {}
+        while not self.evt_quit.is_set():
+            if pending and any(credits.values()):
+                self._send_router(pending,credits)
+                self._recv_credit(credits,0)
+                continue
+            # every worker busy : requests wait here (at most queue_size , then in the queue) , cancels still pass
+            if len(pending) < self.queue_size:
+                try:
+                    requests = self._get_requests(block=not pending,timeout=0.1)
+                except queue.Empty:
+                    requests = []
+                if self.__is_closed:
+                    break
+                for item in requests:
+                    if item[0] is None and item[2] is not None:
+                        self._worker_died(item[1],item[2],credits)
+                    elif item[0] is None:
+                        self._retire_router(item[1],credits)
+                    elif item[2] is None:
+                        self._cancel_router(item[0],pending,credits)
+                    else:
+                        pending.append(item)
+            self._recv_credit(credits,100 if pending and not any(credits.values()) else 0)
+
+    def _send_pub(self,item):
+        request_id,identity,frames,deadline,t_put,_ = item
+        if request_id is None:
+            if frames is None:
+                self.sender.send_multipart([identity,STOP_TOPIC])
+            return
+        b_request_id = request_id.to_bytes(4,byteorder='little',signed=False)
+        if frames is None:
+            self.sender.send_multipart([CANCEL_TOPIC,CANCEL_TOPIC,b_request_id])
+        elif deadline is None or time.time() <= deadline:
+            self.sender.send_multipart([identity,b_request_id,pack_deadline(deadline)] + frames,copy=False)
+            self._on_dispatch(t_put)
+        else:
+            self._on_dispatch(t_put,is_dropped=True)
+
+    def _run_pub(self):
+        subscribed = set()
+        # identity -> items for a worker whose subscription has not arrived yet (starting , remote) , sent in order once it does
+        held = OrderedDict()
+        while not self.evt_quit.is_set():
+            try:
+                requests = self._get_requests(timeout=0.01 if held else None)
+            except queue.Empty:
+                requests = []
+            if self.__is_closed:
+                break
+            recv_subscriptions(self.sender,subscribed)
+            for identity in [identity for identity in held if identity in subscribed]:
+                for item in held.pop(identity):
+                    self._send_pub(item)
+            for item in requests:
+                request_id,identity,frames = item[:3]
+                if request_id is not None and frames is None:
+                    # cancel , a held request is dropped here , workers get the broadcast
+                    for items in held.values():
+                        for held_item in items:
+                            if held_item[0] == request_id:
+                                items.remove(held_item)
+                                self._on_dispatch(held_item[4],is_dropped=True)
+                                break
+                elif identity not in subscribed:
+                    held.setdefault(identity,[]).append(item)
+                    continue
+                self._send_pub(item)
+
     def release(self):
         try:
             self._remove_signal()
@@ -224,14 +684,15 @@ class ZMQ_manager(Process):
 
     def run(self):
         self.__processinit__()
+        if self._metrics is not None:
+            self._stat = self._metrics.writer('manager',self.idx)
         logger.debug('group {} manager bind {}'.format(self.group_name,self.addr))
         try:
             self.signal.wait()
-            while not self.evt_quit.is_set():
-                request_id,identity,msg = self.queue.get()
-                if self.__is_closed:
-                    break
-                self.sender.send_multipart([identity,msg, request_id.to_bytes(4,byteorder='little',signed=False)])
+            if self.dispatch == DISPATCH_ROUTER:
+                self._run_router()
+            else:
+                self._run_pub()
         except KeyboardInterrupt:
             ...
         except Exception as e:
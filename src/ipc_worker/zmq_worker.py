@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/18 21:00
+# @Author  : tk
+
+'''
+    start workers on this host for a running IPC_zmq group (transport='tcp')
+    python -m ipc_worker.zmq_worker --connect tcp://host:port --cls mymod.MyWorker [--args '[1,"a"]'] [--num 2]
+'''
+
+import argparse
+import importlib
+import json
+import multiprocessing
+from .utils import logger
+from .zmq_module.ipc_zmq_registry import register_worker
+
+
+def load_class(path):
+    module_name, cls_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), cls_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ipc_worker.zmq_worker')
+    parser.add_argument('--connect', required=True, help='registry address of the group , IPC_zmq.registry_addr')
+    parser.add_argument('--cls', required=True, help='worker class , module.Class (subclass of ZMQ_process_worker)')
+    parser.add_argument('--args', default='[]', help='json list , worker_args of the class')
+    parser.add_argument('--num', type=int, default=1, help='worker processes to start')
+    args = parser.parse_args(argv)
+
+    CLS_worker = load_class(args.cls)
+    worker_args = tuple(json.loads(args.args))
+    evt_quit = multiprocessing.Event()
+    worker_lst = []
+    for _ in range(args.num):
+        options = register_worker(args.connect)
+        addr_sink = options.pop('addr_sink')
+        addr_pub = options.pop('addr_pub')
+        options['identity'] = options['identity'].encode('utf-8')
+        worker = CLS_worker(*worker_args, evt_quit=evt_quit, **options)
+        worker._set_addr(addr_sink, addr_pub)
+        worker.start()
+        logger.info('worker {} connected to {}'.format(options['idx'], addr_pub))
+        worker_lst.append(worker)
+    try:
+        for worker in worker_lst:
+            worker.join()
+    except KeyboardInterrupt:
+        evt_quit.set()
+        for worker in worker_lst:
+            worker.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:55
+# @Author  : tk
+
+import asyncio
+
+import pytest
+
+from tests.workers import started
+
+
+@pytest.fixture(scope='module', params=['shm', 'zmq'])
+def instance(request):
+    with started(request.param) as instance:
+        yield instance
+
+
+def test_call(instance):
+    async def main():
+        return await asyncio.gather(*[instance.call(i) for i in range(50)])
+
+    assert asyncio.run(main()) == list(range(50))
+
+
+def test_stream(instance):
+    async def main():
+        chunks = [x async for x in instance.stream({'n': 5})]
+        # a plain result is yielded once
+        single = [x async for x in instance.stream('one')]
+        return chunks, single
+
+    assert asyncio.run(main()) == ([0, 1, 2, 3, 4], ['one'])
+
+
+def test_stream_break(instance):
+    async def main():
+        async for x in instance.stream({'n': 100}):
+            if x == 2:
+                break
+        return await instance.call('after')
+
+    assert asyncio.run(main()) == 'after'
+    assert instance.stats()['queue']['listeners'] == 0
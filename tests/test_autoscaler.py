@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 13:10
+# @Author  : tk
+
+import time
+
+import pytest
+
+from ipc_worker.autoscaler import Autoscaler
+from tests.workers import started
+
+
+class Fake_instance:
+    def __init__(self, worker_num=1):
+        self.worker_num = worker_num
+        self.queue = {}
+        self.busy_us = 0
+
+    def stats(self):
+        return {'queue': dict(self.queue),
+                'workers': [{'idx': i, 'busy_us': self.busy_us} for i in range(self.worker_num)]}
+
+    def add_workers(self, n=1):
+        self.worker_num += n
+
+    def remove_workers(self, n=1, timeout=None):
+        self.worker_num -= n
+
+
+def test_desired_queue_depth():
+    scaler = Autoscaler(Fake_instance(2), min_workers=1, max_workers=4, target_queue_depth=5)
+    assert scaler.desired({'queue': {'input': 12}}) == 3
+    # requests held by workers count , unread responses do not
+    assert scaler.desired({'queue': {'input': 0, 'requests': 14, 'unread': 4}}) == 2
+    assert scaler.desired({'queue': {'input': 100}}) == 4
+    assert scaler.desired({'queue': {}}) == 1
+
+
+def test_desired_utilisation():
+    instance = Fake_instance(2)
+    scaler = Autoscaler(instance, min_workers=1, max_workers=8, target_utilisation=0.5)
+    assert scaler.desired(instance.stats(), now=100) is None
+    # both workers busy the whole second , twice the target
+    instance.busy_us = 1e6
+    assert scaler.desired(instance.stats(), now=101) == 4
+    assert scaler.desired(instance.stats(), now=102) == 1
+
+
+def test_step_hysteresis():
+    instance = Fake_instance(1)
+    scaler = Autoscaler(instance, min_workers=1, max_workers=4, target_queue_depth=1, cooldown=0.2)
+    instance.queue = {'input': 3}
+    scaler.step()
+    assert instance.worker_num == 3
+    # within cooldown of the last change
+    instance.queue = {'input': 4}
+    scaler.step()
+    assert instance.worker_num == 3
+    time.sleep(0.25)
+    scaler.step()
+    assert instance.worker_num == 4
+    # a smaller pool must be wanted for cooldown seconds first
+    time.sleep(0.25)
+    instance.queue = {}
+    scaler.step()
+    assert instance.worker_num == 4
+    instance.queue = {'input': 4}
+    scaler.step()
+    instance.queue = {}
+    scaler.step()
+    time.sleep(0.1)
+    scaler.step()
+    assert instance.worker_num == 4
+    time.sleep(0.15)
+    scaler.step()
+    assert instance.worker_num == 1
+
+
+@pytest.mark.parametrize('backend', ['shm', 'shm_ring', 'zmq', 'zmq_router', 'zmq_direct'])
+def test_add_remove_workers(backend):
+    with started(backend, worker_num=1, max_worker_num=3) as instance:
+        assert instance.add_workers(2) == [1, 2] and instance.worker_num == 3
+        with pytest.raises(ValueError):
+            instance.add_workers()
+        futures = [instance.submit({'sleep': 0.01}) for _ in range(30)]
+        assert len({f.result(30) for f in futures}) == 3
+        # the newest first , one always stays
+        assert instance.remove_workers(5, timeout=10) == [2, 1] and instance.worker_num == 1
+        assert [instance.submit(i).result(30) for i in range(10)] == list(range(10))
+        assert instance.add_workers() == [1]
+        assert instance.submit('again').result(30) == 'again'
+
+
+def test_autoscale():
+    with started('shm', worker_num=1, max_worker_num=3) as instance:
+        instance.autoscale(min_workers=1, max_workers=3, target_queue_depth=2, cooldown=0, interval=0.05)
+        futures = [instance.submit({'sleep': 0.05}) for _ in range(60)]
+        deadline = time.time() + 10
+        while instance.worker_num < 3:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        [f.result(30) for f in futures]
+        # idle again , back to min_workers
+        while instance.worker_num > 1:
+            assert time.time() < deadline + 10
+            time.sleep(0.01)
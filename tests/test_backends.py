@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:45
+# @Author  : tk
+
+import pytest
+
+from tests.workers import started
+
+BACKENDS = ['shm', 'zmq', 'zmq_router', 'zmq_direct']
+
+
+@pytest.fixture(scope='module', params=BACKENDS)
+def instance(request):
+    with started(request.param) as instance:
+        yield instance
+
+
+def test_put_get(instance):
+    for i in range(20):
+        request_id = instance.put({'a': i})
+        assert instance.get(request_id, timeout=30) == {'a': i}
+
+
+def test_submit(instance):
+    futures = [instance.submit(i) for i in range(50)]
+    assert [f.result(30) for f in futures] == list(range(50))
+
+
+def test_nothing_left(instance):
+    futures = [instance.submit(i) for i in range(10)]
+    [f.result(30) for f in futures]
+    assert instance.stats()['queue']['requests'] == 0
+
+
+def test_put_many(instance):
+    request_ids = instance.put_many(range(50))
+    assert request_ids == list(range(request_ids[0], request_ids[0] + 50))
+    assert instance.get_many(request_ids, timeout=30) == list(range(50))
+    futures = instance.submit_many(['a', 'b', 'c'])
+    assert [f.result(30) for f in futures] == ['a', 'b', 'c']
+    assert [f.request_id for f in futures] == list(range(futures[0].request_id, futures[0].request_id + 3))
+
+
+def test_map(instance):
+    assert list(instance.map(range(100))) == list(range(100))
+    assert list(instance.map(range(100), chunksize=7, max_pending=10)) == list(range(100))
+    assert sorted(instance.map(range(100), ordered=False, chunksize=16)) == list(range(100))
+    assert list(instance.map([])) == []
+
+
+def test_stream(instance):
+    assert list(instance.iter_results(instance.put({'n': 5}), timeout=30)) == [0, 1, 2, 3, 4]
+    request_id = instance.put({'n': 3})
+    # the end of the stream is None
+    assert [instance.get(request_id, seq_id, timeout=30) for seq_id in (1, 2, 3, 4)] == [0, 1, 2, None]
+    request_ids = [instance.put({'n': 100}) for _ in range(4)]
+    assert [list(instance.iter_results(request_id, timeout=30)) for request_id in reversed(request_ids)] == [list(range(100))] * 4
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:45
+# @Author  : tk
+
+import pytest
+
+from tests.workers import create, started
+
+
+@pytest.mark.parametrize('backend', ['shm_ring', 'zmq'])
+def test_run_batch(backend):
+    with started(backend, worker_num=1, batch=True, max_batch_size=4, max_wait_ms=50) as instance:
+        futures = [instance.submit(i) for i in range(40)]
+        results = [f.result(30) for f in futures]
+        # every result goes back to its own request
+        assert [r for _, r in results] == list(range(40))
+        sizes = [n for n, _ in results]
+        assert max(sizes) <= 4 and max(sizes) > 1
+
+
+@pytest.mark.parametrize('backend', ['shm_ring', 'zmq'])
+def test_default_run_batch(backend):
+    # run_once per request , streams included
+    with started(backend, worker_num=1, max_batch_size=4, max_wait_ms=10) as instance:
+        request_ids = [instance.put({'n': 3}) for _ in range(4)] + [instance.put('a')]
+        assert [list(instance.iter_results(request_id, timeout=30)) for request_id in request_ids[:4]] == [[0, 1, 2]] * 4
+        assert instance.get(request_ids[-1], timeout=30) == 'a'
+
+
+def test_batch_needs_ring():
+    with pytest.raises(AssertionError):
+        create('shm', max_batch_size=4)
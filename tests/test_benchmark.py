@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:05
+# @Author  : tk
+
+import json
+
+from ipc_worker.benchmark.runner import percentiles, iter_cases, run_case, compare, CASE_KEYS
+from ipc_worker.benchmark.__main__ import parse_size, main
+
+
+def test_parse_size():
+    assert [parse_size(s) for s in ('64', '1k', '1.5K', '64m', '2g')] == [64, 1024, 1536, 64 << 20, 2 << 30]
+
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    p = percentiles([i / 1000 for i in range(1, 101)])
+    assert p['p50'] == 51 and p['p99'] == 100 and p['max'] == 100
+    assert abs(p['mean'] - 50.5) < 1e-9
+
+
+def test_iter_cases():
+    cases = list(iter_cases(['shm', 'zmq'], [64], [1], [1, 2], [1], ['unary'], [None, 'block']))
+    assert all(set(case) == set(CASE_KEYS) for case in cases)
+    # zmq has one manager and no wait strategy , its duplicates are dropped
+    assert [(c['backend'], c['manager_num'], c['wait_strategy']) for c in cases] == [
+        ('shm', 1, None), ('shm', 1, 'block'), ('shm', 2, None), ('shm', 2, 'block'), ('zmq', 1, None)]
+
+
+def test_run_case():
+    result = run_case('shm', 256, requests=40, warmup=5, threads=2, call='stream', chunks=4)
+    assert result['errors'] == 0 and result['requests'] == 40
+    assert result['throughput'] > 0 and result['latency_ms']['p50'] > 0
+    assert result['first_chunk_ms']['p50'] <= result['latency_ms']['max']
+    assert set(result['cpu_s']) == {'client', 'workers', 'managers'}
+    assert result['stats']['workers']
+
+
+def _report(throughput, p99):
+    return dict(results=[dict(backend='shm', payload=64, worker_num=1, manager_num=1, threads=1, call='unary',
+                              wait_strategy=None, throughput=throughput, latency_ms=dict(p99=p99))])
+
+
+def test_compare(tmp_path):
+    assert not compare(_report(1000, 1.0), _report(950, 1.05))[0][-1]
+    assert compare(_report(1000, 1.0), _report(800, 1.0))[0][-1]
+    assert compare(_report(1000, 1.0), _report(1000, 1.5))[0][-1]
+    base, new = tmp_path / 'base.json', tmp_path / 'new.json'
+    base.write_text(json.dumps(_report(1000, 1.0)))
+    new.write_text(json.dumps(_report(1000, 1.0)))
+    assert main(['compare', str(base), str(new)]) == 0
+    new.write_text(json.dumps(_report(500, 1.0)))
+    assert main(['compare', str(base), str(new)]) == 1
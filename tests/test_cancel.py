@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 12:50
+# @Author  : tk
+
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+from ipc_worker.shm_module.ipc_shm_cancel import SHM_cancel
+from tests.workers import shm_name, started
+
+
+@pytest.fixture
+def cancel():
+    c = SHM_cancel(shm_name('cancel'), entry_num=8)
+    yield c
+    c.close()
+    c.unlink()
+
+
+def test_cancel_table(cancel):
+    assert not cancel.is_dead(1)
+    cancel.set_deadline(1, 0)
+    assert not cancel.is_dead(1)
+    cancel.cancel(1)
+    assert cancel.is_dead(1)
+    # a new request in the same entry is not cancelled , the old one no longer is either
+    cancel.set_deadline(9, 0)
+    assert not cancel.is_dead(9) and not cancel.is_dead(1)
+    # cancelled before its entry was written
+    cancel.cancel(17)
+    assert cancel.is_dead(17) and not cancel.is_dead(9)
+
+
+def test_cancel_deadline(cancel):
+    cancel.set_deadline(2, time.time() + 0.05)
+    assert not cancel.is_dead(2)
+    time.sleep(0.06)
+    assert cancel.is_dead(2)
+    cancel.set_deadline(3, time.time() - 1)
+    assert cancel.is_dead(3)
+
+
+BACKENDS = ['shm', 'shm_ring', 'zmq', 'zmq_router', 'zmq_direct']
+
+
+@pytest.fixture(scope='module', params=BACKENDS)
+def instance(request):
+    with started(request.param, worker_num=1) as instance:
+        yield instance
+
+
+def test_deadline(instance):
+    slow = instance.submit({'sleep': 0.5})
+    # expire while queued behind the slow request
+    expired = [instance.submit(i, deadline=time.time() + 0.1) for i in range(3)]
+    for f in expired:
+        with pytest.raises(TimeoutError):
+            f.result(10)
+    slow.result(10)
+    assert instance.submit('after', deadline=time.time() + 10).result(10) == 'after'
+    assert instance.stats()['queue']['requests'] == 0
+
+
+def test_cancel_running(instance):
+    seen = instance.submit({'seen': 1}).result(10)
+    future = instance.submit({'spin': 5})
+    time.sleep(0.2)
+    assert instance.cancel(future.request_id)
+    assert not instance.cancel(future.request_id)
+    with pytest.raises(CancelledError):
+        future.result(10)
+    # the worker saw is_cancelled() and gave up early
+    t = time.time()
+    assert instance.submit({'seen': 1}).result(10) == seen + 1
+    assert time.time() - t < 3
+
+
+def test_cancel_stream(instance):
+    request_id = instance.put({'n': 100000})
+    assert [instance.get(request_id, seq_id, timeout=10) for seq_id in (1, 2)] == [0, 1]
+    assert instance.cancel(request_id)
+    with pytest.raises(CancelledError):
+        instance.get(request_id, 3, timeout=10)
+    assert instance.submit('next').result(30) == 'next'
+    assert instance.stats()['queue']['requests'] == 0
@@ -4,7 +4,6 @@
 import multiprocessing
 import os
 import signal
-import torch
 from ipc_worker import logger
 from ipc_worker.ipc_zmq_loader import IPC_zmq, ZMQ_process_worker
 
@@ -33,8 +32,6 @@ class My_worker(ZMQ_process_worker):
     # any data put will trigger this func
     def run_once(self, request_data):
         # process request_data
-        print(torch.cuda.device_count(), torch.cuda.current_device())
-
         if isinstance(request_data, dict):
             request_data['b'] = 200
         if self.handle is not None:
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 13:00
+# @Author  : tk
+
+import pickle
+import time
+import urllib.request
+
+import pytest
+
+from ipc_worker.metrics import SHM_metrics, bucket_index, bucket_upper, record_run, prometheus_text, HIST_BUCKETS
+from tests.workers import shm_name, started
+
+
+def test_buckets():
+    assert [bucket_index(v) for v in range(8)] == list(range(8))
+    # every value falls in a bucket whose upper bound is within 1/8 above it
+    for v in list(range(8, 5000)) + [10 ** 6, 10 ** 9, 123456789]:
+        i = bucket_index(v)
+        assert bucket_upper(i - 1) < v <= bucket_upper(i) <= v * 1.125 + 1
+    assert bucket_index(1 << 62) == HIST_BUCKETS - 1
+    assert bucket_index(-5) == 0
+
+
+@pytest.fixture
+def metrics():
+    m = SHM_metrics(shm_name('metrics'), worker_num=2, manager_num=1)
+    yield m
+    m.unlink()
+
+
+def test_snapshot(metrics):
+    w = metrics.writer('worker', 1)
+    record_run(w, [100, 200, 300], 0.01)
+    for us in range(1, 101):
+        w.observe('run_us', us)
+    metrics.writer('manager', 0).add('dispatched', 5)
+    assert metrics.writer('worker', 2) is None
+    s = metrics.snapshot()
+    assert [d['requests'] for d in s['workers']] == [0, 3] and s['managers'][0]['dispatched'] == 5
+    run_us = s['workers'][1]['run_us']
+    assert run_us['count'] == 101 and run_us['max'] == 10000
+    assert 50 <= run_us['p50'] <= 57 and 90 <= run_us['p90'] <= 101
+    assert s['workers'][1]['payload_bytes']['mean'] == 200
+    assert s['workers'][1]['busy_ratio'] > 0 and s['workers'][0]['busy_ratio'] == 0
+
+
+def test_restart_keeps_section(metrics):
+    w = metrics.writer('worker', 0)
+    w.add('requests', 2)
+    # a restarted worker opens the same section , counters and the start time carry on
+    other = pickle.loads(pickle.dumps(metrics))
+    w2 = other.writer('worker', 0)
+    w2.add('requests')
+    s = metrics.snapshot()['workers'][0]
+    assert s['requests'] == 3 and s['busy_ratio'] == 0
+    other.unlink()
+
+
+def test_prometheus_text():
+    stats = {'queue': {'input': 2}, 'workers': [{'idx': 0, 'requests': 7, 'busy_ratio': 0.5,
+                                                 'run_us': {'count': 2, 'mean': 10, 'p50': 8, 'p90': 12, 'p99': 12, 'max': 12}}]}
+    text = prometheus_text(stats, 'g')
+    assert '# TYPE ipc_worker_queue_input gauge\nipc_worker_queue_input{group="g"} 2\n' in text
+    assert 'ipc_worker_worker_requests{group="g",worker="0"} 7' in text
+    assert '# TYPE ipc_worker_worker_busy_ratio gauge' in text
+    assert 'ipc_worker_worker_run_us{group="g",worker="0",quantile="0.5"} 8' in text
+    assert 'ipc_worker_worker_run_us_sum{group="g",worker="0"} 20' in text
+
+
+@pytest.mark.parametrize('backend', ['shm', 'zmq'])
+def test_stats(backend):
+    with started(backend) as instance:
+        futures = [instance.submit(i) for i in range(30)]
+        [f.result(30) for f in futures]
+        # a worker counts a request once its response is out
+        deadline = time.time() + 10
+        while sum(w['requests'] for w in instance.stats()['workers']) < 30:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        s = instance.stats()
+        assert sum(w['requests'] for w in s['workers']) == 30 and all(0 <= w['busy_ratio'] <= 1 for w in s['workers'])
+        assert sum(m['dispatched'] for m in s['managers']) == 30
+        assert s['queue']['requests'] == 0
+        host, port = instance.start_metrics_server()
+        with urllib.request.urlopen('http://{}:{}/metrics'.format(host, port), timeout=10) as r:
+            assert 'ipc_worker_worker_requests' in r.read().decode('utf-8')
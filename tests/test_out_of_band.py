@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:25
+# @Author  : tk
+
+import pickle
+
+import pytest
+
+from ipc_worker.serializer import dumps_frames, loads_frames, pack_frames, unpack_frames, packed_size, OOB_THRESHOLD
+from ipc_worker.shm_module.ipc_shm_queue import SHM_queue
+from tests.workers import shm_name, started
+
+
+def test_dumps_frames():
+    small, big = bytearray(b's' * 10), bytearray(b'b' * OOB_THRESHOLD)
+    frames = dumps_frames({'small': pickle.PickleBuffer(small), 'big': pickle.PickleBuffer(big), 'inband': big})
+    # only the large buffer leaves the pickle stream
+    assert len(frames) == 2 and bytes(frames[1]) == bytes(big)
+    obj = loads_frames(frames)
+    assert bytes(obj['small']) == bytes(small) and bytes(obj['big']) == bytes(big) and obj['inband'] == big
+
+
+def test_pack_frames():
+    frames = [b'head', bytearray(b'x' * 100), b'']
+    buf = bytearray(packed_size(frames))
+    assert pack_frames(buf, 0, frames) == len(buf)
+    views = unpack_frames(buf)
+    assert [bytes(v) for v in views] == [bytes(f) for f in frames]
+    # views , not copies
+    buf[packed_size(frames[:1])] = ord('y')
+    assert bytes(views[1][:1]) == b'y'
+
+
+def test_queue_out_of_band():
+    q = SHM_queue(shm_name('queue'), maxsize=4, data_size=1024)
+    try:
+        data = bytearray(b'oob' * 50)
+        q.put(pickle.PickleBuffer(data))
+        assert bytes(q.get()) == bytes(data)
+    finally:
+        q.close()
+        q.unlink()
+
+
+@pytest.mark.parametrize('backend', ['shm', 'shm_ring', 'zmq'])
+def test_buffer_echo(backend):
+    kwargs = dict(shm_size=1 << 20) if backend.startswith('shm') else {}
+    with started(backend, **kwargs) as instance:
+        data = bytearray(range(256)) * 1024
+        assert instance.submit(data).result(30) == data
+        assert bytes(instance.submit({'key': pickle.PickleBuffer(data)}).result(30)['key']) == bytes(data)
+
+
+def test_numpy_echo():
+    np = pytest.importorskip('numpy')
+    with started('shm', shm_size=1 << 20) as instance:
+        a = np.arange(100000, dtype=np.float32)
+        assert (instance.submit(a).result(30) == a).all()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:40
+# @Author  : tk
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, CancelledError
+
+import pytest
+
+from ipc_worker.response_dispatcher import Response_dispatcher, Reorder_buffer, ResponseState
+
+
+@pytest.fixture
+def dispatcher():
+    responses = queue.Queue()
+    d = Response_dispatcher(responses.get)
+    d.start()
+    d.responses = responses
+    yield d
+    d.stop()
+    d.join(1)
+
+
+def _wait(fn, timeout=2):
+    deadline = time.time() + timeout
+    while not fn():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def _is_idle(dispatcher):
+    return not any(dispatcher.depth().values())
+
+
+def test_dispatcher_get(dispatcher):
+    dispatcher.add_request(1)
+    dispatcher.responses.put((1, 0, 0, 'r1', ResponseState.RS_DATA))
+    assert dispatcher.get(1, timeout=2) == 'r1'
+    # finished , nothing kept
+    assert _is_idle(dispatcher)
+    dispatcher.add_request(2)
+    with pytest.raises(TimeoutError):
+        dispatcher.get(2, timeout=0.05)
+
+
+def test_dispatcher_future(dispatcher):
+    futures = [Future() for _ in range(3)]
+    for request_id, future in enumerate(futures):
+        dispatcher.add_request(request_id, future=future)
+    for request_id in reversed(range(3)):
+        dispatcher.responses.put((request_id, 0, 0, 'r{}'.format(request_id), ResponseState.RS_DATA))
+    assert [f.result(2) for f in futures] == ['r0', 'r1', 'r2']
+    _wait(lambda: _is_idle(dispatcher))
+
+
+def test_dispatcher_threads(dispatcher):
+    # every caller waits on its own request , responses arrive in reverse order
+    results = {}
+
+    def caller(request_id):
+        results[request_id] = dispatcher.get(request_id, timeout=5)
+
+    for request_id in range(8):
+        dispatcher.add_request(request_id)
+    threads = [threading.Thread(target=caller, args=(request_id,)) for request_id in range(8)]
+    for t in threads:
+        t.start()
+    for request_id in reversed(range(8)):
+        dispatcher.responses.put((request_id, 0, 0, request_id * 10, ResponseState.RS_DATA))
+    for t in threads:
+        t.join()
+    assert results == {request_id: request_id * 10 for request_id in range(8)}
+
+
+def test_dispatcher_listener(dispatcher):
+    items = []
+    done = threading.Event()
+
+    def listener(seq_id, response, state):
+        items.append((seq_id, response, state))
+        if state == ResponseState.RS_END:
+            done.set()
+
+    dispatcher.add_request(1, listener=listener)
+    dispatcher.responses.put((1, 0, 1, 'a', ResponseState.RS_DATA))
+    dispatcher.responses.put((1, 0, 2, None, ResponseState.RS_END))
+    assert done.wait(2)
+    assert items == [(1, 'a', ResponseState.RS_DATA), (2, None, ResponseState.RS_END)]
+    _wait(lambda: _is_idle(dispatcher))
+    # removed before the end , later responses are dropped
+    dispatcher.add_request(2, listener=listener)
+    dispatcher.remove_listener(2)
+    dispatcher.responses.put((2, 0, 1, 'b', ResponseState.RS_DATA))
+    time.sleep(0.05)
+    assert len(items) == 2 and _is_idle(dispatcher)
+
+
+def test_dispatcher_error(dispatcher):
+    dispatcher.add_request(1)
+    dispatcher.responses.put((1, 0, 0, ValueError('bad'), ResponseState.RS_ERROR))
+    with pytest.raises(ValueError):
+        dispatcher.get(1, timeout=2)
+    future = Future()
+    dispatcher.add_request(2, future=future)
+    dispatcher.responses.put((2, 0, 0, KeyError('bad'), ResponseState.RS_ERROR))
+    with pytest.raises(KeyError):
+        future.result(2)
+    _wait(lambda: _is_idle(dispatcher))
+
+
+def test_reorder_buffer():
+    buffer = Reorder_buffer([(3, 'c', 0), (1, 'a', 0)])
+    buffer.extend([(2, 'b', 0)])
+    assert 2 in buffer and len(buffer) == 3
+    assert buffer.items() == [(1, 'a', 0), (2, 'b', 0), (3, 'c', 0)]
+    assert buffer.pop(2) == (2, 'b', 0)
+    # the heap entry of 2 is skipped
+    assert buffer.pop() == (1, 'a', 0)
+    assert buffer.pop() == (3, 'c', 0)
+    assert buffer.pop() is None and buffer.pop(5) is None and len(buffer) == 0
+
+
+def test_dispatcher_stream_order(dispatcher):
+    dispatcher.add_request(1)
+    for seq_id in (3, 1, 4, 2):
+        dispatcher.responses.put((1, 0, seq_id, seq_id * 10 if seq_id < 4 else None,
+                                  ResponseState.RS_DATA if seq_id < 4 else ResponseState.RS_END))
+    assert list(dispatcher.iter_results(1, timeout=2)) == [10, 20, 30]
+    assert _is_idle(dispatcher)
+
+
+def test_dispatcher_deadline(dispatcher):
+    future = Future()
+    dispatcher.add_request(1, future=future, deadline=time.time() + 0.05)
+    dispatcher.add_request(2, deadline=time.time() + 0.05)
+    dispatcher.add_request(3, deadline=time.time() + 5)
+    with pytest.raises(TimeoutError):
+        future.result(2)
+    with pytest.raises(TimeoutError):
+        dispatcher.get(2, timeout=2)
+    # a late response is dropped
+    dispatcher.responses.put((1, 0, 0, 'late', ResponseState.RS_DATA))
+    dispatcher.responses.put((3, 0, 0, 'r3', ResponseState.RS_DATA))
+    assert dispatcher.get(3, timeout=2) == 'r3'
+    assert dispatcher.depth()['requests'] == 0
+
+
+def test_dispatcher_close(dispatcher):
+    future = Future()
+    dispatcher.add_request(1, future=future)
+    dispatcher.add_request(2)
+    assert dispatcher.cancel(1)
+    assert not dispatcher.cancel(1)
+    with pytest.raises(CancelledError):
+        future.result(2)
+    # a stream stops at the close
+    dispatcher.responses.put((2, 0, 1, 'a', ResponseState.RS_DATA))
+    _wait(lambda: dispatcher.depth()['unread'] == 1)
+    assert dispatcher.close_request(2, RuntimeError('closed'))
+    with pytest.raises(RuntimeError):
+        list(dispatcher.iter_results(2, timeout=2))
+    assert dispatcher.fail_pending(RuntimeError('x')) == []
+    dispatcher.add_request(3)
+    assert dispatcher.fail_pending(RuntimeError('down')) == [3]
+    with pytest.raises(RuntimeError):
+        dispatcher.get(3, timeout=2)
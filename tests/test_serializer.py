@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 12:35
+# @Author  : tk
+
+import pytest
+
+from ipc_worker.serializer import get_codec, Codec, Pickle_codec, Raw_codec
+from tests.workers import started
+
+
+def test_pickle_codec():
+    codec = get_codec('pickle')
+    assert isinstance(codec, Pickle_codec) and get_codec(codec) is codec
+    assert codec.loads(codec.dumps({'a': [1, 2]})) == {'a': [1, 2]}
+    assert codec.loads_list(codec.dumps_list(iter([1, 'b']))) == [1, 'b']
+
+
+def test_raw_codec():
+    codec = get_codec('raw')
+    data = memoryview(b'abc')
+    assert codec.dumps(data) == [data] and codec.loads([b'abc']) == b'abc'
+    # one frame per chunk
+    assert codec.dumps_list([b'a', bytearray(b'b')]) == [b'a', bytearray(b'b')]
+    assert codec.loads_list([b'a', b'b']) == [b'a', b'b']
+    with pytest.raises(TypeError):
+        codec.dumps('text')
+
+
+def test_msgpack_codec():
+    pytest.importorskip('msgpack')
+    codec = get_codec('msgpack')
+    assert codec.loads(codec.dumps({'a': [1, b'x']})) == {'a': [1, b'x']}
+
+
+def test_bad_codec():
+    with pytest.raises(ValueError):
+        get_codec('json')
+    assert Codec.name is None
+
+
+@pytest.mark.parametrize('backend', ['shm', 'shm_ring', 'zmq', 'zmq_direct'])
+def test_raw_e2e(backend):
+    with started(backend, codec='raw') as instance:
+        for size in (0, 10, 100000):
+            data = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+            assert bytes(instance.submit(data).result(30)) == data
+
+
+def test_mixed_codecs():
+    # pickled requests , raw responses
+    with started('shm', request_codec='pickle', response_codec='raw') as instance:
+        assert bytes(instance.submit(b'abc').result(30)) == b'abc'
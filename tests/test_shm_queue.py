@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:30
+# @Author  : tk
+
+import multiprocessing
+import random
+from queue import Empty, Full
+
+import pytest
+
+from ipc_worker.shm_module.ipc_shm_queue import SHM_queue
+from tests.workers import shm_name
+
+
+@pytest.fixture
+def queue():
+    q = SHM_queue(shm_name('queue'), maxsize=4, data_size=1024)
+    yield q
+    q.close()
+    q.unlink()
+
+
+def test_queue_full_empty(queue):
+    with pytest.raises(Empty):
+        queue.get_nowait()
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+    for i in range(4):
+        queue.put(i)
+    assert queue.full() and queue.qsize() == 4
+    with pytest.raises(Full):
+        queue.put_nowait(4)
+    with pytest.raises(Full):
+        queue.put(4, timeout=0.01)
+    assert [queue.get() for _ in range(4)] == [0, 1, 2, 3]
+    assert queue.empty()
+
+
+def test_queue_bytes_limit(queue):
+    with pytest.raises(ValueError):
+        queue.put(b'x' * 2048)
+    # maxsize not reached , the data area is
+    queue.put(b'x' * 600)
+    with pytest.raises(Full):
+        queue.put_nowait(b'y' * 600)
+    assert queue.get() == b'x' * 600
+    queue.put_nowait(b'y' * 600)
+    assert queue.get() == b'y' * 600
+
+
+def test_queue_wrap(queue):
+    rnd = random.Random(1)
+    sent = []
+    got = []
+    for i in range(200):
+        item = (i, b'z' * rnd.randint(0, 300))
+        while True:
+            try:
+                queue.put_nowait(item)
+                sent.append(item)
+                break
+            except Full:
+                got.append(queue.get())
+    while not queue.empty():
+        got.append(queue.get())
+    assert got == sent
+
+
+def _producer(q, p, n):
+    for i in range(n):
+        q.put((p, i, b'p' * (i % 97)))
+
+
+def _consumer(q, out, n):
+    items = []
+    for _ in range(n):
+        p, i, payload = q.get(timeout=30)
+        assert payload == b'p' * (i % 97)
+        items.append((p, i))
+    out.put(items)
+
+
+def test_queue_producers_consumers(queue):
+    producers, consumers, n = 3, 3, 300
+    out = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_producer, args=(queue, p, n)) for p in range(producers)] + \
+            [multiprocessing.Process(target=_consumer, args=(queue, out, n)) for _ in range(consumers)]
+    for p in procs:
+        p.start()
+    results = [out.get(timeout=60) for _ in range(consumers)]
+    for p in procs:
+        p.join(10)
+        assert p.exitcode == 0
+    # every item once , each consumer sees the items of one producer in put order
+    assert sorted(x for items in results for x in items) == sorted((p, i) for p in range(producers) for i in range(n))
+    for items in results:
+        for p in range(producers):
+            seen = [i for q, i in items if q == p]
+            assert seen == sorted(seen)
+    assert queue.empty()
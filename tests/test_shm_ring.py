@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:20
+# @Author  : tk
+
+import struct
+import threading
+
+import pytest
+
+from ipc_worker.shm_module.ipc_utils_func import C_ringdata
+from tests.workers import shm_name, started
+
+
+@pytest.fixture
+def ring():
+    r = C_ringdata(shm_name('ring'), create=True, size=64 + 2 * 3 * 512, slot_num=3)
+    yield r
+    r.close()
+    r.shm.unlink()
+
+
+def _bytes(frames):
+    return [bytes(f) for f in frames]
+
+
+def test_ring_request_wrap(ring):
+    seq = 0
+    # head and tail go around the 3 slots several times
+    for _ in range(5):
+        for i in range(ring.slot_num):
+            assert ring.push_request(seq + i, [b'r%d' % (seq + i)])
+        assert not ring.push_request(99, [b'x'])
+        assert ring.request_free() == 0
+        assert [(r_id, _bytes(frames)) for r_id, frames in ring.peek_requests(5)] == \
+               [(seq + i, [b'r%d' % (seq + i)]) for i in range(ring.slot_num)]
+        for i in range(ring.slot_num):
+            r_id, frames = ring.peek_request()
+            assert (r_id, _bytes(frames)) == (seq + i, [b'r%d' % (seq + i)])
+            ring.finish_request()
+        assert ring.peek_request() is None
+        seq += ring.slot_num
+    assert struct.unpack_from('2q', ring.buf, 8) == (seq, seq)
+
+
+def test_ring_response_interleaved(ring):
+    # one slot in , one slot out , tail stays ahead of head across the wrap
+    assert ring.push_response(0, 1, 0, 0, [b'a'])
+    for i in range(1, 10):
+        assert ring.push_response(i, 1, i, 0, [b'a', b'%d' % i])
+        request_id, worker_id, seq_id, flag, frames = ring.peek_response()
+        assert (request_id, worker_id, seq_id) == (i - 1, 1, i - 1)
+        ring.finish_response()
+        assert ring.response_pending() == 1
+    ring.finish_response()
+    assert ring.peek_response() is None
+
+
+def test_ring_capacity(ring):
+    with pytest.raises(ValueError):
+        ring.push_request(1, [b'x' * (ring.capacity + 1)])
+
+
+def test_ring_instance():
+    with started('shm_ring', worker_num=2, manager_num=2) as instance:
+        results = {}
+
+        def client(k):
+            results[k] = [instance.get(instance.put((k, i)), timeout=30) for i in range(50)]
+
+        threads = [threading.Thread(target=client, args=(k,)) for k in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {k: [(k, i) for i in range(50)] for k in range(4)}
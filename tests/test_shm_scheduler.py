@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:55
+# @Author  : tk
+
+import time
+
+import pytest
+
+from ipc_worker.shm_module.ipc_shm_scheduler import SHM_scheduler, get_policy
+from tests.workers import shm_name, started
+
+
+def test_policies():
+    assert get_policy('least_outstanding', 3).select([1, 0, 1], 2, 2) == 1
+    # ties go round from the cursor
+    assert get_policy('least_outstanding', 3).select([1, 1, 1], 2, 2) == 2
+    assert get_policy('round_robin', 3).select([2, 1, 0], 2, 0) == 1
+    assert get_policy('round_robin', 3).select([2, 2, 2], 2, 0) is None
+    weighted = get_policy('weighted', 3, [3, 1])
+    assert weighted.weights == [3, 1, 1]
+    assert weighted.select([2, 0, 0], 4, 0) == 0 and weighted.select([3, 0, 0], 4, 0) == 1
+    with pytest.raises(ValueError):
+        get_policy('fastest', 3)
+
+
+
+
+@pytest.fixture
+def scheduler():
+    s = SHM_scheduler(shm_name('sched'), worker_num=3, capacity=2)
+    yield s
+    s.close()
+    s.unlink()
+
+
+def test_scheduler_acquire_capacity(scheduler):
+    taken = [scheduler.acquire(timeout=0.1) for _ in range(6)]
+    assert sorted(taken) == [0, 0, 1, 1, 2, 2]
+    assert scheduler.loads() == [2, 2, 2]
+    t = time.time()
+    assert scheduler.acquire(timeout=0.05) is None
+    assert time.time() - t >= 0.04
+    scheduler.release(1)
+    assert scheduler.acquire(timeout=0.1) == 1
+    for i in taken:
+        scheduler.release(i)
+    assert scheduler.loads() == [0, 0, 0]
+    # release below zero is ignored
+    scheduler.release(0)
+    assert scheduler.loads() == [0, 0, 0]
+
+
+
+@pytest.mark.parametrize('scheduler', ['least_outstanding', 'round_robin', 'weighted'])
+def test_scheduler_e2e(scheduler):
+    with started('shm', worker_num=3, scheduler=scheduler, worker_weights=[2, 1, 1]) as instance:
+        futures = [instance.submit(i) for i in range(60)]
+        assert [f.result(30) for f in futures] == list(range(60))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:35
+# @Author  : tk
+
+import pytest
+
+from ipc_worker.shm_module.ipc_shm_spill import SHM_spill, Spill_handle
+from tests.workers import shm_name, started
+
+
+@pytest.fixture
+def spill():
+    prefix = shm_name('spill')
+    writer, reader = SHM_spill(prefix, max_idle=1), SHM_spill(prefix)
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def test_spill_alloc_reuse(spill):
+    writer, reader = spill
+    buf = bytearray(256)
+    frames = [b'a' * 1000, b'b' * 3000]
+    assert writer.pack_into(buf, 0, [b'small'], 200) < 200
+    assert [bytes(f) for f in SHM_spill.unpack_from(buf, 0)] == [b'small']
+
+    writer.pack_into(buf, 0, frames, 200)
+    handle = SHM_spill.unpack_from(buf, 0)
+    assert isinstance(handle, Spill_handle)
+    views = reader.frames(handle)
+    assert [bytes(f) for f in views] == frames
+    for v in views:
+        v.release()
+    reader.release(handle)
+
+    # the block went back to the writer , the next spill takes it
+    writer.pack_into(buf, 0, frames, 200)
+    assert SHM_spill.unpack_from(buf, 0).name == handle.name
+    # still in use , a new block
+    writer.pack_into(buf, 0, frames, 200)
+    other = SHM_spill.unpack_from(buf, 0)
+    assert other.name != handle.name
+    reader.discard(handle)
+    reader.discard(other)
+
+
+def test_spill_discard_and_trim(spill):
+    writer, reader = spill
+    handles = [writer.spill([b'c' * 100]) for _ in range(3)]
+    assert len({h.name for h in handles}) == 3
+    for h in handles:
+        reader.discard(h)
+    # one block reused , max_idle=1 keeps one more , the rest is unlinked
+    writer.spill([b'd'])
+    assert len(writer._pool) == 2
+
+
+
+@pytest.mark.parametrize('backend', ['shm', 'shm_ring'])
+def test_spill_e2e(backend):
+    with started(backend, shm_size=4096) as instance:
+        data = b'x' * 100000
+        # larger than a slot both ways , then small again so the blocks are reused
+        for _ in range(5):
+            assert instance.submit(data).result(30) == data
+            assert instance.submit(b'small').result(30) == b'small'
+        assert list(instance.iter_results(instance.put({'n': 3}), timeout=30)) == [0, 1, 2]
+
+
+def test_encode_error():
+    with started('shm') as instance:
+        # the codec fails before anything is registered or queued
+        for _ in range(3):
+            with pytest.raises(Exception):
+                instance.submit(lambda: 0)
+        assert instance.stats()['queue']['requests'] == 0
+        assert instance.submit('ok').result(30) == 'ok'
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:15
+# @Author  : tk
+
+import time
+
+import pytest
+
+from ipc_worker.stream_utils import Stream_writer
+from tests.workers import started
+
+
+def _slow(n, sleep=0.0):
+    for i in range(n):
+        if sleep:
+            time.sleep(sleep)
+        yield i
+
+
+def test_writer_plain():
+    sent = []
+    assert Stream_writer(lambda seq_id, chunks: sent.append((seq_id, chunks))).run(_slow(3)) == 3
+    assert sent == [(1, [0]), (2, [1]), (3, [2])]
+
+
+def test_writer_coalesce():
+    sent = []
+    writer = Stream_writer(lambda seq_id, chunks: sent.append((seq_id, chunks)), coalesce_ms=200, coalesce_num=4)
+    assert writer.run(_slow(10)) == 10
+    # packed by at most 4 , seq_id of a transfer is that of its first chunk
+    assert [c for _, chunks in sent for c in chunks] == list(range(10))
+    assert all(len(chunks) <= 4 for _, chunks in sent) and len(sent) < 10
+    assert [seq_id for seq_id, _ in sent] == [1 + sum(len(c) for _, c in sent[:i]) for i in range(len(sent))]
+
+
+def test_writer_cancel():
+    sent = []
+    n = Stream_writer(lambda seq_id, chunks: sent.append(chunks)).run(_slow(100), is_cancelled=lambda: len(sent) >= 3)
+    assert n == 3
+
+
+def test_writer_error():
+    def send_fn(seq_id, chunks):
+        raise IOError('closed')
+
+    with pytest.raises(IOError):
+        Stream_writer(send_fn, coalesce_ms=10).run(_slow(50))
+
+
+@pytest.mark.parametrize('backend,kwargs', [
+    ('shm', dict(stream_coalesce_ms=5)),
+    ('shm_ring', dict(stream_credit=2)),
+    ('shm_ring', dict(stream_credit=2, stream_coalesce_ms=5, stream_coalesce_num=8)),
+    ('zmq', dict(stream_coalesce_ms=5)),
+])
+def test_stream(backend, kwargs):
+    with started(backend, **kwargs) as instance:
+        request_ids = [instance.put({'n': 200}) for _ in range(3)]
+        for request_id in request_ids:
+            assert list(instance.iter_results(request_id, timeout=30)) == list(range(200))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 13:20
+# @Author  : tk
+
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from ipc_worker.response_dispatcher import WorkerDiedError
+from ipc_worker.supervisor import Restart_backoff
+from tests.workers import started
+
+BACKENDS = ['shm', 'shm_ring', 'zmq', 'zmq_router', 'zmq_direct']
+
+
+def test_restart_backoff():
+    backoff = Restart_backoff(base=0.5, max_delay=2, min_uptime=10)
+    # the first crash restarts at once , quick crashes again double the delay
+    assert [backoff.delay('w0', 1) for _ in range(5)] == [0, 0.5, 1, 2, 2]
+    # a long run resets it
+    assert backoff.delay('w0', 60) == 0 and backoff.delay('w0', 1) == 0
+    assert backoff.delay('w1', 1) == 0
+
+
+def _wait_alive(instance, n, timeout=20):
+    deadline = time.time() + timeout
+    while sum(w.is_alive() for w in instance.woker_process_list) < n:
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+@pytest.fixture(params=BACKENDS)
+def instance(request):
+    kwargs = dict(manager_num=2) if request.param.startswith('shm') else {}
+    with started(request.param, max_retries=1, supervise_interval=0.1, **kwargs) as instance:
+        yield instance
+
+
+def test_retry(instance, tmp_path):
+    # dies once , the retry on the new worker succeeds
+    assert isinstance(instance.submit({'kill': str(tmp_path / 'flaky')}).result(30), int)
+    # dies on every try
+    with pytest.raises(WorkerDiedError):
+        instance.submit({'kill': None}).result(30)
+    # a chunk already reached the client , no retry
+    with pytest.raises(WorkerDiedError):
+        list(instance.iter_results(instance.put({'die_stream': 1}), timeout=30))
+    _wait_alive(instance, 2)
+    assert [instance.submit(i).result(30) for i in range(20)] == list(range(20))
+    assert instance.stats()['queue']['requests'] == 0
+
+
+def test_kill_under_load(instance):
+    errors = []
+
+    def load():
+        try:
+            for i in range(100):
+                assert instance.submit(i).result(30) == i
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    os.kill(instance.woker_process_list[0].pid, signal.SIGKILL)
+    for t in threads:
+        t.join()
+    # requests of the dead worker were sent again
+    assert errors == []
+    _wait_alive(instance, 2)
+
+
+def test_manager_restart():
+    with started('shm', manager_num=2, supervise_interval=0.1) as instance:
+        manager = instance.manager_process_list[0]
+        os.kill(manager.pid, signal.SIGKILL)
+        deadline = time.time() + 20
+        while not instance.manager_process_list[0].is_alive() or instance.manager_process_list[0].pid == manager.pid:
+            assert time.time() < deadline
+            time.sleep(0.05)
+        assert [instance.submit(i).result(30) for i in range(40)] == list(range(40))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 11:05
+# @Author  : tk
+
+import multiprocessing
+
+import pytest
+
+from ipc_worker.shm_module.ipc_utils_func import C_sharedata
+from ipc_worker.shm_module.ipc_wait import Shm_word, atomic_available
+from tests.workers import shm_name, started
+
+
+def _bump(name, lock, n):
+    s = C_sharedata(name=name, create=False)
+    word = Shm_word(s.buf, 0, lock)
+    for _ in range(n):
+        word.fetch_add(1)
+    del word
+    s.close()
+
+
+def test_fetch_add_processes():
+    # the bell is bumped by the client and by every worker at once , no add may be lost
+    name = shm_name('word')
+    s = C_sharedata(name=name, create=True, size=64)
+    lock = None if atomic_available() else multiprocessing.Lock()
+    try:
+        procs = [multiprocessing.Process(target=_bump, args=(name, lock, 5000)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(60)
+        assert Shm_word(s.buf, 0).get() == 4 * 5000
+    finally:
+        s.close()
+        s.shm.unlink()
+
+
+@pytest.mark.parametrize('wait_strategy', ['spin', 'yield', 'block'])
+def test_wait_strategy(wait_strategy):
+    with started('shm_ring', wait_strategy=wait_strategy) as instance:
+        futures = [instance.submit(i) for i in range(100)]
+        assert [f.result(30) for f in futures] == list(range(100))
+        assert list(instance.iter_results(instance.put({'n': 5}), timeout=30)) == list(range(5))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 12:15
+# @Author  : tk
+
+from queue import Full
+
+import pytest
+
+from tests.workers import started
+
+
+@pytest.mark.parametrize('dispatch', ['pub', 'router'])
+def test_direct(dispatch):
+    with started('zmq_direct', dispatch=dispatch) as instance:
+        futures = [instance.submit({'a': i}) for i in range(100)]
+        assert [f.result(30) for f in futures] == [{'a': i} for i in range(100)]
+        request_ids = [instance.put({'n': 20}) for _ in range(3)]
+        for request_id in request_ids:
+            assert list(instance.iter_results(request_id, timeout=30)) == list(range(20))
+        assert instance.stats()['queue']['requests'] == 0
+
+
+def test_direct_full():
+    queue_size = 4
+    with started('zmq_direct', worker_num=1, dispatch='router', queue_size=queue_size) as instance:
+        instance.submit({'sleep': 1.0})
+        # the worker is busy , requests pile up in the client until put refuses them
+        with pytest.raises(Full):
+            for _ in range(20 * queue_size):
+                instance._put({'sleep': 0}, block=False)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 12:05
+# @Author  : tk
+
+import pytest
+
+from tests.workers import started
+
+
+@pytest.mark.parametrize('prefetch', [1, 2])
+def test_router_stream(prefetch):
+    with started('zmq_router', prefetch=prefetch) as instance:
+        request_ids = [instance.put({'n': 50}) for _ in range(4)]
+        for request_id in request_ids:
+            assert list(instance.iter_results(request_id, timeout=30)) == list(range(50))
+
+
+def test_router_load_aware():
+    # a busy worker asks for nothing , short requests go to the free one
+    with started('zmq_router', prefetch=1) as instance:
+        slow = instance.submit({'sleep': 1.0})
+        fast = [instance.submit({'sleep': 0}) for _ in range(10)]
+        pids = {f.result(30) for f in fast}
+        assert not slow.done()
+        assert slow.result(30) not in pids
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 12:25
+# @Author  : tk
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from ipc_worker.serializer import Pickle_codec
+from tests.workers import started
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('direct', [False, True])
+def test_remote_workers(direct):
+    with started('zmq_router', worker_num=1, transport='tcp', direct=direct) as instance:
+        assert instance.registry_addr.startswith('tcp://')
+        # two workers of another "host" join through the registry
+        p = subprocess.Popen([sys.executable, '-m', 'ipc_worker.zmq_worker', '--connect', instance.registry_addr,
+                              '--cls', 'tests.workers.Echo_zmq_worker', '--num', '2'],
+                             cwd=ROOT, start_new_session=True)
+        try:
+            deadline = time.time() + 30
+            pids = set()
+            while len(pids) < 3:
+                assert time.time() < deadline
+                pids |= {f.result(30) for f in [instance.submit({'sleep': 0.02}) for _ in range(12)]}
+            assert list(instance.iter_results(instance.put({'n': 30}), timeout=30)) == list(range(30))
+        finally:
+            os.killpg(p.pid, signal.SIGKILL)
+            p.wait()
+
+
+class Own_codec(Pickle_codec):
+    name = None
+
+
+def test_remote_needs_codec_name():
+    # a remote worker builds its codec by name
+    with started('zmq_router', worker_num=1, transport='tcp', codec=Own_codec()) as instance:
+        with pytest.raises(ValueError):
+            instance._on_register({})
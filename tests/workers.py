@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19 10:15
+# @Author  : tk
+
+'''
+    workers and instances of the end to end tests , module level so that worker processes find them
+'''
+import contextlib
+import itertools
+import os
+import pickle
+import random
+import signal
+import tempfile
+import time
+
+import pytest
+
+from ipc_worker.ipc_shm_loader import IPC_shm, SHM_process_worker
+
+try:
+    from ipc_worker.ipc_zmq_loader import IPC_zmq, ZMQ_process_worker
+except ImportError:
+    IPC_zmq = ZMQ_process_worker = None
+
+_ids = itertools.count()
+# ipc sockets of the zmq instances go to the temp dir instead of the working directory
+os.environ.setdefault('ZEROMQ_SOCK_TMP_DIR', tempfile.gettempdir())
+
+
+def shm_name(tag):
+    # unique per test run , shared memory names are global
+    return 'test_{}_{}_{}'.format(tag, os.getpid(), random.randint(0, 1 << 30))
+
+
+def _die_stream():
+    yield 1
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def reply(worker, request_data):
+    # {'n': n} streams 0 .. n-1 , {'sleep': s} returns the worker pid after s seconds ,
+    # {'spin': s} runs up to s seconds or until cancelled , {'seen': 1} returns how many spins saw their cancel ,
+    # {'kill': path} kills the worker unless path exists (then creates it) , {'kill': None} always ,
+    # {'die_stream': 1} yields once then kills the worker ,
+    # anything else is echoed , out of band buffers of a dict go back out of band
+    if isinstance(request_data, dict):
+        if 'n' in request_data:
+            return (i for i in range(request_data['n']))
+        if 'sleep' in request_data:
+            time.sleep(request_data['sleep'])
+            return os.getpid()
+        if 'spin' in request_data:
+            deadline = time.time() + request_data['spin']
+            while time.time() < deadline:
+                if worker.is_cancelled():
+                    worker.cancel_seen = getattr(worker, 'cancel_seen', 0) + 1
+                    return None
+                time.sleep(0.01)
+            return os.getpid()
+        if 'seen' in request_data:
+            return getattr(worker, 'cancel_seen', 0)
+        if 'kill' in request_data:
+            path = request_data['kill']
+            if path is None or not os.path.exists(path):
+                if path is not None:
+                    open(path, 'w').close()
+                os.kill(os.getpid(), signal.SIGKILL)
+            return os.getpid()
+        if 'die_stream' in request_data:
+            return _die_stream()
+        return {k: pickle.PickleBuffer(v) if isinstance(v, memoryview) else v for k, v in request_data.items()}
+    return request_data
+
+
+class Echo_shm_worker(SHM_process_worker):
+    def run_begin(self):
+        pass
+
+    def run_end(self):
+        pass
+
+    def run_once(self, request_data):
+        return reply(self, request_data)
+
+
+class Batch_shm_worker(Echo_shm_worker):
+    def run_batch(self, request_list):
+        return [(len(request_list), r) for r in request_list]
+
+
+if ZMQ_process_worker is not None:
+    class Echo_zmq_worker(ZMQ_process_worker):
+        def run_begin(self):
+            pass
+
+        def run_end(self):
+            pass
+
+        def run_once(self, request_data):
+            return reply(self, request_data)
+
+    class Batch_zmq_worker(Echo_zmq_worker):
+        def run_batch(self, request_list):
+            return [(len(request_list), r) for r in request_list]
+
+
+def create(backend, worker_num=2, batch=False, **kwargs):
+    '''
+        backend : shm | shm_ring | zmq | zmq_router | zmq_direct , skipped without pyzmq
+        batch : run_batch replies (batch size , request) instead of the echo
+    '''
+    group_name = 'test_{}_{}_{}'.format(backend, os.getpid(), next(_ids))
+    if backend.startswith('shm'):
+        if backend == 'shm_ring':
+            kwargs.setdefault('slot_num', 4)
+        kwargs.setdefault('manager_num', 1)
+        return IPC_shm(CLS_worker=Batch_shm_worker if batch else Echo_shm_worker, worker_args=(), worker_num=worker_num, group_name=group_name, **kwargs)
+    if IPC_zmq is None:
+        pytest.skip('pyzmq is not installed')
+    if backend == 'zmq_router':
+        kwargs.setdefault('dispatch', 'router')
+    elif backend == 'zmq_direct':
+        kwargs.setdefault('direct', True)
+    return IPC_zmq(CLS_worker=Batch_zmq_worker if batch else Echo_zmq_worker, worker_args=(), worker_num=worker_num, group_name=group_name, **kwargs)
+
+
+@contextlib.contextmanager
+def started(backend, **kwargs):
+    instance = create(backend, **kwargs)
+    instance.start()
+    try:
+        yield instance
+    finally:
+        instance.terminate()